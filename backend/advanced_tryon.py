@@ -1,72 +1,120 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
-import requests
-import io
-import base64
 from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
 import cv2
 import numpy as np
 import time
+from services.result_cache import get_result_cache
+from services.tryon_request import read_tryon_request, TryOnRequestError, image_response
+from services.image_encoding import negotiate_format, encode_image, variant_key
+from services.garment_fetcher import get_garment_fetcher
+from services.person_cache import cached_person_analysis
+from services.working_resolution import at_working_resolution, build_mask
+from services.image_io import decode_person, decode_garment, ImageTooLargeError
+from services.admission import add_flask_admission
+from services.profiling import add_flask_profiling
+from services.metrics import add_flask_metrics, stage_timer, timed
+from services.garment_store import get_garment_store, enhance_texture
+from services.tryon_jobs import tryon_job_queue, add_job_routes
+from services.progress import report_stage, report_preview
 
 app = Flask(__name__)
 CORS(app)
 
+# Request and per-stage metrics at GET /metrics
+add_flask_metrics(app, 'advanced_tryon')
+
+# Bounded concurrent try-ons: excess requests wait briefly, then get 429 + Retry-After
+add_flask_admission(app, 'advanced_tryon')
+
+# Opt-in cProfile/tracemalloc captures of sampled try-ons (admin token)
+add_flask_profiling(app, 'advanced_tryon')
+
+result_cache = get_result_cache()
+garment_fetcher = get_garment_fetcher()
+garment_store = get_garment_store()
+
 @app.route('/api/virtual-tryon', methods=['POST'])
 def virtual_tryon():
     try:
         print("Starting ULTRA-ADVANCED Virtual Try-On...")
-        data = request.get_json()
-        
-        person_b64 = data['person_image']
-        garment_url = data['garment_image']
-        product_info = data['product_info']
-        
-        print(f"Processing: {product_info.get('name', 'Unknown Product')}")
-        
-        # Convert person image
-        if person_b64.startswith('data:'):
-            person_b64 = person_b64.split(',')[1]
-        person_bytes = base64.b64decode(person_b64)
+        upload = read_tryon_request(request)
         
-        # Download garment image
-        print("Downloading garment image...")
-        garment_response = requests.get(garment_url, timeout=10)
-        garment_bytes = garment_response.content
+        # Output format from the Accept header (JPEG unless WebP/AVIF is asked for)
+        fmt = negotiate_format(request.headers.get('Accept'))
         
-        # Ultra-advanced simulation
-        print("Using ULTRA-ADVANCED simulation...")
-        result = ultra_advanced_tryon(person_bytes, garment_bytes, product_info)
-        
-        img_io = io.BytesIO()
-        result.save(img_io, 'JPEG', quality=95)
-        img_io.seek(0)
-        
-        return send_file(img_io, mimetype='image/jpeg')
+        return image_response(render_tryon(upload, fmt), fmt)
         
+    except TryOnRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print(f"ERROR: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def ultra_advanced_tryon(person_bytes, garment_bytes, product_info):
+def render_tryon(upload, fmt, budget=None):
+    """Encoded try-on result for an upload (no remote model here, so `budget` is unused)"""
+    person_bytes = upload.person_bytes
+    garment_url = upload.garment_url
+    product_info = upload.product_info
+    
+    print(f"Processing: {product_info.get('name', 'Unknown Product')}")
+    
+    # Serve retries of the same photo + garment from the result cache
+    cache_key = result_cache.make_key(person_bytes, upload.garment_ref, product_info,
+                                      engine='advanced_tryon', **variant_key(fmt, 'high'))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print("Result cache hit")
+        return cached
+    
+    # Download garment image
+    print("Downloading garment image...")
+    report_stage('download_garment')
+    garment_bytes = upload.garment_bytes if upload.garment_bytes is not None else garment_fetcher.fetch_bytes(garment_url)
+    
+    # Precomputed colour and texture for this catalog item
+    report_stage('garment_assets')
+    assets = garment_store.get_or_build(garment_store.asset_id_for(product_info, upload.garment_ref), garment_bytes)
+    
+    # Ultra-advanced simulation
+    print("Using ULTRA-ADVANCED simulation...")
+    result = ultra_advanced_tryon(person_bytes, garment_bytes, product_info, assets)
+    
+    report_stage('encode')
+    body = encode_image(result, fmt, 'high')
+    result_cache.put(cache_key, body)
+    return body
+
+# POST /api/jobs: try-ons on the queue's workers, with stage events for progress UIs
+job_queue = tryon_job_queue('advanced_tryon', render_tryon)
+add_job_routes(app, job_queue)
+
+def ultra_advanced_tryon(person_bytes, garment_bytes, product_info, assets=None):
     """Ultra-advanced virtual try-on with professional results"""
     
-    # Load images
-    person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-    garment_img = Image.open(io.BytesIO(garment_bytes)).convert('RGB')
-    
-    # Convert to numpy for advanced processing
-    person_np = np.array(person_img)
-    garment_np = np.array(garment_img)
+    # Decode once into RGB arrays
+    report_stage('decode')
+    person_np = decode_person(person_bytes)
+    if assets is not None:
+        garment_np = assets.rgb
+    else:
+        garment_np = decode_garment(garment_bytes)
     
     print(f"Person image: {person_np.shape}, Garment: {garment_np.shape}")
     
     # Step 1: Advanced body detection
+    report_stage('detect_body')
     body_info = detect_body_advanced(person_np)
     
     # Step 2: Intelligent garment fitting
-    fitted_result = fit_garment_intelligently(person_np, garment_np, body_info)
+    report_stage('apply_garment')
+    fitted_result = fit_garment_intelligently(person_np, garment_np, body_info, assets)
+    report_preview(fitted_result)
     
     # Step 3: Add professional effects
+    report_stage('overlay')
     final_result = add_professional_effects(fitted_result, body_info, product_info)
     
     # DEBUG: Save the result to see what we're generating
@@ -76,6 +124,9 @@ def ultra_advanced_tryon(person_bytes, garment_bytes, product_info):
     
     return Image.fromarray(final_result)
 
+@at_working_resolution
+@cached_person_analysis('advanced_tryon.body_info')
+@timed('detection')
 def detect_body_advanced(person_img):
     """Advanced body detection using multiple computer vision techniques"""
     
@@ -153,7 +204,7 @@ def detect_body_advanced(person_img):
         'original_mask': None
     }
 
-def fit_garment_intelligently(person_img, garment_img, body_info):
+def fit_garment_intelligently(person_img, garment_img, body_info, assets=None):
     """Create realistic shirt fitting with proper body contours"""
     
     result = person_img.copy()
@@ -162,40 +213,48 @@ def fit_garment_intelligently(person_img, garment_img, body_info):
     print(f"Creating realistic shirt fitting: {x}, {y}, {w}, {h}")
     
     # Create realistic shirt texture based on garment
-    shirt_texture = create_realistic_shirt_texture(garment_img, w, h, person_img[y:y+h, x:x+w])
+    shirt_texture = create_realistic_shirt_texture(garment_img, w, h, person_img[y:y+h, x:x+w], assets)
     
     # Create body-shaped mask
-    body_mask = create_body_shaped_mask(w, h)
+    # Built at working resolution and stretched: it is smooth, and the ROI can be 10+ MP
+    body_mask = build_mask(create_body_shaped_mask, w, h)
     
     # Apply the shirt with realistic body fitting
     roi = result[y:y+h, x:x+w]
     
     # Blend the shirt texture with body contours
-    for c in range(3):
-        result[y:y+h, x:x+w, c] = (
-            roi[:, :, c] * (1 - body_mask * 0.85) + 
-            shirt_texture[:, :, c] * body_mask * 0.85
-        ).astype(np.uint8)
+    with stage_timer('blend'):
+        for c in range(3):
+            result[y:y+h, x:x+w, c] = (
+                roi[:, :, c] * (1 - body_mask * 0.85) + 
+                shirt_texture[:, :, c] * body_mask * 0.85
+            ).astype(np.uint8)
     
     print(f"Realistic shirt fitting complete!")
     
     return result
 
-def create_realistic_shirt_texture(garment_img, w, h, person_roi):
+@timed('garment_fit')
+def create_realistic_shirt_texture(garment_img, w, h, person_roi, assets=None):
     """Create realistic shirt texture that fits the body"""
     
-    # Resize garment
-    garment_resized = cv2.resize(garment_img, (w, h), interpolation=cv2.INTER_LANCZOS4)
-    
-    # Get the dominant color from the garment (for white shirt, this will be white/light colors)
-    garment_color = np.mean(garment_resized, axis=(0, 1))
+    if assets is not None:
+        # Precomputed mean colour and detail-enhanced layer: only resize per request
+        garment_color = assets.mean_color
+        fabric_texture = extract_fabric_texture(None, assets.resized('enhanced', w, h))
+    else:
+        # Resize garment
+        garment_resized = cv2.resize(garment_img, (w, h), interpolation=cv2.INTER_LANCZOS4)
+        
+        # Get the dominant color from the garment (for white shirt, this will be white/light colors)
+        garment_color = np.mean(garment_resized, axis=(0, 1))
+        
+        # Add fabric texture from original garment
+        fabric_texture = extract_fabric_texture(garment_resized)
     
     # Create base shirt texture
     shirt_base = np.full((h, w, 3), garment_color, dtype=np.uint8)
     
-    # Add fabric texture from original garment
-    fabric_texture = extract_fabric_texture(garment_resized)
-    
     # Combine base color with texture
     shirt_texture = blend_color_and_texture(shirt_base, fabric_texture)
     
@@ -204,17 +263,14 @@ def create_realistic_shirt_texture(garment_img, w, h, person_roi):
     
     return shirt_with_lighting
 
-def extract_fabric_texture(garment):
-    """Extract fabric texture patterns from garment"""
-    
-    # Convert to grayscale to get texture
-    gray = cv2.cvtColor(garment, cv2.COLOR_RGB2GRAY)
+def extract_fabric_texture(garment, enhanced=None):
+    """Extract fabric texture patterns from garment (or an already enhanced garment)"""
     
     # Enhance texture details
-    texture = cv2.detailEnhance(garment, sigma_s=10, sigma_r=0.15)
+    texture = enhanced if enhanced is not None else enhance_texture(garment)
     
     # Add subtle fabric noise
-    noise = np.random.normal(0, 5, garment.shape).astype(np.float32)
+    noise = np.random.normal(0, 5, texture.shape).astype(np.float32)
     textured = np.clip(texture.astype(np.float32) + noise, 0, 255).astype(np.uint8)
     
     return textured
@@ -231,52 +287,40 @@ def add_body_lighting_effects(shirt_texture, person_roi):
     """Add realistic lighting effects based on body contours"""
     
     h, w = shirt_texture.shape[:2]
-    result = shirt_texture.copy()
     
     # Create lighting gradient (brighter in center, darker at edges)
     center_x, center_y = w // 2, h // 2
     
-    for y in range(h):
-        for x in range(w):
-            # Distance from center
-            dist_x = abs(x - center_x) / (w / 2)
-            dist_y = abs(y - center_y) / (h / 2)
-            
-            # Create lighting effect (brighter in center)
-            lighting_factor = 1.0 - (dist_x * 0.2 + dist_y * 0.1)
-            lighting_factor = max(0.7, min(1.3, lighting_factor))
-            
-            # Apply lighting
-            result[y, x] = np.clip(result[y, x] * lighting_factor, 0, 255).astype(np.uint8)
+    # Distance from center, per column and per row
+    dist_x = np.abs(np.arange(w) - center_x) / (w / 2)
+    dist_y = np.abs(np.arange(h) - center_y) / (h / 2)
     
-    return result
+    # Create lighting effect (brighter in center)
+    lighting_factor = 1.0 - (dist_x[None, :] * 0.2 + dist_y[:, None] * 0.1)
+    lighting_factor = np.clip(lighting_factor, 0.7, 1.3)
+    
+    # Apply lighting
+    return np.clip(shirt_texture * lighting_factor[:, :, None], 0, 255).astype(np.uint8)
 
 def create_body_shaped_mask(w, h):
     """Create realistic body-shaped mask"""
     
-    mask = np.zeros((h, w), dtype=np.float32)
     center_x = w // 2
     
-    for y in range(h):
-        progress = y / h
-        
-        # Natural body shape (wider shoulders, narrower waist)
-        if progress < 0.3:  # Shoulders
-            width_factor = 0.85
-        elif progress < 0.6:  # Chest to waist
-            width_factor = 0.75
-        else:  # Lower torso
-            width_factor = 0.8
-        
-        current_width = int(w * width_factor)
-        start_x = center_x - current_width // 2
-        end_x = center_x + current_width // 2
-        
-        # Create smooth gradient
-        for x in range(w):
-            if start_x <= x <= end_x:
-                dist_from_center = abs(x - center_x) / (current_width / 2)
-                mask[y, x] = max(0, 1 - dist_from_center ** 2)
+    # Natural body shape (wider shoulders, narrower waist), one value per row
+    progress = np.arange(h) / h
+    width_factor = np.where(progress < 0.3, 0.85,                # Shoulders
+                            np.where(progress < 0.6, 0.75, 0.8))  # Chest to waist, lower torso
+    current_width = (w * width_factor).astype(np.int64)[:, None]
+    start_x = center_x - current_width // 2
+    end_x = center_x + current_width // 2
+    
+    # Create smooth gradient
+    x = np.arange(w)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist_from_center = np.abs(x - center_x) / (current_width / 2)
+        gradient = np.maximum(0, 1 - dist_from_center ** 2)
+    mask = np.where((x >= start_x) & (x <= end_x), np.nan_to_num(gradient), 0).astype(np.float32)
     
     # Smooth the mask
     mask = cv2.GaussianBlur(mask, (15, 15), 5)
@@ -327,11 +371,16 @@ def match_colors_advanced_unused(garment, person_roi):
     
     return garment_textured
 
+@timed('overlay')
 def add_professional_effects(image, body_info, product_info):
     """Add professional visual effects"""
     
+    # Only the status band at the top is composited, not the whole frame
+    band_height = min(image.shape[0], 140)
+    result = image.copy()
+    
     # Convert to PIL for text overlay
-    result_pil = Image.fromarray(image)
+    result_pil = Image.fromarray(result[:band_height])
     
     # Add professional overlay
     overlay = Image.new('RGBA', result_pil.size, (0, 0, 0, 0))
@@ -359,8 +408,9 @@ def add_professional_effects(image, body_info, product_info):
     
     # Composite overlay
     result_pil = Image.alpha_composite(result_pil.convert('RGBA'), overlay).convert('RGB')
+    result[:band_height] = np.array(result_pil)
     
-    return np.array(result_pil)
+    return result
 
 if __name__ == '__main__':
     print("Starting ULTRA-ADVANCED Virtual Try-On System...")
@@ -0,0 +1,423 @@
+"""Wall time, CPU time and peak RSS of every try-on engine at 0.3, 2, 12 and 24 MP.
+
+The engines run on deterministic synthetic photos: a seeded, noisy figure
+with skin-toned head and arms and a light blue shirt, which is what the
+engines' detectors look for. Every run uses the same garment. The SHA-256 of
+each input is saved with the results.
+
+Each engine x size case runs in its own spawned process. Imports, caches and
+peak RSS from one case therefore do not leak into the next. A warm-up run
+(imports, cascades, model loading) is timed separately as `cold_ms`. The
+person analysis cache is cleared before every run, so detection is always
+timed. Per-stage wall and CPU time come from the engines' metrics stage
+timers (services/metrics.py). Stages can nest, so they do not add up to the
+total.
+
+Everything runs on the CPU without network access. The simulations are called
+directly and no remote model is contacted. When MediaPipe finds no pose, or
+its heavy model is not installed, PoseTryOnService measures its fallback
+overlay; the case notes say so. virtual_tryon_api still calls helpers that
+do not exist, and its failure is recorded as the case's error.
+
+With --baseline, these count as regressions: a case that used to pass and
+now fails, or a median wall time, CPU time or peak RSS that grew by more than
+--tolerance over the stored baseline. Cases with notes are only checked for
+failures. Regressions make the exit status 1.
+
+Usage (from the backend directory):
+    python -m benchmarks.engines --runs 5 --output engine_results.json
+    python -m benchmarks.engines --sizes 0.3mp,2mp --engines simple_backend,pose_tryon
+    python -m benchmarks.engines --save-baseline benchmarks/engine_baseline.json
+    python -m benchmarks.engines --baseline benchmarks/engine_baseline.json --tolerance 0.25
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Portrait photos, width x height
+SIZES = {
+    '0.3mp': (480, 640),
+    '2mp': (1224, 1632),
+    '12mp': (3000, 4000),
+    '24mp': (4240, 5656),
+}
+
+ENGINES = (
+    'simple_backend',
+    'virtual_tryon_api',
+    'huggingface_tryon',
+    'simple_dramatic_tryon',
+    'advanced_tryon',
+    'pose_tryon',
+)
+
+PRODUCT_INFO = {'id': 'bench-1', 'name': 'Benchmark shirt', 'subcategory': 'shirt', 'color': '#C82828'}
+
+SEED = 1
+
+# Growth below these is noise, whatever the relative change
+MIN_DELTA_MS = 5.0
+MIN_DELTA_MB = 10.0
+
+# Settings that change what the engines do, saved with the results
+CONFIG_VARS = ('TRYON_MAX_INPUT_SIDE', 'TRYON_MAX_INPUT_PIXELS', 'TRYON_WORKING_MAX_SIDE', 'OMP_NUM_THREADS')
+
+
+def _jpeg(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_person(width, height, seed=SEED):
+    """Synthetic person photo (JPEG bytes); the same bytes for the same size and seed"""
+    rng = np.random.default_rng(seed)
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    # Light wall, a little darker towards the floor
+    pixels[:] = np.linspace(232, 200, height, dtype=np.uint8)[:, None, None]
+
+    def box(x1, y1, x2, y2):
+        return (int(width * x1), int(height * y1)), (int(width * x2), int(height * y2))
+
+    skin = (224, 172, 140)
+    cv2.ellipse(pixels, (width // 2, int(height * 0.16)), (int(width * 0.09), int(height * 0.08)), 0, 0, 360, skin, -1)
+    cv2.rectangle(pixels, *box(0.46, 0.22, 0.54, 0.27), skin, -1)
+    cv2.rectangle(pixels, *box(0.18, 0.27, 0.28, 0.62), skin, -1)
+    cv2.rectangle(pixels, *box(0.72, 0.27, 0.82, 0.62), skin, -1)
+    cv2.rectangle(pixels, *box(0.27, 0.26, 0.73, 0.60), (120, 170, 220), -1)
+    cv2.rectangle(pixels, *box(0.30, 0.60, 0.49, 0.97), (40, 55, 90), -1)
+    cv2.rectangle(pixels, *box(0.51, 0.60, 0.70, 0.97), (40, 55, 90), -1)
+
+    # Sensor noise, in strips to keep the 24 MP temporaries small
+    for top in range(0, height, 512):
+        strip = pixels[top:top + 512]
+        noise = rng.integers(-6, 7, strip.shape, dtype=np.int16)
+        strip[:] = np.clip(strip + noise, 0, 255).astype(np.uint8)
+    return _jpeg(pixels)
+
+
+def make_garment(seed=SEED):
+    """Synthetic product shot of a striped red t-shirt on white (JPEG bytes)"""
+    rng = np.random.default_rng(seed + 1)
+    pixels = np.full((1024, 1024, 3), 255, dtype=np.uint8)
+    shirt = np.array([[312, 120], [712, 120], [930, 330], [810, 440], [740, 380],
+                      [740, 940], [284, 940], [284, 380], [214, 440], [94, 330]], dtype=np.int32)
+    cv2.fillPoly(pixels, [shirt], (200, 40, 40))
+    inside = pixels[:, :, 1] == 40
+    stripes = (np.arange(1024) // 40 % 2 == 0)[:, None] & inside
+    pixels[stripes] = (170, 30, 30)
+    noise = rng.integers(-4, 5, pixels.shape, dtype=np.int16)
+    return _jpeg(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+
+def build_engine(name, person_bytes, garment_bytes):
+    """Zero-argument callable running one try-on with `name`"""
+    from services.garment_store import GarmentAssetStore
+    from services.image_io import decode_person, decode_garment
+
+    if name == 'simple_backend':
+        import simple_backend
+        return lambda: simple_backend.process_tryon(
+            decode_person(person_bytes), decode_garment(garment_bytes), PRODUCT_INFO)
+
+    if name == 'virtual_tryon_api':
+        import virtual_tryon_api
+        return lambda: virtual_tryon_api.enhanced_virtual_tryon(person_bytes, garment_bytes, PRODUCT_INFO)
+
+    if name == 'pose_tryon':
+        import asyncio
+        from services.pose_tryon import PoseTryOnService
+        service = PoseTryOnService()
+        return lambda: asyncio.run(service.realistic_tryon(person_bytes, garment_bytes, PRODUCT_INFO))
+
+    # The Flask views take the garment's prebuilt assets from the garment store
+    assets = GarmentAssetStore(root=tempfile.mkdtemp(prefix='tryon_bench_assets_')).get_or_build('bench', garment_bytes)
+
+    if name == 'huggingface_tryon':
+        import huggingface_tryon
+        return lambda: huggingface_tryon.advanced_simulation_tryon(person_bytes, garment_bytes, PRODUCT_INFO, assets)
+
+    if name == 'simple_dramatic_tryon':
+        import simple_dramatic_tryon
+        return lambda: simple_dramatic_tryon.create_super_dramatic_tryon(person_bytes, garment_bytes, PRODUCT_INFO, assets)
+
+    if name == 'advanced_tryon':
+        import advanced_tryon
+        return lambda: advanced_tryon.ultra_advanced_tryon(person_bytes, garment_bytes, PRODUCT_INFO, assets)
+
+    raise ValueError(f"Unknown engine {name!r}")
+
+
+def engine_notes(name):
+    """Caveats about what a case measured on this machine"""
+    if name == 'pose_tryon':
+        import mediapipe
+        model = os.path.join(os.path.dirname(mediapipe.__file__), 'modules', 'pose_landmark', 'pose_landmark_heavy.tflite')
+        if not os.path.exists(model):
+            # MediaPipe downloads it on first use; offline, every run falls back
+            return ['heavy pose model not installed: measured the fallback overlay']
+    return []
+
+
+def _rss_mb(field):
+    """VmRSS / VmHWM of this process in MB, or None where /proc is not available"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Restart VmHWM from the current RSS (Linux); elsewhere the peak covers the whole process"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    peak = _rss_mb('VmHWM')
+    if peak is not None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def measure(engine, call):
+    """One run: wall and CPU time, per-stage totals, and the error if it failed"""
+    from services.metrics import run_collecting
+    from services.person_cache import get_person_cache
+
+    get_person_cache().clear()
+    stages = {}
+    error = None
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        _, samples = run_collecting(engine, call)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        samples = []
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    for _, stage, seconds, cpu_seconds in samples:
+        totals = stages.setdefault(stage, [0.0, 0.0])
+        totals[0] += seconds
+        totals[1] += cpu_seconds or 0.0
+    return {'wall': wall, 'cpu': cpu, 'stages': stages, 'error': error}
+
+
+def _median_ms(values):
+    return round(statistics.median(values) * 1000, 2)
+
+
+def run_case(engine, size, person_bytes, garment_bytes, runs):
+    """Benchmark one engine on one photo size; runs in a fresh process"""
+    # advanced_tryon saves debug_result.jpg to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='tryon_bench_'))
+    case = {'engine': engine, 'size': size, 'runs': runs}
+
+    try:
+        case['notes'] = engine_notes(engine)
+        call = build_engine(engine, person_bytes, garment_bytes)
+    except Exception as e:
+        return {**case, 'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+
+    cold = measure(engine, call)
+    case['cold_ms'] = round(cold['wall'] * 1000, 2)
+    if cold['error']:
+        return {**case, 'status': 'error', 'error': cold['error']}
+
+    rss_before = _rss_mb('VmRSS')
+    reset_peak_rss()
+    measurements = [measure(engine, call) for _ in range(runs)]
+    peak = peak_rss_mb()
+
+    errors = [m['error'] for m in measurements if m['error']]
+    if errors:
+        return {**case, 'status': 'error', 'error': errors[0]}
+
+    stage_names = sorted({stage for m in measurements for stage in m['stages']})
+    return {
+        **case,
+        'status': 'ok',
+        'wall_ms': _median_ms([m['wall'] for m in measurements]),
+        'cpu_ms': _median_ms([m['cpu'] for m in measurements]),
+        'wall_ms_runs': [round(m['wall'] * 1000, 2) for m in measurements],
+        'peak_rss_mb': round(peak, 1),
+        'rss_growth_mb': round(peak - rss_before, 1) if rss_before is not None else None,
+        'stages': {
+            stage: {
+                'wall_ms': _median_ms([m['stages'].get(stage, (0.0, 0.0))[0] for m in measurements]),
+                'cpu_ms': _median_ms([m['stages'].get(stage, (0.0, 0.0))[1] for m in measurements]),
+            }
+            for stage in stage_names
+        },
+    }
+
+
+def run_isolated(engine, size, person_bytes, garment_bytes, runs):
+    """run_case in its own spawned process; a crashed worker (e.g. out of memory) is reported, not raised"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        try:
+            return pool.submit(run_case, engine, size, person_bytes, garment_bytes, runs).result()
+        except BrokenProcessPool:
+            return {'engine': engine, 'size': size, 'runs': runs, 'status': 'crashed',
+                    'error': 'benchmark process died (out of memory?)'}
+
+
+def environment():
+    import PIL
+    versions = {'python': platform.python_version(), 'numpy': np.__version__,
+                'opencv': cv2.__version__, 'pillow': PIL.__version__}
+    try:
+        import mediapipe
+        versions['mediapipe'] = mediapipe.__version__
+    except ImportError:
+        versions['mediapipe'] = None
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions,
+        'config': {name: os.getenv(name) for name in CONFIG_VARS},
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as messages"""
+    regressions = []
+    previous = {(case['engine'], case['size']): case for case in baseline['cases']}
+    for case in results['cases']:
+        before = previous.get((case['engine'], case['size']))
+        if before is None or before['status'] != 'ok':
+            continue
+        label = f"{case['engine']} @ {case['size']}"
+        if case['status'] != 'ok':
+            regressions.append(f"{label}: {case['status']} ({case.get('error')})")
+            continue
+        if case.get('notes') or before.get('notes'):
+            # A fallback was measured (see engine_notes); its timings are not the engine's
+            continue
+        for metric, floor in (('wall_ms', MIN_DELTA_MS), ('cpu_ms', MIN_DELTA_MS), ('peak_rss_mb', MIN_DELTA_MB)):
+            old, new = before.get(metric), case.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append(f"{label}: {metric} {old:.1f} -> {new:.1f} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def baseline_warnings(results, baseline):
+    """Differences that make the comparison less meaningful (other machine, inputs or settings)"""
+    warnings = []
+    inputs = baseline.get('inputs', {})
+    changed = [name for name, value in results['inputs'].items() if name in inputs and inputs[name] != value]
+    if changed:
+        warnings.append(f"synthetic inputs differ from the baseline's ({', '.join(changed)}): other libjpeg/Pillow build?")
+    for key in ('cpu_count', 'machine', 'versions', 'config'):
+        if baseline['environment'].get(key) != results['environment'][key]:
+            warnings.append(f"{key} differs from the baseline: {baseline['environment'].get(key)} -> {results['environment'][key]}")
+    return warnings
+
+
+def print_case(case):
+    label = f"{case['engine']:<22} {case['size']:>6}"
+    if case['status'] != 'ok':
+        print(f"{label}  {case['status'].upper()}: {case['error']}")
+        return
+    stages = '  '.join(f"{stage}={timing['wall_ms']:.1f}" for stage, timing in case['stages'].items())
+    print(f"{label}  wall={case['wall_ms']:9.1f} ms  cpu={case['cpu_ms']:9.1f} ms  "
+          f"peak_rss={case['peak_rss_mb']:7.1f} MB  cold={case['cold_ms']:9.1f} ms  {stages}")
+    for note in case.get('notes', []):
+        print(f"{'':<30}⚠️ {note}")
+
+
+def _names(value, known, what):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise SystemExit(f"Unknown {what}: {', '.join(unknown)} (choose from {', '.join(known)})")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per case, after one warm-up run')
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--sizes', default=','.join(SIZES))
+    parser.add_argument('--output', default='engine_results.json', help='where to write the results JSON')
+    parser.add_argument('--baseline', help='results JSON to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative growth (default 0.25)')
+    parser.add_argument('--save-baseline', help='also write the results here, as the new baseline')
+    args = parser.parse_args()
+
+    engines = _names(args.engines, ENGINES, 'engines')
+    sizes = _names(args.sizes, tuple(SIZES), 'sizes')
+
+    garment_bytes = make_garment()
+    people = {size: make_person(*SIZES[size]) for size in sizes}
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'runs': args.runs,
+        'seed': SEED,
+        'environment': environment(),
+        'inputs': {
+            'garment': hashlib.sha256(garment_bytes).hexdigest(),
+            **{size: {'width': SIZES[size][0], 'height': SIZES[size][1],
+                      'sha256': hashlib.sha256(people[size]).hexdigest()} for size in sizes},
+        },
+        'cases': [],
+    }
+
+    for size in sizes:
+        for engine in engines:
+            case = run_isolated(engine, size, people[size], garment_bytes, args.runs)
+            results['cases'].append(case)
+            print_case(case)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for warning in baseline_warnings(results, baseline):
+            print(f"⚠️ {warning}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Frames per second of the live webcam try-on pipeline, against per-frame still detection.
+
+Builds a clip by panning a person photo across a 640x480 frame (or reads
+--video), then pushes every frame through a LiveTryOnSession: decode, pose
+tracking, garment composite, JPEG encode. "every frame" runs the session
+with TRACK_KEYFRAME_INTERVAL=1 (the pose graph on every frame, no optical
+flow), "static" runs the same frames through a Pose graph in
+static_image_mode, which is what the stills pipeline does for every image.
+Run it pinned to one core to check the 15 FPS target:
+
+Usage (from the backend directory):
+    taskset -c 0 python -m benchmarks.live_tryon --frames 120 --image debug_result.jpg
+"""
+import argparse
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from services.garment_store import _compute_assets
+from services.live_tryon import LiveTryOnSession
+
+
+def panned_clip(image_path, frames, width=640, height=480):
+    person = cv2.imread(image_path)
+    if person is None:
+        raise SystemExit(f"Could not read {image_path}")
+    scale = height / person.shape[0]
+    person = cv2.resize(person, (max(1, round(person.shape[1] * scale)), height), interpolation=cv2.INTER_AREA)
+    person = person[:, :width]
+    travel = max(0, width - person.shape[1])
+
+    clip = []
+    for i in range(frames):
+        frame = np.full((height, width, 3), 200, np.uint8)
+        x = int(travel / 2 + travel / 2 * np.sin(i / 10))
+        frame[:, x:x + person.shape[1]] = person
+        clip.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    return clip
+
+
+def video_clip(video_path, frames):
+    capture = cv2.VideoCapture(video_path)
+    clip = []
+    while len(clip) < frames:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        clip.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    capture.release()
+    return clip
+
+
+def make_garment():
+    garment = np.full((600, 450, 3), 255, np.uint8)
+    cv2.rectangle(garment, (60, 80), (390, 560), (40, 60, 170), -1)
+    cv2.rectangle(garment, (0, 80), (60, 300), (40, 60, 170), -1)
+    cv2.rectangle(garment, (390, 80), (450, 300), (40, 60, 170), -1)
+    return _compute_assets('benchmark-live', garment, 'benchmark')
+
+
+def run_live(clip, complexity, keyframe_interval=None):
+    session = LiveTryOnSession(model_complexity=complexity)
+    if keyframe_interval:
+        session.tracker.keyframe_interval = keyframe_interval
+    session.set_garment(make_garment())
+    session.process_frame(clip[0])  # graph warm-up
+    timings = []
+    started = time.perf_counter()
+    for frame in clip:
+        frame_started = time.perf_counter()
+        session.process_frame(frame)
+        timings.append((time.perf_counter() - frame_started) * 1000)
+    elapsed = time.perf_counter() - started
+    stages = {**session.stage_ms, **session.stats()}
+    session.close()
+    return len(clip) / elapsed, timings, stages
+
+
+def run_static(clip, complexity):
+    import mediapipe as mp
+    from services.image_io import decode_rgb
+
+    pose = mp.solutions.pose.Pose(static_image_mode=True, model_complexity=complexity)
+    timings = []
+    started = time.perf_counter()
+    for frame in clip:
+        frame_started = time.perf_counter()
+        pose.process(decode_rgb(frame, 640))
+        timings.append((time.perf_counter() - frame_started) * 1000)
+    elapsed = time.perf_counter() - started
+    pose.close()
+    return len(clip) / elapsed, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--image', default='debug_result.jpg', help='person photo to pan across the frame')
+    parser.add_argument('--video', help='use frames from this video instead of --image')
+    parser.add_argument('--complexity', type=int, default=1, help='Pose model complexity (0 and 2 are downloaded on first use)')
+    parser.add_argument('--keyframe-interval', type=int, help='override TRACK_KEYFRAME_INTERVAL for the "live" run')
+    args = parser.parse_args()
+
+    clip = video_clip(args.video, args.frames) if args.video else panned_clip(args.image, args.frames)
+    print(f"{len(clip)} frames, model_complexity={args.complexity}")
+
+    fps, timings, stages = run_live(clip, args.complexity, args.keyframe_interval)
+    print(f"live         {fps:6.1f} FPS  median={statistics.median(timings):6.1f} ms  {stages}")
+    fps, timings, stages = run_live(clip, args.complexity, keyframe_interval=1)
+    print(f"every frame  {fps:6.1f} FPS  median={statistics.median(timings):6.1f} ms  {stages}")
+    fps, timings = run_static(clip, args.complexity)
+    print(f"static       {fps:6.1f} FPS  median={statistics.median(timings):6.1f} ms  (pose only)")
+
+
+if __name__ == '__main__':
+    main()
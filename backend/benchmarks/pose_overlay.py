@@ -0,0 +1,96 @@
+"""Per-request latency of AdvancedTryOnService._basic_overlay, before and after pose pooling.
+
+"before" rebuilds a MediaPipe Pose graph on every call (and never closes it),
+which is what _basic_overlay used to do. "after" uses the service's long-lived
+pooled estimators.
+
+Usage (from the backend directory):
+    python -m benchmarks.pose_overlay --runs 20 --size 1024x1365
+"""
+import argparse
+import asyncio
+import io
+import statistics
+import time
+
+import mediapipe as mp
+import numpy as np
+from PIL import Image
+
+from services.advanced_tryon import AdvancedTryOnService
+from services.person_cache import get_person_cache
+from services.pose_pool import close_pose_pools
+
+
+class PerCallPose:
+    """Stand-in for the old behaviour: a fresh Pose graph per request"""
+
+    def __init__(self, **pose_options):
+        self.pose_options = pose_options
+
+    def process(self, image):
+        pose = mp.solutions.pose.Pose(**self.pose_options)
+        return pose.process(image)
+
+    def close(self):
+        pass
+
+
+def make_jpeg(width, height, seed):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def time_overlay(service, person_bytes, garment_bytes, runs):
+    timings = []
+    for _ in range(runs):
+        # Landmarks are cached per person image; clear them so detection is timed
+        get_person_cache().clear()
+        started = time.perf_counter()
+        asyncio.run(service._basic_overlay(person_bytes, garment_bytes))
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summarize(label, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<8} mean={statistics.mean(timings):8.1f} ms  "
+          f"median={statistics.median(timings):8.1f} ms  p95={p95:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--size', default='1024x1365', help='person image WxH')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    person_bytes = make_jpeg(width, height, seed=1)
+    garment_bytes = make_jpeg(512, 512, seed=2)
+
+    service = AdvancedTryOnService()
+    pooled = service.pose_pool
+
+    # Warm up both paths once so import and first-load costs are excluded
+    service.pose_pool = PerCallPose(**pooled.pose_options)
+    time_overlay(service, person_bytes, garment_bytes, 1)
+    before = time_overlay(service, person_bytes, garment_bytes, args.runs)
+
+    service.pose_pool = pooled
+    time_overlay(service, person_bytes, garment_bytes, 1)
+    after = time_overlay(service, person_bytes, garment_bytes, args.runs)
+
+    print(f"_basic_overlay, {width}x{height} person image, {args.runs} runs")
+    summarize('before', before)
+    summarize('after', after)
+    print(f"speedup  {statistics.median(before) / statistics.median(after):.2f}x (median)")
+
+    close_pose_pools()
+
+
+if __name__ == '__main__':
+    main()
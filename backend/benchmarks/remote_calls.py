@@ -0,0 +1,103 @@
+"""Event-loop stalls from remote model calls: blocking requests.post vs the pooled async client.
+
+Starts a local fake Hugging Face inference server that answers after
+--delay seconds, then runs --calls concurrent styling-advice calls while a
+heartbeat task measures how late the event loop wakes it up. "blocking" is
+what LLMStylist used to do (requests.post inside a coroutine); "async" goes
+through services.remote_client.
+
+Usage (from the backend directory):
+    python -m benchmarks.remote_calls --calls 8 --delay 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+RESPONSE = json.dumps([{'generated_text': '- Choose well-fitted clothing\n- Invest in basics'}]).encode()
+
+
+def start_fake_hf(delay):
+    """Fake inference API on 127.0.0.1; returns the server (stop with .shutdown())"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(RESPONSE)))
+            self.end_headers()
+            self.wfile.write(RESPONSE)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def blocking_advice(stylist, user_data):
+    # The old code path: a synchronous POST inside a coroutine
+    response = requests.post(stylist.models['text'], json={'inputs': 'advice'}, timeout=30)
+    return stylist._format_styling_advice(response.json())
+
+
+async def heartbeat(stop, interval=0.01):
+    """Worst lateness (ms) of a task that wants to run every `interval` seconds"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, (time.perf_counter() - started - interval) * 1000)
+    return worst
+
+
+async def run(mode, calls):
+    from services.llm_stylist import LLMStylist
+    from services.remote_client import close_remote_client
+
+    stylist = LLMStylist()
+    user_data = {'body_type': 'pear'}
+    if mode == 'blocking':
+        call = lambda: blocking_advice(stylist, user_data)
+    else:
+        call = lambda: stylist.get_personalized_styling_advice(user_data)
+
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*[call() for _ in range(calls)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_stall = await beat
+    await close_remote_client()
+    return elapsed * 1000, worst_stall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.5, help='fake server response time (s)')
+    args = parser.parse_args()
+
+    server = start_fake_hf(args.delay)
+    os.environ['HF_INFERENCE_URL'] = f'http://127.0.0.1:{server.server_port}'
+    try:
+        print(f"{args.calls} concurrent styling-advice calls, fake HF server delay {args.delay}s")
+        for mode in ('blocking', 'async'):
+            elapsed, stall = asyncio.run(run(mode, args.calls))
+            print(f"{mode:<9} total={elapsed:8.1f} ms  worst event-loop stall={stall:8.1f} ms")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Peak Python memory of parsing one try-on upload: base64 JSON vs multipart vs raw binary.
+
+Measures read_tryon_request() (everything between the WSGI body and the
+person-image bytes handed to the decoder) with tracemalloc, through Flask's
+test client, so the numbers include Werkzeug's own body/form handling.
+
+Usage (from the backend directory):
+    python -m benchmarks.upload_memory --size 3000x4000
+"""
+import argparse
+import base64
+import io
+import json
+import tracemalloc
+
+import numpy as np
+from flask import Flask, request, jsonify
+from PIL import Image
+
+from services.tryon_request import read_tryon_request
+
+GARMENT_URL = 'https://example.com/garment.png'
+PRODUCT_INFO = {'id': 'sku-1', 'name': 'Benchmark shirt'}
+
+
+def make_jpeg(width, height):
+    # Noise compresses badly, which is what a large phone photo looks like to the parser
+    rng = np.random.default_rng(1)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def build_app(results):
+    app = Flask(__name__)
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        # The body is still unread here; only the parse is traced
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        parsed = read_tryon_request(request)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[parsed.transport] = (peak, len(parsed.person_bytes))
+        return jsonify({'ok': True})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='3000x4000', help='person image WxH')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    person_bytes = make_jpeg(width, height)
+
+    results = {}
+    client = build_app(results).test_client()
+
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(person_bytes).decode('ascii')
+    client.post('/upload', data=json.dumps({
+        'person_image': data_url,
+        'garment_image': GARMENT_URL,
+        'product_info': PRODUCT_INFO
+    }), content_type='application/json')
+
+    client.post('/upload', data={
+        'person_image': (io.BytesIO(person_bytes), 'person.jpg', 'image/jpeg'),
+        'garment_image': GARMENT_URL,
+        'product_info': json.dumps(PRODUCT_INFO)
+    }, content_type='multipart/form-data')
+
+    client.post('/upload', data=person_bytes, content_type='image/jpeg', query_string={
+        'garment_image': GARMENT_URL,
+        'product_info': json.dumps(PRODUCT_INFO)
+    })
+
+    mb = 1024 * 1024
+    print(f"Person image {width}x{height}: {len(person_bytes) / mb:.2f} MB JPEG")
+    for transport in ('json', 'multipart', 'binary'):
+        peak, size = results[transport]
+        print(f"{transport:<10} peak={peak / mb:7.2f} MB  ({peak / size:.1f}x image size)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Flask engine latency on large photos, full-frame detection vs working resolution.
+
+"full" runs detection and mask building on the whole frame
+(TRYON_WORKING_MAX_SIDE=0); "working" uses the capped detection copy. The
+person analysis cache is cleared before every run so detection is timed too.
+Garment assets are prebuilt, as the views do through the garment store.
+
+Usage (from the backend directory):
+    python -m benchmarks.working_resolution --runs 3 --size 4000x3000
+"""
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from services.garment_store import GarmentAssetStore
+from services.image_io import decode_person, decode_garment
+from services.person_cache import get_person_cache
+
+
+def make_person(width, height):
+    # Light background with a light blue shirt block where the engines look for one
+    rng = np.random.default_rng(1)
+    pixels = np.full((height, width, 3), 225, dtype=np.uint8)
+    pixels[height // 3:height * 5 // 6, width // 4:width * 3 // 4] = (120, 170, 220)
+    pixels = np.clip(pixels + rng.normal(0, 6, pixels.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def make_garment():
+    garment = np.full((800, 640, 3), 255, dtype=np.uint8)
+    garment[80:720, 80:560] = (200, 40, 40)
+    buffer = io.BytesIO()
+    Image.fromarray(garment).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def engines(person_bytes, garment_bytes):
+    import simple_backend
+    import simple_dramatic_tryon
+    import huggingface_tryon
+    import replicate_tryon
+
+    info = {'name': 'Benchmark shirt', 'subcategory': 'shirt'}
+    assets = GarmentAssetStore(root=tempfile.mkdtemp(prefix='tryon_bench_')).get_or_build('bench', garment_bytes)
+
+    def simple():
+        return simple_backend.process_tryon(decode_person(person_bytes), decode_garment(garment_bytes), info)
+
+    return {
+        'simple_backend': simple,
+        'simple_dramatic': lambda: simple_dramatic_tryon.create_super_dramatic_tryon(person_bytes, garment_bytes, info, assets),
+        'huggingface_sim': lambda: huggingface_tryon.advanced_simulation_tryon(person_bytes, garment_bytes, info, assets),
+        'replicate_sim': lambda: replicate_tryon.create_dramatic_tryon(person_bytes, garment_bytes, info),
+    }
+
+
+def time_engine(run, runs):
+    timings = []
+    for _ in range(runs):
+        get_person_cache().clear()
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--size', default='4000x3000', help='person image WxH')
+    parser.add_argument('--max-side', default='1024', help='working resolution to compare against')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    person_bytes = make_person(width, height)
+    garment_bytes = make_garment()
+
+    results = {}
+    for label, max_side in (('full', '0'), ('working', args.max_side)):
+        os.environ['TRYON_WORKING_MAX_SIDE'] = max_side
+        for name, run in engines(person_bytes, garment_bytes).items():
+            run()  # warm-up: imports, cascades, first allocations
+            results.setdefault(name, {})[label] = time_engine(run, args.runs)
+
+    print(f"{width}x{height} person image, median of {args.runs} runs, working side {args.max_side}")
+    for name, timings in results.items():
+        print(f"{name:<16} full={timings['full']:8.1f} ms  working={timings['working']:8.1f} ms  "
+              f"speedup={timings['full'] / timings['working']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
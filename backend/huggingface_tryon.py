@@ -1,14 +1,40 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 import requests
-import io
 import base64
 from PIL import Image
 import time
+from services.result_cache import get_result_cache
+from services.tryon_request import read_tryon_request, TryOnRequestError, image_response
+from services.image_encoding import negotiate_format, encode_image, transcode_image, variant_key
+from services.garment_fetcher import get_garment_fetcher
+from services.person_cache import cached_person_analysis
+from services.working_resolution import at_working_resolution, build_mask
+from services.image_io import decode_person, decode_garment, ImageTooLargeError
+from services.admission import add_flask_admission
+from services.profiling import add_flask_profiling
+from services.metrics import add_flask_metrics, timed
+from services.garment_store import get_garment_store, enhance_texture
+from services.tryon_jobs import tryon_job_queue, add_job_routes
+from services.progress import report_stage, report_preview
+from services.resilience import DeadlineExceeded, deadline_scope, remote_budget, remote_timeout, get_breaker, breaker_stats
 
 app = Flask(__name__)
 CORS(app)
 
+# Request and per-stage metrics at GET /metrics
+add_flask_metrics(app, 'huggingface_tryon')
+
+# Bounded concurrent try-ons: excess requests wait briefly, then get 429 + Retry-After
+add_flask_admission(app, 'huggingface_tryon')
+
+# Opt-in cProfile/tracemalloc captures of sampled try-ons (admin token)
+add_flask_profiling(app, 'huggingface_tryon')
+
+result_cache = get_result_cache()
+garment_fetcher = get_garment_fetcher()
+garment_store = get_garment_store()
+
 # Updated Hugging Face Spaces API configuration
 HF_SPACE_URL = "https://yisol-idm-vton.hf.space/api/predict"
 HF_HEADERS = {
@@ -16,54 +42,99 @@ HF_HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Seconds a request may wait on the Space before the local simulation takes over
+TRYON_REMOTE_BUDGET = remote_budget('TRYON_REMOTE_BUDGET', 20)
+hf_breaker = get_breaker('huggingface_space')
+
 @app.route('/api/virtual-tryon', methods=['POST'])
 def virtual_tryon():
     try:
         print("🚀 Starting Hugging Face VITON processing...")
-        data = request.get_json()
-        
-        person_b64 = data['person_image']
-        garment_url = data['garment_image']
-        product_info = data['product_info']
-        
-        print(f"📸 Processing: {product_info.get('name', 'Unknown Product')}")
-        
-        # Convert person image
-        if person_b64.startswith('data:'):
-            person_b64 = person_b64.split(',')[1]
-        person_bytes = base64.b64decode(person_b64)
+        upload = read_tryon_request(request)
         
-        # Download garment image
-        print("⬇️ Downloading garment image...")
-        garment_response = requests.get(garment_url, timeout=10)
-        garment_bytes = garment_response.content
+        # Output format from the Accept header (JPEG unless WebP/AVIF is asked for)
+        fmt = negotiate_format(request.headers.get('Accept'))
         
-        # Try Hugging Face VITON first
-        try:
-            print("🤖 Calling Hugging Face VITON API...")
-            result = call_huggingface_viton(person_bytes, garment_bytes)
-            if result:
-                print("✅ Hugging Face VITON successful!")
-                return send_file(io.BytesIO(result), mimetype='image/jpeg')
-        except Exception as e:
-            print(f"⚠️ Hugging Face failed: {e}")
-        
-        # Fallback to advanced simulation
-        print("🎨 Using advanced simulation fallback...")
-        result = advanced_simulation_tryon(person_bytes, garment_bytes, product_info)
-        
-        img_io = io.BytesIO()
-        result.save(img_io, 'JPEG', quality=90)
-        img_io.seek(0)
-        
-        return send_file(img_io, mimetype='image/jpeg')
+        return image_response(render_tryon(upload, fmt), fmt)
         
+    except TryOnRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print(f"❌ ERROR: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def render_tryon(upload, fmt, budget=TRYON_REMOTE_BUDGET):
+    """Encoded try-on result for an upload: HF VITON within `budget` seconds, else the advanced simulation"""
+    person_bytes = upload.person_bytes
+    garment_url = upload.garment_url
+    product_info = upload.product_info
+    
+    print(f"📸 Processing: {product_info.get('name', 'Unknown Product')}")
+    
+    # Serve retries of the same photo + garment from the result cache
+    cache_key = result_cache.make_key(person_bytes, upload.garment_ref, product_info,
+                                      engine='huggingface_tryon', **variant_key(fmt, 'standard'))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print("⚡ Result cache hit")
+        return cached
+    
+    # Download garment image
+    print("⬇️ Downloading garment image...")
+    report_stage('download_garment')
+    garment_bytes = upload.garment_bytes if upload.garment_bytes is not None else garment_fetcher.fetch_bytes(garment_url)
+    
+    # Try Hugging Face VITON first, within the remote budget
+    try:
+        print("🤖 Calling Hugging Face VITON API...")
+        report_stage('remote_model')
+        with deadline_scope(budget):
+            result = call_huggingface_viton(person_bytes, garment_bytes)
+        if result:
+            print("✅ Hugging Face VITON successful!")
+            report_stage('encode')
+            result = transcode_image(result, fmt, 'standard')
+            result_cache.put(cache_key, result)
+            return result
+    except Exception as e:
+        print(f"⚠️ Hugging Face failed: {e}")
+    
+    # Fallback to advanced simulation, cached under its own key: the VITON key is
+    # only ever filled by the Space, so later requests and jobs try it again
+    fallback_key = result_cache.make_key(person_bytes, upload.garment_ref, product_info,
+                                         engine='huggingface_tryon.simulation', **variant_key(fmt, 'standard'))
+    cached = result_cache.get(fallback_key)
+    if cached is not None:
+        print("⚡ Simulation cache hit")
+        return cached
+    
+    print("🎨 Using advanced simulation fallback...")
+    report_stage('garment_assets')
+    assets = garment_store.get_or_build(garment_store.asset_id_for(product_info, upload.garment_ref), garment_bytes)
+    result = advanced_simulation_tryon(person_bytes, garment_bytes, product_info, assets)
+    
+    report_stage('encode')
+    body = encode_image(result, fmt, 'standard')
+    result_cache.put(fallback_key, body)
+    return body
+
+# POST /api/jobs: the Space call and the simulation run on the queue's workers instead of an HTTP thread
+job_queue = tryon_job_queue('huggingface_tryon', render_tryon)
+add_job_routes(app, job_queue)
+
+@app.route('/api/remote-stats', methods=['GET'])
+def remote_stats():
+    return jsonify({'breakers': breaker_stats()})
+
+@timed('remote_call')
 def call_huggingface_viton(person_bytes, garment_bytes):
-    """Call Hugging Face Spaces VITON API"""
+    """Call Hugging Face Spaces VITON API (None when it fails, is out of budget or its breaker is open)"""
+    if not hf_breaker.allow():
+        print("⏭️ Hugging Face Space circuit open, skipping")
+        return None
+    
     try:
         # Convert images to base64 data URLs
         person_b64 = base64.b64encode(person_bytes).decode('utf-8')
@@ -87,8 +158,10 @@ def call_huggingface_viton(person_bytes, garment_bytes):
         
         print(f"🌐 Calling HF Space: {HF_SPACE_URL}")
         
-        # Make API call to Hugging Face Space
-        response = requests.post(HF_SPACE_URL, json=payload, timeout=120)
+        # Make API call to Hugging Face Space (timeout cut to the remaining budget)
+        cap = 120
+        timeout = remote_timeout(cap)
+        response = requests.post(HF_SPACE_URL, json=payload, timeout=timeout)
         
         if response.status_code == 200:
             result = response.json()
@@ -100,54 +173,80 @@ def call_huggingface_viton(person_bytes, garment_bytes):
                     img_data = result['data'][0]
                     if isinstance(img_data, str) and img_data.startswith('data:image'):
                         img_b64 = img_data.split(',')[1]
+                        hf_breaker.record_success()
                         return base64.b64decode(img_b64)
                     elif isinstance(img_data, dict) and 'url' in img_data:
                         # Download from URL
-                        img_response = requests.get(img_data['url'], timeout=30)
+                        cap = 30
+                        timeout = remote_timeout(cap)
+                        img_response = requests.get(img_data['url'], timeout=timeout)
                         if img_response.status_code == 200:
+                            hf_breaker.record_success()
                             return img_response.content
             
+            hf_breaker.record_failure("unexpected response")
             return None
         
         print(f"❌ HF Space Error: {response.status_code} - {response.text}")
+        hf_breaker.record_failure(f"HTTP {response.status_code}")
         return None
         
+    except DeadlineExceeded as e:
+        print(f"⏱️ HF Space skipped: {e}")
+        hf_breaker.record_abandoned()
+        return None
+    except requests.Timeout as e:
+        print(f"⏱️ HF Space timed out: {e}")
+        if timeout < cap:
+            # Cut short by the request budget, not the Space's fault
+            hf_breaker.record_abandoned()
+        else:
+            hf_breaker.record_failure(e)
+        return None
     except Exception as e:
         print(f"❌ HF Space Exception: {e}")
+        hf_breaker.record_failure(e)
         return None
 
-def advanced_simulation_tryon(person_bytes, garment_bytes, product_info):
+def advanced_simulation_tryon(person_bytes, garment_bytes, product_info, assets=None):
     """Ultra-advanced simulation with professional-grade body fitting"""
     import cv2
-    import numpy as np
-    
-    # Load images
-    person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-    garment_img = Image.open(io.BytesIO(garment_bytes)).convert('RGB')
     
-    # Convert to numpy
-    person_np = np.array(person_img)
-    garment_np = np.array(garment_img)
+    # Decode once into RGB arrays
+    report_stage('decode')
+    person_np = decode_person(person_bytes)
+    if assets is not None:
+        garment_np = assets.rgb
+    else:
+        garment_np = decode_garment(garment_bytes)
     
     height, width = person_np.shape[:2]
     
     print(f"🎨 Processing {width}x{height} person image with {garment_np.shape} garment")
     
     # Multi-method body detection
+    report_stage('detect_body')
     body_region = ultra_smart_body_detection(person_np)
     
     # Professional garment application
-    result = apply_professional_garment(person_np, garment_np, body_region, product_info)
+    report_stage('apply_garment')
+    result = apply_professional_garment(person_np, garment_np, body_region, product_info, assets)
     
     # Add realistic lighting and shadows
+    report_stage('lighting')
     result = add_realistic_lighting(result, body_region)
+    report_preview(result)
     
     # Final professional touches
+    report_stage('overlay')
     result_pil = Image.fromarray(result)
     result_pil = add_ultra_professional_overlay(result_pil, product_info)
     
     return result_pil
 
+@at_working_resolution
+@cached_person_analysis('huggingface_tryon.body_region')
+@timed('detection')
 def ultra_smart_body_detection(image):
     """Ultra-smart body detection using multiple advanced methods"""
     import cv2
@@ -269,7 +368,8 @@ def create_shirt_mask(width, height):
     
     return mask
 
-def apply_professional_garment(person_img, garment_img, body_region, product_info):
+@timed('blend')
+def apply_professional_garment(person_img, garment_img, body_region, product_info, assets=None):
     """Apply garment with professional-grade fitting and realism"""
     import cv2
     import numpy as np
@@ -285,13 +385,16 @@ def apply_professional_garment(person_img, garment_img, body_region, product_inf
     print(f"🎨 Applying professional garment at: x={x}, y={y}, w={w}, h={h}")
     
     # Advanced garment preprocessing
-    garment_processed = preprocess_garment(garment_img, w, h)
+    garment_processed = preprocess_garment(garment_img, w, h, assets)
     
     # Create ultra-realistic body-fitted mask
-    body_mask = create_ultra_realistic_body_mask(w, h, body_region)
+    # Built at working resolution and stretched: it is smooth, and the ROI can be 10+ MP
+    body_mask = build_mask(create_ultra_realistic_body_mask, w, h, body_region)
     
     # Apply advanced color matching
-    garment_color_matched = match_lighting_conditions(garment_processed, person_img[y:y+h, x:x+w])
+    garment_brightness = assets.lab_stats['enhanced_mean'][0] if assets is not None else None
+    garment_color_matched = match_lighting_conditions(garment_processed, person_img[y:y+h, x:x+w],
+                                                      garment_brightness)
     
     # Professional blending with multiple layers
     roi = result[y:y+h, x:x+w]
@@ -306,16 +409,20 @@ def apply_professional_garment(person_img, garment_img, body_region, product_inf
     
     return result
 
-def preprocess_garment(garment_img, target_w, target_h):
+@timed('garment_fit')
+def preprocess_garment(garment_img, target_w, target_h, assets=None):
     """Advanced garment preprocessing for realistic fitting"""
     import cv2
     import numpy as np
     
-    # Resize with high-quality interpolation
-    garment_resized = cv2.resize(garment_img, (target_w, target_h), interpolation=cv2.INTER_LANCZOS4)
-    
-    # Enhance garment details
-    garment_enhanced = cv2.detailEnhance(garment_resized, sigma_s=10, sigma_r=0.15)
+    if assets is not None:
+        # Detail enhancement was done once when the garment assets were built
+        garment_enhanced = assets.resized('enhanced', target_w, target_h)
+    else:
+        # Enhance garment details at the garment's own resolution (upscaling first
+        # only multiplies the work), then resize with high-quality interpolation
+        garment_enhanced = cv2.resize(enhance_texture(garment_img), (target_w, target_h),
+                                      interpolation=cv2.INTER_LANCZOS4)
     
     # Add subtle noise for fabric texture
     noise = np.random.normal(0, 2, garment_enhanced.shape).astype(np.int16)
@@ -328,41 +435,33 @@ def create_ultra_realistic_body_mask(w, h, body_region):
     import cv2
     import numpy as np
     
-    mask = np.zeros((h, w), dtype=np.float32)
-    
     # Create natural body curves
     center_x = w // 2
     
-    for y in range(h):
-        # Natural body tapering (wider shoulders, narrower waist)
-        progress = y / h
-        
-        # Shoulder to waist curve (realistic body shape)
-        if progress < 0.3:  # Shoulder area
-            width_factor = 0.95 - progress * 0.1
-        elif progress < 0.6:  # Chest to waist
-            width_factor = 0.85 - (progress - 0.3) * 0.15
-        else:  # Waist to bottom
-            width_factor = 0.7 + (progress - 0.6) * 0.2
-        
-        current_width = int(w * width_factor)
-        start_x = center_x - current_width // 2
-        end_x = center_x + current_width // 2
-        
-        # Smooth edges with gaussian-like falloff
-        for x in range(w):
-            if start_x <= x <= end_x:
-                # Distance from center
-                dist_from_center = abs(x - center_x) / (current_width / 2)
-                # Smooth falloff
-                mask[y, x] = max(0, 1 - dist_from_center ** 1.5)
+    # Natural body tapering (wider shoulders, narrower waist), one value per row
+    progress = np.arange(h) / h
+    width_factor = np.where(
+        progress < 0.3, 0.95 - progress * 0.1,                       # Shoulder area
+        np.where(progress < 0.6, 0.85 - (progress - 0.3) * 0.15,     # Chest to waist
+                 0.7 + (progress - 0.6) * 0.2)                       # Waist to bottom
+    )
+    current_width = (w * width_factor).astype(np.int64)[:, None]
+    start_x = center_x - current_width // 2
+    end_x = center_x + current_width // 2
+    
+    # Smooth edges with gaussian-like falloff
+    x = np.arange(w)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist_from_center = np.abs(x - center_x) / (current_width / 2)
+        falloff = np.maximum(0, 1 - dist_from_center ** 1.5)
+    mask = np.where((x >= start_x) & (x <= end_x), np.nan_to_num(falloff), 0).astype(np.float32)
     
     # Apply gaussian blur for ultra-smooth edges
     mask = cv2.GaussianBlur(mask, (15, 15), 5)
     
     return mask
 
-def match_lighting_conditions(garment, person_roi):
+def match_lighting_conditions(garment, person_roi, garment_brightness=None):
     """Match garment lighting to person's lighting conditions"""
     import cv2
     import numpy as np
@@ -373,7 +472,8 @@ def match_lighting_conditions(garment, person_roi):
     
     # Calculate average lighting (L channel)
     person_brightness = np.mean(person_lab[:, :, 0])
-    garment_brightness = np.mean(garment_lab[:, :, 0])
+    if garment_brightness is None:
+        garment_brightness = np.mean(garment_lab[:, :, 0])
     
     # Adjust garment brightness to match person
     brightness_ratio = person_brightness / garment_brightness
@@ -418,24 +518,19 @@ def add_realistic_lighting(image, body_region):
     w = body_region['shirt_width']
     h = body_region['shirt_height']
     
-    # Create subtle shadow under garment
-    shadow_mask = np.zeros((image.shape[0], image.shape[1]), dtype=np.float32)
-    
-    # Add shadow below garment
+    # Add shadow below garment (only the shadow strip is touched, not the whole frame)
     shadow_y_start = y + h
     shadow_h = min(20, image.shape[0] - shadow_y_start)
     
     if shadow_h > 0:
-        for i in range(shadow_h):
-            alpha = 1 - (i / shadow_h)
-            shadow_mask[shadow_y_start + i, x:x+w] = alpha * 0.1
-    
-    # Apply shadow
-    for c in range(3):
-        result[:, :, c] = (result[:, :, c] * (1 - shadow_mask)).astype(np.uint8)
+        alpha = (1 - np.arange(shadow_h) / shadow_h) * 0.1
+        shadow_mask = (1 - alpha.astype(np.float32))[:, None, None]
+        strip = result[shadow_y_start:shadow_y_start + shadow_h, x:x+w]
+        result[shadow_y_start:shadow_y_start + shadow_h, x:x+w] = (strip * shadow_mask).astype(np.uint8)
     
     return result
 
+@timed('overlay')
 def add_ultra_professional_overlay(image, product_info):
     """Add ultra-professional overlay with advanced graphics"""
     from PIL import ImageDraw, ImageFont
@@ -1,20 +1,157 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.datastructures import MutableHeaders
 import cv2
 import numpy as np
 from PIL import Image
-import io
 import base64
-from services.virtual_tryon import VirtualTryOnService
-from services.advanced_tryon import AdvancedTryOnService
-from services.pose_tryon import PoseTryOnService
-from services.style_analyzer import StyleAnalyzer
+import asyncio
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from services.executor import TryOnExecutor
+from services import tasks
+from services.pose_pool import close_pose_pools
+from services.result_cache import get_result_cache
+from services.garment_fetcher import get_garment_fetcher
+from services.person_cache import combined_stats
+from services.image_encoding import negotiate_format, variant_key, MIMETYPES
+from services.image_io import ImageTooLargeError
 from services.llm_stylist import LLMStylist
-from services.recommendation_engine import RecommendationEngine
+from services.llm_cache import get_llm_cache
+from services.remote_client import close_remote_client, remote_client_stats
+from services.resilience import deadline_scope, remote_budget, breaker_stats
+from services.garment_store import get_garment_store
+from services.live_tryon import LiveTryOnSession, FrameMeter, live_max_sessions
+from services.admission import AdmissionRejected, get_admission, get_rate_limiter, admission_stats
+from services.metrics import REGISTRY, CONTENT_TYPE, engine_scope, http_in_flight, metrics_text, record_request
+from services.profiling import (PROFILE_HEADER, PROFILE_QUERY, ProfileSession, admin_token_ok, get_profile_store,
+                                profile_scope, profiling_requested)
 
 app = FastAPI(title="Frenzy Vastra AI Backend", version="1.0.0")
 
+# Bounded concurrency per engine, by POST path: excess requests wait briefly,
+# then get 429 + Retry-After instead of piling up (see services/admission.py)
+ADMISSION_PATHS = {
+    '/api/virtual-tryon': get_admission('pose_tryon'),
+    '/api/virtual-tryon/batch': get_admission('batch'),
+    '/api/analyze-style': get_admission('style')
+}
+
+def too_many_requests(message, retry_after):
+    return JSONResponse({'detail': message, 'retry_after': retry_after}, status_code=429,
+                        headers={'Retry-After': str(retry_after)})
+
+# Endpoints whose requests may be profiled (see services/profiling.py)
+PROFILED_PATHS = set(ADMISSION_PATHS) | {'/api/recommendations'}
+
+def profile_token(request):
+    return request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY)
+
+class RequestProfiling:
+    """Pure ASGI middleware: the profile is stored when the app returns, even if the client left mid-response"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or scope['path'] not in PROFILED_PATHS \
+                or not profiling_requested(profile_token(Request(scope))):
+            return await self.app(scope, receive, send)
+        
+        controller = ADMISSION_PATHS.get(scope['path'])
+        session = ProfileSession(controller.name if controller is not None else 'api', scope['path'])
+        
+        async def send_with_profile_id(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).append('X-Profile-Id', session.id)
+            await send(message)
+        
+        # Covers the (possibly streamed) body too; the stored files are small
+        try:
+            with profile_scope(session):
+                await self.app(scope, receive, send_with_profile_id)
+        finally:
+            get_profile_store().save(session)
+
+# Innermost: only admitted requests are profiled, and only their work on the executor pools
+app.add_middleware(RequestProfiling)
+
+class AdmissionControl:
+    """Pure ASGI middleware: the slot is released when the app returns, even if the client left mid-response"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        controller = ADMISSION_PATHS.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'POST' else None
+        if controller is None:
+            return await self.app(scope, receive, send)
+        
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            wait = limiter.check(scope['client'][0] if scope.get('client') else None)
+            if wait:
+                return await too_many_requests("Too many requests from this client", wait)(scope, receive, send)
+        try:
+            await controller.acquire_async()
+        except AdmissionRejected as e:
+            print(f"🚦 Rejected {scope['path']}: {e}")
+            return await too_many_requests(str(e), e.retry_after)(scope, receive, send)
+        
+        # Streamed bodies (batch NDJSON) hold the slot until their last line is sent
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.monotonic() - started)
+
+# Registered before CORS so that rejections still carry the CORS headers
+app.add_middleware(AdmissionControl)
+
+def endpoint_labels(path):
+    """(engine, endpoint) metric labels of a request path"""
+    controller = ADMISSION_PATHS.get(path)
+    engine = controller.name if controller is not None else 'api'
+    # Only known routes become label values, so stray URLs can't grow the series
+    if any(getattr(route, 'path', None) == path for route in app.routes):
+        return engine, path
+    return engine, 'unmatched'
+
+class RequestMetrics:
+    """Pure ASGI middleware: the request is settled when the app returns, even if the client left mid-response"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        
+        engine, endpoint = endpoint_labels(scope['path'])
+        status = 500
+        
+        async def send_and_note_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+        
+        started = time.perf_counter()
+        http_in_flight.inc(engine=engine, endpoint=endpoint)
+        try:
+            with engine_scope(engine):
+                await self.app(scope, receive, send_and_note_status)
+        finally:
+            http_in_flight.dec(engine=engine, endpoint=endpoint)
+            record_request(engine, endpoint, scope['method'], status, time.perf_counter() - started)
+
+# Outside admission control, so 429s are counted too
+app.add_middleware(RequestMetrics)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:4028"],
@@ -23,16 +160,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-virtual_tryon = VirtualTryOnService()
-advanced_tryon = AdvancedTryOnService()
-pose_tryon = PoseTryOnService()
-style_analyzer = StyleAnalyzer()
+# Pixel work runs on the CPU pool and blocking remote calls on the I/O pool,
+# so a large upload never stalls the event loop for other clients.
+# Services are created lazily inside the workers (see services/tasks.py).
+executor = TryOnExecutor()
+result_cache = get_result_cache()
+garment_fetcher = get_garment_fetcher()
+REGISTRY.register_collector(executor.metrics)
+
+# Remote model calls are plain coroutines on the event loop (pooled async client)
 llm_stylist = LLMStylist()
-recommendation_engine = RecommendationEngine()
+
+MAX_BATCH_GARMENTS = 48
+
+# Quality presets per endpoint (see services/image_encoding.py)
+TRYON_PRESET = 'compact'
+BATCH_PRESET = 'compact'
+
+# Seconds the style endpoints may spend on remote models before answering from the local fallbacks
+STYLE_REMOTE_BUDGET = remote_budget('STYLE_REMOTE_BUDGET', 8)
+
+# Live webcam sessions run in this process: each owns a Pose graph and a thread
+LIVE_MAX_SESSIONS = live_max_sessions()
+live_sessions = 0
+REGISTRY.register_collector(lambda: [
+    ('live_sessions', 'gauge', 'Open live try-on WebSocket sessions', [({}, live_sessions)])
+])
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    executor.shutdown(wait=False)
+    close_pose_pools()
+    await close_remote_client()
 
 @app.post("/api/virtual-tryon")
 async def virtual_tryon_endpoint(
+    request: Request,
     person_image: UploadFile = File(...),
     garment_image: UploadFile = File(...),
     product_info: dict = None
@@ -42,33 +205,280 @@ async def virtual_tryon_endpoint(
         person_bytes = await person_image.read()
         garment_bytes = await garment_image.read()
         
-        # Use pose-based AI try-on
-        result_image = await pose_tryon.realistic_tryon(
-            person_bytes, garment_bytes, product_info
+        # WebP/AVIF when the client asks for them, JPEG otherwise
+        fmt = negotiate_format(request.headers.get('accept'))
+        
+        # Retries of the same photo + garment are served from the result cache
+        cache_key = await executor.run_io(
+            result_cache.make_key, person_bytes, garment_bytes, product_info,
+            engine='pose_tryon', **variant_key(fmt, TRYON_PRESET)
         )
+        result_bytes = await executor.run_io(result_cache.get, cache_key)
+        cache_status = 'HIT'
         
-        # Convert to bytes for response
-        img_byte_arr = io.BytesIO()
-        result_image.save(img_byte_arr, format='JPEG')
-        img_byte_arr.seek(0)
+        if result_bytes is None:
+            cache_status = 'MISS'
+            # Use pose-based AI try-on (decoded, fitted and encoded on the CPU pool)
+            result_bytes, fell_back = await executor.run_cpu(
+                tasks.pose_tryon_task, person_bytes, garment_bytes, product_info, fmt, TRYON_PRESET
+            )
+            # The simple overlay stands in for a possibly temporary failure: not cached,
+            # so the next request tries pose detection again
+            if not fell_back:
+                await executor.run_io(result_cache.put, cache_key, result_bytes)
         
-        return StreamingResponse(
-            io.BytesIO(img_byte_arr.getvalue()),
-            media_type="image/jpeg"
+        # Sent straight from the encoded bytes: no second buffer, no chunked streaming
+        return Response(
+            content=result_bytes,
+            media_type=MIMETYPES[fmt],
+            headers={'X-Cache': cache_status, 'Vary': 'Accept'}
         )
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/virtual-tryon/batch")
+async def virtual_tryon_batch_endpoint(
+    request: Request,
+    person_image: UploadFile = File(...),
+    garment_images: List[UploadFile] = File(None),
+    garment_urls: List[str] = Form(None),
+    product_info: str = Form(None)
+):
+    """Try many garments on one person photo.
+    
+    Garments are uploaded files and/or catalog URLs; `product_info` is an
+    optional JSON list aligned with them (uploads first, then URLs). The body
+    is detected once, every garment is rendered in parallel on the CPU pool,
+    and results stream back as NDJSON lines in completion order.
+    """
+    person_bytes = await person_image.read()
+    
+    garments = []
+    for upload in garment_images or []:
+        garments.append({'ref': upload.filename, 'bytes': await upload.read()})
+    for url in garment_urls or []:
+        garments.append({'ref': url, 'url': url})
+    
+    if not garments:
+        raise HTTPException(status_code=400, detail="No garments provided")
+    if len(garments) > MAX_BATCH_GARMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_GARMENTS} garments per batch")
+    
+    try:
+        infos = json.loads(product_info) if product_info else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="product_info must be a JSON list")
+    if not isinstance(infos, list):
+        infos = [infos] * len(garments)
+    
+    # Images inside the NDJSON lines use the image types listed in Accept
+    fmt = negotiate_format(request.headers.get('accept'))
+    variant = variant_key(fmt, BATCH_PRESET)
+    
+    person_key = hashlib.blake2b(person_bytes, digest_size=20).hexdigest()
+    detection = None
+    
+    async def detect():
+        """(region, detected): detected is False when detection failed and center placement stands in"""
+        try:
+            return await executor.run_cpu(tasks.pose_detect_task, person_key, person_bytes), True
+        except Exception as e:
+            print(f"Batch pose detection failed, using center placement: {e}")
+            return None, False
+    
+    async def detect_once():
+        nonlocal detection
+        if detection is None:
+            detection = asyncio.ensure_future(detect())
+        return await asyncio.shield(detection)
+    
+    async def render(index, garment):
+        started = time.perf_counter()
+        info = infos[index] if index < len(infos) else None
+        try:
+            garment_bytes = garment.get('bytes')
+            if garment_bytes is None:
+                garment_bytes = await executor.run_io(garment_fetcher.fetch_bytes, garment['url'])
+            
+            # Same key as /api/virtual-tryon, so single and batch try-ons share results
+            cache_key = await executor.run_io(
+                result_cache.make_key, person_bytes, garment_bytes, info,
+                engine='pose_tryon', **variant
+            )
+            result_bytes = await executor.run_io(result_cache.get, cache_key)
+            cache_status = 'HIT'
+            
+            if result_bytes is None:
+                cache_status = 'MISS'
+                region, detected = await detect_once()
+                result_bytes = await executor.run_cpu(
+                    tasks.pose_render_task, person_key, person_bytes, garment_bytes, region,
+                    fmt, BATCH_PRESET
+                )
+                # Center placement after a failed detection is not the real result
+                if detected:
+                    await executor.run_io(result_cache.put, cache_key, result_bytes)
+            
+            return {
+                'index': index,
+                'garment': garment['ref'],
+                'status': 'ok',
+                'cache': cache_status,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+                'image': f'data:{MIMETYPES[fmt]};base64,' + base64.b64encode(result_bytes).decode()
+            }
+        except Exception as e:
+            return {
+                'index': index,
+                'garment': garment['ref'],
+                'status': 'error',
+                'error': str(e)
+            }
+    
+    async def stream_results():
+        pending = [asyncio.ensure_future(render(i, g)) for i, g in enumerate(garments)]
+        try:
+            for finished in asyncio.as_completed(pending):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            # Client went away: stop rendering what is left
+            for task in pending:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.websocket("/ws/live-tryon")
+async def live_tryon_socket(websocket: WebSocket):
+    """Webcam try-on stream (see services/live_tryon.py).
+    
+    Text messages select the garment: {"garment_image": URL or data URL,
+    "product_info": {...}}. Binary messages are JPEG frames; each processed
+    frame comes back as a binary JPEG, and a {"type": "stats"} message reports
+    the achieved FPS about once a second. A frame that arrives while another
+    is being processed replaces any frame still waiting, so a slow client or
+    link drops stale frames instead of building up lag.
+    """
+    global live_sessions
+    await websocket.accept()
+    if live_sessions >= LIVE_MAX_SESSIONS:
+        await websocket.close(code=1013, reason="Too many live sessions")
+        return
+    live_sessions += 1
+    
+    loop = asyncio.get_running_loop()
+    # One thread per connection: the Pose graph tracks state from frame to frame
+    worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='live-tryon')
+    send_lock = asyncio.Lock()
+    meter = FrameMeter()
+    frame_ready = asyncio.Event()
+    latest = None
+    closed = False
+    session = None
+    receiver = None
+    
+    async def send(message):
+        async with send_lock:
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_json(message)
+    
+    async def select_garment(text):
+        try:
+            config = json.loads(text)
+            garment = config.get('garment_image') or ''
+            info = config.get('product_info') or {}
+            if garment.startswith('http://') or garment.startswith('https://'):
+                garment_bytes = await executor.run_io(garment_fetcher.fetch_bytes, garment)
+                garment_ref = garment
+            elif garment:
+                garment_bytes = garment_ref = base64.b64decode(garment.split(',', 1)[-1])
+            else:
+                raise ValueError("Missing garment_image")
+            store = get_garment_store()
+            assets = await executor.run_io(store.get_or_build, store.asset_id_for(info, garment_ref), garment_bytes)
+            await executor.run_io(session.set_garment, assets)
+            await send({'type': 'garment', 'status': 'ready', 'garment_type': assets.garment_type})
+        except Exception as e:
+            await send({'type': 'error', 'error': f"Could not load garment: {e}"})
+    
+    async def receive_frames():
+        nonlocal latest, closed
+        try:
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message.get('bytes') is not None:
+                    if latest is not None:
+                        # Newer frame wins; the waiting one is already stale
+                        meter.dropped += 1
+                    latest = message['bytes']
+                    frame_ready.set()
+                elif message.get('text'):
+                    # Garment loads in the background while frames keep flowing
+                    asyncio.ensure_future(select_garment(message['text']))
+        finally:
+            closed = True
+            frame_ready.set()
+    
+    try:
+        session = await loop.run_in_executor(worker, LiveTryOnSession)
+        receiver = asyncio.ensure_future(receive_frames())
+        await send({'type': 'ready', 'model_complexity': session.model_complexity, 'max_side': session.max_side})
+        last_stats = time.monotonic()
+        
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if closed:
+                break
+            frame, latest = latest, None
+            if frame is None:
+                continue
+            
+            started = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(worker, session.process_frame, frame)
+            except Exception as e:
+                await send({'type': 'error', 'error': f"Bad frame: {e}"})
+                continue
+            meter.record((time.perf_counter() - started) * 1000)
+            await send(result)
+            
+            if time.monotonic() - last_stats >= 1.0:
+                last_stats = time.monotonic()
+                await send({'type': 'stats', **meter.stats(), **session.stats(), 'stages_ms': dict(session.stage_ms)})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ Live try-on session failed: {e}")
+        try:
+            await websocket.close(code=1011, reason=str(e)[:120])
+        except Exception:
+            pass
+    finally:
+        live_sessions -= 1
+        if receiver is not None:
+            receiver.cancel()
+        if session is not None:
+            worker.submit(session.close)
+        worker.shutdown(wait=False)
+
 @app.post("/api/analyze-style")
 async def analyze_style(image: UploadFile = File(...), user_preferences: dict = None):
     try:
         image_bytes = await image.read()
         
-        # Use LLM for advanced analysis
-        llm_analysis = await llm_stylist.analyze_style_with_llm(image_bytes, user_preferences)
-        
-        # Combine with traditional analysis
-        basic_analysis = await style_analyzer.analyze_image(image_bytes)
+        # LLM analysis (remote calls) and traditional analysis (CPU pool) are
+        # independent, so the endpoint takes as long as the slower of the two
+        with deadline_scope(STYLE_REMOTE_BUDGET):
+            llm_analysis, basic_analysis = await asyncio.gather(
+                llm_stylist.analyze_style_with_llm(image_bytes, user_preferences),
+                executor.run_cpu(tasks.analyze_image_task, image_bytes)
+            )
         
         return {
             'llm_analysis': llm_analysis,
@@ -81,11 +491,12 @@ async def analyze_style(image: UploadFile = File(...), user_preferences: dict =
 @app.post("/api/recommendations")
 async def get_recommendations(user_data: dict):
     try:
-        # Get ML recommendations
-        ml_recommendations = await recommendation_engine.generate_recommendations(user_data)
-        
-        # Get LLM styling advice
-        styling_advice = await llm_stylist.get_personalized_styling_advice(user_data)
+        # ML recommendations and LLM styling advice run concurrently
+        with deadline_scope(STYLE_REMOTE_BUDGET):
+            ml_recommendations, styling_advice = await asyncio.gather(
+                executor.run_io(tasks.recommendations_task, user_data),
+                llm_stylist.get_personalized_styling_advice(user_data)
+            )
         
         return {
             'ml_recommendations': ml_recommendations,
@@ -103,6 +514,77 @@ async def get_outfit_suggestions(style_data: dict):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/executor-stats")
+async def executor_stats():
+    # Pose pools live in whichever process runs the pixel work: the CPU workers
+    # in process mode (as of their latest task), this process in thread mode
+    pose_pools = [
+        {'pid': pid, **pool}
+        for pid, stats in executor.worker_stats().items()
+        for pool in stats['pose_pools']
+    ]
+    return {**executor.stats(), 'pose_pools': pose_pools}
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format: requests, stage latency, caches, pools, queues (see services/metrics.py)
+    return Response(content=metrics_text(), media_type=CONTENT_TYPE)
+
+def require_profile_admin(request):
+    if not admin_token_ok(profile_token(request)):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/api/profiles")
+async def list_profiles(request: Request):
+    require_profile_admin(request)
+    return await executor.run_io(get_profile_store().list)
+
+@app.get("/api/profiles/{profile_id}")
+async def profile_summary(profile_id: str, request: Request):
+    require_profile_admin(request)
+    summary = await executor.run_io(get_profile_store().summary, profile_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Unknown profile")
+    return summary
+
+@app.get("/api/profiles/{profile_id}/pstats")
+async def profile_pstats(profile_id: str, request: Request):
+    require_profile_admin(request)
+    path = get_profile_store().pstats_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Unknown profile")
+    return FileResponse(path, media_type='application/octet-stream', filename=f'{profile_id}.pstats')
+
+@app.get("/api/profiles/{profile_id}/report")
+async def profile_report(profile_id: str, request: Request):
+    require_profile_admin(request)
+    report = await executor.run_io(get_profile_store().report, profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Unknown profile")
+    return Response(content=report, media_type='text/plain')
+
+@app.get("/api/admission-stats")
+async def admission_stats_endpoint():
+    # In-flight, queue depth and rejections per engine, and per-client rate limiting
+    return admission_stats()
+
+@app.get("/api/remote-stats")
+async def remote_stats():
+    # Circuit breaker state per upstream host, and the pooled client's counters
+    return {'breakers': breaker_stats(), 'clients': remote_client_stats()}
+
+@app.get("/api/cache-stats")
+async def cache_stats():
+    # The person analysis cache lives in whichever process runs the pixel work:
+    # the CPU workers in process mode (as of their latest task), this process in thread mode
+    workers = executor.worker_stats()
+    return {
+        'result_cache': result_cache.stats(),
+        'person_cache': combined_stats({pid: stats['person_cache'] for pid, stats in workers.items()}),
+        'llm_cache': get_llm_cache().stats(),
+        'garment_fetcher': garment_fetcher.stats()
+    }
+
 @app.get("/")
 async def root():
     return {"message": "Frenzy Vastra AI Backend with LLM Integration"}
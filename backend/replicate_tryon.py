@@ -1,56 +1,128 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 import requests
-import io
 import base64
 from PIL import Image
 import time
+from services.result_cache import get_result_cache
+from services.tryon_request import read_tryon_request, TryOnRequestError, image_response
+from services.image_encoding import negotiate_format, encode_image, transcode_image, variant_key
+from services.garment_fetcher import get_garment_fetcher
+from services.person_cache import cached_person_analysis
+from services.working_resolution import at_working_resolution
+from services.image_io import decode_person, decode_garment, ImageTooLargeError
+from services.admission import add_flask_admission
+from services.profiling import add_flask_profiling
+from services.metrics import add_flask_metrics, timed
+from services.tryon_jobs import tryon_job_queue, add_job_routes
+from services.progress import report_stage, report_preview
+from services.resilience import DeadlineExceeded, deadline_scope, remote_budget, remote_timeout, get_breaker, breaker_stats
 
 app = Flask(__name__)
 CORS(app)
 
+# Request and per-stage metrics at GET /metrics
+add_flask_metrics(app, 'replicate_tryon')
+
+# Bounded concurrent try-ons: excess requests wait briefly, then get 429 + Retry-After
+add_flask_admission(app, 'replicate_tryon')
+
+# Opt-in cProfile/tracemalloc captures of sampled try-ons (admin token)
+add_flask_profiling(app, 'replicate_tryon')
+
+result_cache = get_result_cache()
+garment_fetcher = get_garment_fetcher()
+
+# Seconds a request may wait on Replicate before the local simulation takes over
+TRYON_REMOTE_BUDGET = remote_budget('TRYON_REMOTE_BUDGET', 20)
+replicate_breaker = get_breaker('replicate')
+
 @app.route('/api/virtual-tryon', methods=['POST'])
 def virtual_tryon():
     try:
         print("Starting Replicate Virtual Try-On...")
-        data = request.get_json()
-        
-        person_b64 = data['person_image']
-        garment_url = data['garment_image']
-        product_info = data['product_info']
+        upload = read_tryon_request(request)
         
-        print(f"Processing: {product_info.get('name', 'Unknown Product')}")
+        # Output format from the Accept header (JPEG unless WebP/AVIF is asked for)
+        fmt = negotiate_format(request.headers.get('Accept'))
         
-        # Convert person image
-        if person_b64.startswith('data:'):
-            person_b64 = person_b64.split(',')[1]
-        person_bytes = base64.b64decode(person_b64)
-        
-        # Try Replicate API first
-        try:
-            result = call_replicate_tryon(person_bytes, garment_url)
-            if result:
-                print("Replicate API successful!")
-                return send_file(io.BytesIO(result), mimetype='image/jpeg')
-        except Exception as e:
-            print(f"Replicate failed: {e}")
-        
-        # Fallback to dramatic simulation
-        print("Using dramatic simulation fallback...")
-        result = create_dramatic_tryon(person_bytes, garment_url, product_info)
-        
-        img_io = io.BytesIO()
-        result.save(img_io, 'JPEG', quality=95)
-        img_io.seek(0)
-        
-        return send_file(img_io, mimetype='image/jpeg')
+        return image_response(render_tryon(upload, fmt), fmt)
         
+    except TryOnRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print(f"ERROR: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def render_tryon(upload, fmt, budget=TRYON_REMOTE_BUDGET):
+    """Encoded try-on result for an upload: Replicate within `budget` seconds, else the dramatic simulation"""
+    person_bytes = upload.person_bytes
+    garment_url = upload.garment_url
+    product_info = upload.product_info
+    
+    print(f"Processing: {product_info.get('name', 'Unknown Product')}")
+    
+    # Serve retries of the same photo + garment from the result cache
+    cache_key = result_cache.make_key(person_bytes, upload.garment_ref, product_info,
+                                      engine='replicate_tryon', **variant_key(fmt, 'high'))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print("Result cache hit")
+        return cached
+    
+    # Try Replicate API first
+    report_stage('remote_model')
+    try:
+        garment_input = garment_url
+        if garment_input is None:
+            # Uploaded garment: Replicate accepts data URLs as well as links
+            garment_input = "data:image/jpeg;base64," + base64.b64encode(upload.garment_bytes).decode('utf-8')
+        with deadline_scope(budget):
+            result = call_replicate_tryon(person_bytes, garment_input)
+        if result:
+            print("Replicate API successful!")
+            report_stage('encode')
+            result = transcode_image(result, fmt, 'high')
+            result_cache.put(cache_key, result)
+            return result
+    except Exception as e:
+        print(f"Replicate failed: {e}")
+    
+    # Fallback to dramatic simulation, cached under its own key: the Replicate key is
+    # only ever filled by Replicate, so later requests and jobs try it again
+    fallback_key = result_cache.make_key(person_bytes, upload.garment_ref, product_info,
+                                         engine='replicate_tryon.simulation', **variant_key(fmt, 'high'))
+    cached = result_cache.get(fallback_key)
+    if cached is not None:
+        print("Simulation cache hit")
+        return cached
+    
+    print("Using dramatic simulation fallback...")
+    result = create_dramatic_tryon(person_bytes, upload.garment_ref, product_info)
+    
+    report_stage('encode')
+    body = encode_image(result, fmt, 'high')
+    result_cache.put(fallback_key, body)
+    return body
+
+# POST /api/jobs: Replicate's polling runs on the queue's workers instead of an HTTP thread
+job_queue = tryon_job_queue('replicate_tryon', render_tryon)
+add_job_routes(app, job_queue)
+
+@app.route('/api/remote-stats', methods=['GET'])
+def remote_stats():
+    return jsonify({'breakers': breaker_stats()})
+
+@timed('remote_call')
 def call_replicate_tryon(person_bytes, garment_url):
-    """Call Replicate API for virtual try-on"""
+    """Call Replicate API for virtual try-on (None when it fails, is out of budget or its breaker is open)"""
+    if not replicate_breaker.allow():
+        print("Replicate circuit open, skipping")
+        return None
+    
+    cap = timeout = None
     try:
         # Convert person image to data URL
         person_b64 = base64.b64encode(person_bytes).decode('utf-8')
@@ -71,54 +143,67 @@ def call_replicate_tryon(person_bytes, garment_url):
             "Content-Type": "application/json"
         }
         
+        # Every timeout below is cut to what is left of the request's budget
+        cap = 60
+        timeout = remote_timeout(cap)
         response = requests.post(
             "https://api.replicate.com/v1/predictions",
             json=payload,
             headers=headers,
-            timeout=60
+            timeout=timeout
         )
         
         if response.status_code == 201:
             prediction = response.json()
             prediction_url = prediction['urls']['get']
             
-            # Poll for result
-            for _ in range(30):  # Wait up to 5 minutes
-                time.sleep(10)
-                result_response = requests.get(prediction_url, headers=headers)
+            # Poll for result until the budget runs out (DeadlineExceeded ends the loop)
+            cap = 30
+            while True:
+                time.sleep(remote_timeout(10))
+                timeout = remote_timeout(cap)
+                result_response = requests.get(prediction_url, headers=headers, timeout=timeout)
                 result_data = result_response.json()
                 
                 if result_data['status'] == 'succeeded':
                     output_url = result_data['output']
-                    img_response = requests.get(output_url)
+                    timeout = remote_timeout(cap)
+                    img_response = requests.get(output_url, timeout=timeout)
+                    replicate_breaker.record_success()
                     return img_response.content
                 elif result_data['status'] == 'failed':
-                    break
+                    # Replicate answered; the prediction itself failed
+                    replicate_breaker.record_success()
+                    return None
         
+        replicate_breaker.record_failure(f"HTTP {response.status_code}")
         return None
         
+    except DeadlineExceeded as e:
+        print(f"Replicate out of budget: {e}")
+        replicate_breaker.record_abandoned()
+        return None
+    except requests.Timeout as e:
+        print(f"Replicate timed out: {e}")
+        if timeout < cap:
+            # Cut short by the request budget, not Replicate's fault
+            replicate_breaker.record_abandoned()
+        else:
+            replicate_breaker.record_failure(e)
+        return None
     except Exception as e:
         print(f"Replicate API error: {e}")
+        replicate_breaker.record_failure(e)
         return None
 
-def create_dramatic_tryon(person_bytes, garment_url, product_info):
-    """Create dramatic virtual try-on that's clearly visible"""
-    
-    # Load person image
-    person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-    
-    # Download garment
-    garment_response = requests.get(garment_url, timeout=10)
-    garment_img = Image.open(io.BytesIO(garment_response.content)).convert('RGB')
-    
-    # Convert to arrays
+@at_working_resolution
+@cached_person_analysis('replicate_tryon.shirt_region')
+@timed('detection')
+def detect_shirt_region(person_np):
+    """Bounding box (x, y, w, h) of the light blue shirt, padded, or None"""
     import cv2
     import numpy as np
     
-    person_np = np.array(person_img)
-    garment_np = np.array(garment_img)
-    
-    # Detect shirt area (look for light blue)
     hsv = cv2.cvtColor(person_np, cv2.COLOR_RGB2HSV)
     lower_blue = np.array([90, 30, 100])
     upper_blue = np.array([130, 255, 255])
@@ -127,20 +212,48 @@ def create_dramatic_tryon(person_bytes, garment_url, product_info):
     # Find largest contour
     contours, _ = cv2.findContours(blue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    if contours:
-        largest_contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(largest_contour)
-        
-        # Expand area
-        padding = 30
-        x = max(0, x - padding)
-        y = max(0, y - padding)
-        w = min(person_np.shape[1] - x, w + 2*padding)
-        h = min(person_np.shape[0] - y, h + 2*padding)
+    if not contours:
+        return None
+    
+    largest_contour = max(contours, key=cv2.contourArea)
+    x, y, w, h = cv2.boundingRect(largest_contour)
+    
+    # Expand area
+    padding = 30
+    x = max(0, x - padding)
+    y = max(0, y - padding)
+    w = min(person_np.shape[1] - x, w + 2*padding)
+    h = min(person_np.shape[0] - y, h + 2*padding)
+    
+    return (x, y, w, h)
+
+def create_dramatic_tryon(person_bytes, garment_ref, product_info):
+    """Create dramatic virtual try-on that's clearly visible (garment_ref: URL or uploaded bytes)"""
+    
+    # Load person image
+    report_stage('decode')
+    person_np = decode_person(person_bytes)
+    
+    # Download garment (or decode the uploaded one); the fetched array is shared and read-only
+    if isinstance(garment_ref, str):
+        garment_np = garment_fetcher.fetch_image(garment_ref)
+    else:
+        garment_np = decode_garment(garment_ref)
+    
+    import cv2
+    import numpy as np
+    
+    # Detect shirt area (look for light blue)
+    report_stage('detect_body')
+    shirt_region = detect_shirt_region(person_np)
+    
+    if shirt_region:
+        x, y, w, h = shirt_region
         
         print(f"Replacing shirt at: {x}, {y}, {w}, {h}")
         
         # Create dramatic replacement
+        report_stage('apply_garment')
         result = person_np.copy()
         
         # Resize garment
@@ -166,7 +279,10 @@ def create_dramatic_tryon(person_bytes, garment_url, product_info):
                 garment_resized[:, :, c] * mask * 0.9
             ).astype(np.uint8)
         
+        report_preview(result)
+        
         # Add dramatic border for visibility
+        report_stage('overlay')
         cv2.rectangle(result, (x, y), (x+w, y+h), (255, 0, 0), 4)
         
         # Add text overlay
@@ -0,0 +1,330 @@
+"""Admission control: bounded concurrency per engine and per-client rate limits.
+
+Every try-on engine gets an AdmissionController. At most `max_in_flight`
+requests run at once; up to `max_queued` more wait in FIFO order for at most
+`queue_timeout` seconds. Anything beyond that is refused at once with
+AdmissionRejected, which the HTTP layers turn into 429 + Retry-After. Under a
+spike a few requests are shed quickly instead of every request queueing until
+it times out. A finishing request hands its slot straight to the oldest
+waiter, so late arrivals can't overtake the queue.
+
+A RateLimiter adds a token bucket per client (IP address) on top. It is off
+unless RATE_LIMIT_PER_MINUTE is set.
+
+Configuration (environment variables):
+    ADMISSION_MAX_IN_FLIGHT - requests an engine runs at once (default: 2 x cores)
+    ADMISSION_MAX_QUEUED    - requests that may wait for a slot (default: 16)
+    ADMISSION_QUEUE_TIMEOUT - seconds a request waits for a slot before 429 (default: 10)
+    RATE_LIMIT_PER_MINUTE   - sustained requests per client per minute, 0 = no limit (default: 0)
+    RATE_LIMIT_BURST        - requests a client may send at once on top of that (default: 10)
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted; retry after `retry_after` seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('wake', 'granted')
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class AdmissionController:
+    """Bounded in-flight count with a bounded, deadline-limited FIFO wait queue.
+
+    Usable from threads (admit()) and from asyncio (admit_async()); both share
+    the same slots.
+    """
+
+    def __init__(self, name, max_in_flight=None, max_queued=None, queue_timeout=None):
+        self.name = name
+        self.max_in_flight = max(1, max_in_flight or _env_number('ADMISSION_MAX_IN_FLIGHT', 2 * (os.cpu_count() or 1)))
+        self.max_queued = max(0, max_queued if max_queued is not None else _env_number('ADMISSION_MAX_QUEUED', 16))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else \
+            _env_number('ADMISSION_QUEUE_TIMEOUT', 10, float)
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = deque()
+
+        self._admitted = 0
+        self._queued = 0
+        self._peak_queued = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._wait_ms = 0.0
+        self._service_s = None     # moving average of the time a slot is held
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: the queue ahead, divided over the slots"""
+        service = self._service_s if self._service_s is not None else 1.0
+        return max(1, min(60, math.ceil(service * (len(self._waiters) + 1) / self.max_in_flight)))
+
+    def _try_enter(self, wake):
+        """Under the lock: None if admitted now, a queued _Waiter otherwise; raises when full"""
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            self._admitted += 1
+            return None
+        if len(self._waiters) >= self.max_queued:
+            self._rejected_full += 1
+            raise AdmissionRejected(f"{self.name} is at capacity", self.retry_after())
+        waiter = _Waiter(wake)
+        self._waiters.append(waiter)
+        self._queued += 1
+        self._peak_queued = max(self._peak_queued, len(self._waiters))
+        return waiter
+
+    def _give_up(self, waiter, started):
+        """Under the lock: drop a waiter whose wait ended; True if it was granted a slot meanwhile"""
+        self._wait_ms += (time.monotonic() - started) * 1000
+        if waiter.granted:
+            return True
+        self._waiters.remove(waiter)
+        return False
+
+    def release(self, held_seconds=None):
+        with self._lock:
+            if held_seconds is not None:
+                self._service_s = held_seconds if self._service_s is None else \
+                    self._service_s * 0.9 + held_seconds * 0.1
+            if self._waiters:
+                # Hand the slot over; the in-flight count stays the same
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self._admitted += 1
+                waiter.wake()
+            else:
+                self._in_flight -= 1
+
+    def acquire(self, timeout=None):
+        """Block until a slot is free (at most `timeout`, default queue_timeout); raises AdmissionRejected"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        event = threading.Event()
+        with self._lock:
+            waiter = self._try_enter(event.set)
+        if waiter is None:
+            return
+        started = time.monotonic()
+        event.wait(timeout)
+        with self._lock:
+            if self._give_up(waiter, started):
+                return
+            self._rejected_timeout += 1
+        raise AdmissionRejected(f"Timed out waiting for {self.name}", self.retry_after())
+
+    async def acquire_async(self, timeout=None):
+        """Coroutine version of acquire(); a cancelled waiter gives back a slot it was handed"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        with self._lock:
+            waiter = self._try_enter(wake)
+        if waiter is None:
+            return
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                handed_over = self._give_up(waiter, started)
+            if handed_over:
+                self.release()
+            raise
+        with self._lock:
+            if self._give_up(waiter, started):
+                return
+            self._rejected_timeout += 1
+        raise AdmissionRejected(f"Timed out waiting for {self.name}", self.retry_after())
+
+    @contextmanager
+    def admit(self, timeout=None):
+        self.acquire(timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def admit_async(self, timeout=None):
+        await self.acquire_async(timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        with self._lock:
+            waited = self._queued - len(self._waiters)
+            return {
+                'name': self.name,
+                'max_in_flight': self.max_in_flight,
+                'max_queued': self.max_queued,
+                'queue_timeout': self.queue_timeout,
+                'in_flight': self._in_flight,
+                'queue_depth': len(self._waiters),
+                'peak_queue_depth': self._peak_queued,
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'rejected_full': self._rejected_full,
+                'rejected_timeout': self._rejected_timeout,
+                'avg_wait_ms': round(self._wait_ms / waited, 1) if waited else 0.0,
+                'avg_service_ms': round(self._service_s * 1000, 1) if self._service_s is not None else None
+            }
+
+
+class RateLimiter:
+    """Token bucket per client: `rate` requests per second sustained, `burst` at once"""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # client -> (tokens, last refill), least recently seen first
+        self._allowed = 0
+        self._limited = 0
+
+    def check(self, client):
+        """Take a token for `client`: 0 if allowed, else whole seconds until the next token"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                self._allowed += 1
+                wait = 0
+            else:
+                self._buckets[client] = (tokens, now)
+                self._limited += 1
+                wait = max(1, math.ceil((1 - tokens) / self.rate))
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate_per_minute': round(self.rate * 60, 2),
+                'burst': self.burst,
+                'clients': len(self._buckets),
+                'allowed': self._allowed,
+                'rate_limited': self._limited
+            }
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+_rate_limiter = None
+_rate_limiter_loaded = False
+
+
+def get_admission(name, **options):
+    """Process-wide AdmissionController for engine `name` (options apply on first use)"""
+    with _controllers_lock:
+        if name not in _controllers:
+            _controllers[name] = AdmissionController(name, **options)
+        return _controllers[name]
+
+
+def get_rate_limiter():
+    """Process-wide per-client RateLimiter, or None when RATE_LIMIT_PER_MINUTE is unset"""
+    global _rate_limiter, _rate_limiter_loaded
+    with _controllers_lock:
+        if not _rate_limiter_loaded:
+            per_minute = _env_number('RATE_LIMIT_PER_MINUTE', 0, float)
+            if per_minute > 0:
+                _rate_limiter = RateLimiter(per_minute / 60, _env_number('RATE_LIMIT_BURST', 10))
+            _rate_limiter_loaded = True
+        return _rate_limiter
+
+
+def admission_stats():
+    with _controllers_lock:
+        controllers = list(_controllers.values())
+        limiter = _rate_limiter
+    return {
+        'engines': {controller.name: controller.stats() for controller in controllers},
+        'rate_limit': limiter.stats() if limiter is not None else None
+    }
+
+
+def add_flask_admission(app, engine, paths=('/api/virtual-tryon',), rate_limited=('/api/jobs',)):
+    """Guard POSTs to `paths` of a Flask app with engine's AdmissionController.
+
+    POSTs to `paths` and `rate_limited` also take a token from the client's
+    bucket. Rejections answer 429 with Retry-After. GET /api/admission-stats
+    reports the counters.
+    """
+    from flask import g, jsonify, request
+
+    controller = get_admission(engine)
+
+    def too_many(message, retry_after):
+        response = jsonify({'error': message, 'retry_after': retry_after})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+
+    @app.before_request
+    def admit_request():
+        if request.method != 'POST' or (request.path not in paths and request.path not in rate_limited):
+            return None
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            wait = limiter.check(request.remote_addr)
+            if wait:
+                return too_many('Too many requests from this client', wait)
+        if request.path in paths:
+            try:
+                controller.acquire()
+            except AdmissionRejected as e:
+                print(f"🚦 Rejected {request.path}: {e}")
+                return too_many(str(e), e.retry_after)
+            g.admission_started = time.monotonic()
+        return None
+
+    @app.teardown_request
+    def release_slot(exc=None):
+        started = g.pop('admission_started', None)
+        if started is not None:
+            controller.release(time.monotonic() - started)
+
+    @app.route('/api/admission-stats', methods=['GET'])
+    def admission_stats_endpoint():
+        return jsonify(admission_stats())
+
+    return controller
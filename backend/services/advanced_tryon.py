@@ -1,19 +1,25 @@
 import cv2
 import numpy as np
 from PIL import Image
-import requests
-import io
+import mediapipe as mp
 import base64
 import json
+from services.pose_pool import get_pose_pool, compact_landmarks
+from services.person_cache import get_person_cache
+from services.image_io import decode_person, decode_garment
+from services.remote_client import get_remote_client, hf_model_url, hf_headers
 
 class AdvancedTryOnService:
     def __init__(self):
-        # Free AI models for virtual try-on
+        # Free AI models for virtual try-on (called through the shared async client)
         self.models = {
-            'cloth_segmentation': 'https://api-inference.huggingface.co/models/mattmdjaga/segformer_b2_clothes',
-            'pose_estimation': 'https://api-inference.huggingface.co/models/microsoft/table-transformer-structure-recognition',
-            'inpainting': 'https://api-inference.huggingface.co/models/runwayml/stable-diffusion-inpainting'
+            'cloth_segmentation': hf_model_url('mattmdjaga/segformer_b2_clothes'),
+            'pose_estimation': hf_model_url('microsoft/table-transformer-structure-recognition'),
+            'inpainting': hf_model_url('runwayml/stable-diffusion-inpainting')
         }
+        # Long-lived pose estimators, reused across requests instead of building a graph per call
+        self.mp_pose = mp.solutions.pose
+        self.pose_pool = get_pose_pool(static_image_mode=True, min_detection_confidence=0.5)
         
     async def advanced_virtual_tryon(self, person_bytes, garment_bytes, product_info=None):
         try:
@@ -36,11 +42,10 @@ class AdvancedTryOnService:
             # Convert to base64
             image_b64 = base64.b64encode(image_bytes).decode()
             
-            response = requests.post(
+            response = await get_remote_client().post_json(
                 self.models['cloth_segmentation'],
-                headers={"Authorization": "Bearer hf_demo"},  # Use demo token
-                json={"inputs": image_b64},
-                timeout=30
+                {"inputs": image_b64},
+                headers=hf_headers()  # hf_demo token unless HF_API_TOKEN is set
             )
             
             if response.status_code == 200:
@@ -57,8 +62,7 @@ class AdvancedTryOnService:
     
     async def _extract_garment_features(self, garment_bytes):
         """Extract garment features for better fitting"""
-        image = Image.open(io.BytesIO(garment_bytes))
-        image_np = np.array(image)
+        image_np = decode_garment(garment_bytes)
         
         # Extract color palette
         colors = self._extract_dominant_colors(image_np)
@@ -73,32 +77,30 @@ class AdvancedTryOnService:
             'colors': colors,
             'type': garment_type,
             'texture': texture,
-            'size': image.size
+            'size': (image_np.shape[1], image_np.shape[0])
         }
     
     async def _generate_tryon(self, person_bytes, garment_bytes, mask):
         """Generate realistic try-on using AI inpainting"""
+        # Decoded once; the fallback below reuses the same arrays
+        person_np = decode_person(person_bytes)
+        garment_np = decode_garment(garment_bytes)
+        
         try:
-            person_img = Image.open(io.BytesIO(person_bytes))
-            garment_img = Image.open(io.BytesIO(garment_bytes))
-            
             # Resize garment to fit person
-            fitted_garment = self._fit_garment_to_body(person_img, garment_img, mask)
+            fitted_garment = self._fit_garment_to_body(person_np, garment_np, mask)
             
             # Blend with proper lighting and shadows
-            result = self._advanced_blend(person_img, fitted_garment, mask)
+            result = self._advanced_blend(person_np, fitted_garment, mask)
             
             return result
             
         except Exception as e:
             print(f"Generation failed: {e}")
-            return await self._basic_overlay(person_bytes, garment_bytes)
+            return await self._basic_overlay(person_bytes, garment_bytes, person_np, garment_np)
     
-    def _fit_garment_to_body(self, person_img, garment_img, mask):
+    def _fit_garment_to_body(self, person_np, garment_np, mask):
         """Fit garment to body shape using perspective transformation"""
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
-        
         # Find body contours from mask
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
@@ -117,11 +119,8 @@ class AdvancedTryOnService:
         
         return garment_np
     
-    def _advanced_blend(self, person_img, garment_img, mask):
+    def _advanced_blend(self, person_np, garment_np, mask):
         """Advanced blending with lighting and shadow effects"""
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
-        
         # Create seamless blend
         result = person_np.copy()
         
@@ -185,7 +184,8 @@ class AdvancedTryOnService:
         curved_garment = cv2.remap(garment, map_x, map_y, cv2.INTER_LINEAR)
         return curved_garment
     
-    def _extract_dominant_colors(self, image):
+    @staticmethod
+    def _extract_dominant_colors(image):
         """Extract dominant colors from garment"""
         from sklearn.cluster import KMeans
         
@@ -196,10 +196,11 @@ class AdvancedTryOnService:
         colors = kmeans.cluster_centers_.astype(int)
         return [f"#{r:02x}{g:02x}{b:02x}" for r, g, b in colors]
     
-    def _classify_garment_type(self, image):
+    @staticmethod
+    def _classify_garment_type(image):
         """Classify garment type based on shape analysis"""
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        contours, _ = cv2.findContours(gray > 50, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours((gray > 50).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
         if contours:
             largest = max(contours, key=cv2.contourArea)
@@ -216,7 +217,8 @@ class AdvancedTryOnService:
         
         return 'unknown'
     
-    def _analyze_texture(self, image):
+    @staticmethod
+    def _analyze_texture(image):
         """Analyze garment texture"""
         gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
         
@@ -238,8 +240,7 @@ class AdvancedTryOnService:
     
     def _create_simple_mask(self, image_bytes):
         """Create simple clothing mask as fallback"""
-        image = Image.open(io.BytesIO(image_bytes))
-        image_np = np.array(image)
+        image_np = decode_person(image_bytes)
         
         # Simple torso region mask
         h, w = image_np.shape[:2]
@@ -250,30 +251,27 @@ class AdvancedTryOnService:
         
         return mask
     
-    async def _basic_overlay(self, person_bytes, garment_bytes):
-        """Improved overlay with pose detection"""
-        import mediapipe as mp
-        
-        person_img = Image.open(io.BytesIO(person_bytes))
-        garment_img = Image.open(io.BytesIO(garment_bytes))
-        
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
+    async def _basic_overlay(self, person_bytes, garment_bytes, person_np=None, garment_np=None):
+        """Improved overlay with pose detection (reuses the arrays when they were already decoded)"""
+        if person_np is None:
+            person_np = decode_person(person_bytes)
+        if garment_np is None:
+            garment_np = decode_garment(garment_bytes)
         
         # Use MediaPipe for pose detection
-        mp_pose = mp.solutions.pose
-        pose = mp_pose.Pose(static_image_mode=True, min_detection_confidence=0.5)
+        mp_pose = self.mp_pose
         
-        # Convert BGR to RGB for MediaPipe
-        rgb_image = cv2.cvtColor(person_np, cv2.COLOR_RGB2BGR)
-        results = pose.process(rgb_image)
+        # Decoded images are already RGB, as MediaPipe expects (landmarks are cached per person image)
+        landmarks = get_person_cache().get_or_compute(
+            person_np, 'advanced_tryon.pose_landmarks',
+            lambda: compact_landmarks(self.pose_pool.process(person_np))
+        )
         
         h, w = person_np.shape[:2]
         result = person_np.copy()
         
-        if results.pose_landmarks:
+        if landmarks:
             # Get key body points
-            landmarks = results.pose_landmarks.landmark
             
             # Shoulder points
             left_shoulder = landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER]
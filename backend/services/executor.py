@@ -0,0 +1,187 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from services.metrics import current_engine, pool_families, record_samples, run_collecting
+from services.person_cache import get_person_cache
+from services.pose_pool import pose_pool_stats
+from services.profiling import capture_profile, current_profile
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def process_stats():
+    """Stats of the per-process services that live wherever the pixel work runs"""
+    return {'pose_pools': pose_pool_stats(), 'person_cache': get_person_cache().stats()}
+
+
+def _run_task(engine, call, profile, report_stats):
+    """Runs on the pool: call() with its stage samples, a profile capture if asked,
+    and this worker's (pid, process_stats()) if asked"""
+    if not profile:
+        result, samples = run_collecting(engine, call)
+        capture = None
+    else:
+        (result, samples), capture = capture_profile(functools.partial(run_collecting, engine, call))
+    worker = (os.getpid(), process_stats()) if report_stats else None
+    return result, samples, capture, worker
+
+
+class TrackedPool:
+    """A concurrent.futures executor that keeps track of queued and running work"""
+
+    def __init__(self, name, executor, max_workers):
+        self.name = name
+        self.executor = executor
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._peak_pending = 0
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+
+        with self._lock:
+            self._pending += 1
+            self._submitted += 1
+            self._peak_pending = max(self._peak_pending, self._pending)
+
+        try:
+            result = await loop.run_in_executor(self.executor, call)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+
+        return result
+
+    def stats(self):
+        with self._lock:
+            pending = self._pending
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'running': min(pending, self.max_workers),
+                'queue_depth': max(0, pending - self.max_workers),
+                'peak_pending': self._peak_pending,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed
+            }
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+class TryOnExecutor:
+    """Executor layer that keeps CPU-bound pixel work and blocking I/O off the event loop.
+
+    Configuration (environment variables):
+        CPU_WORKERS    - size of the pixel-work pool (default: number of cores)
+        IO_WORKERS     - size of the blocking I/O thread pool (default: 16)
+        CPU_POOL_MODE  - 'process' (default) or 'thread' for the pixel-work pool
+    """
+
+    def __init__(self, cpu_workers=None, io_workers=None, cpu_mode=None):
+        cpu_workers = cpu_workers or _env_int('CPU_WORKERS', os.cpu_count() or 1)
+        io_workers = io_workers or _env_int('IO_WORKERS', 16)
+        cpu_mode = (cpu_mode or os.getenv('CPU_POOL_MODE', 'process')).lower()
+
+        if cpu_mode == 'process':
+            # spawn keeps MediaPipe/OpenCV threads from the parent out of the workers
+            cpu_executor = ProcessPoolExecutor(
+                max_workers=cpu_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            cpu_executor = ThreadPoolExecutor(
+                max_workers=cpu_workers, thread_name_prefix='tryon-cpu'
+            )
+
+        self.cpu_mode = cpu_mode
+        # Latest process_stats() of each CPU worker process, by pid
+        self._worker_stats = {}
+        self.cpu = TrackedPool('cpu', cpu_executor, cpu_workers)
+        self.io = TrackedPool(
+            'io',
+            ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='tryon-io'),
+            io_workers
+        )
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        """Run pixel work (decode, pose detection, blending, encoding).
+
+        With the process pool, fn and its arguments must be picklable, so pass
+        module-level functions such as the ones in services.tasks.
+        """
+        return await self._run_timed(self.cpu, fn, *args, **kwargs)
+
+    async def run_io(self, fn, *args, **kwargs):
+        """Run blocking I/O (remote model calls, downloads) on the thread pool"""
+        return await self._run_timed(self.io, fn, *args, **kwargs)
+
+    async def _run_timed(self, pool, fn, *args, **kwargs):
+        # Stage timings taken inside fn come back with its result, labelled with this
+        # request's engine; so does its profile when the request is being profiled
+        # CPU workers in process mode also report their pose pools and caches
+        session = current_profile()
+        report_stats = pool is self.cpu and self.cpu_mode == 'process'
+        result, samples, capture, worker = await pool.run(
+            _run_task, current_engine(), functools.partial(fn, *args, **kwargs), session is not None, report_stats
+        )
+        record_samples(samples)
+        if session is not None:
+            session.add(capture)
+        if worker is not None:
+            pid, stats = worker
+            self._worker_stats[pid] = stats
+        return result
+
+    def stats(self):
+        return {
+            'cpu_mode': self.cpu_mode,
+            'pools': {
+                'cpu': self.cpu.stats(),
+                'io': self.io.stats()
+            }
+        }
+
+    def worker_stats(self):
+        """process_stats() of the processes doing the pixel work, as {pid: stats}.
+
+        In process mode these are the CPU workers' reports from their latest
+        task (a worker that has not run one yet is not listed); in thread mode
+        it is this process.
+        """
+        if self.cpu_mode != 'process':
+            return {os.getpid(): process_stats()}
+        return dict(self._worker_stats)
+
+    def metrics(self):
+        """Pool utilization for the /metrics collector"""
+        return pool_families({'cpu': self.cpu.stats(), 'io': self.io.stats()})
+
+    def shutdown(self, wait=True):
+        self.cpu.shutdown(wait=wait)
+        self.io.shutdown(wait=wait)
@@ -0,0 +1,253 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from services.image_io import decode_garment
+
+
+def _env_mb(name, default):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default * 1024 * 1024
+    try:
+        return max(0, int(float(value) * 1024 * 1024))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default} MB")
+        return default * 1024 * 1024
+
+
+class GarmentEntry:
+    """A downloaded garment image plus the validators needed to revalidate it"""
+
+    def __init__(self, content, etag=None, last_modified=None, max_age=None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.max_age = max_age
+        self.fetched_at = time.monotonic()
+        # Bytes counted against the fetcher's budget (grows once the image is decoded)
+        self.charged = 0
+        self._image = None
+        self._image_lock = threading.Lock()
+
+    def is_fresh(self, default_max_age):
+        max_age = default_max_age if self.max_age is None else self.max_age
+        return time.monotonic() - self.fetched_at < max_age
+
+    def size(self):
+        """Memory held: the downloaded bytes plus the decoded array once there is one"""
+        image = self._image
+        return len(self.content) + (image.nbytes if image is not None else 0)
+
+    def image(self):
+        """Decoded RGB array, decoded once per entry and shared, so it is read-only"""
+        if self._image is None:
+            with self._image_lock:
+                if self._image is None:
+                    image = decode_garment(self.content)
+                    image.setflags(write=False)
+                    self._image = image
+        return self._image
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class GarmentFetcher:
+    """Shared garment downloader with a pooled keep-alive session and an LRU by URL.
+
+    Entries are served from memory while fresh (Cache-Control max-age, or
+    `max_age` seconds by default), then revalidated with If-None-Match /
+    If-Modified-Since. Concurrent requests for the same URL share one download.
+    The LRU is bounded by entry count and by bytes (downloaded plus decoded).
+
+    Configuration (environment variables):
+        GARMENT_CACHE_MEMORY_MB - byte budget of the LRU (default: 256)
+    """
+
+    def __init__(self, max_entries=256, max_bytes=None, max_age=300, timeout=10, pool_size=32, session=None):
+        self.max_entries = max_entries
+        self.max_bytes = _env_mb('GARMENT_CACHE_MEMORY_MB', 256) if max_bytes is None else max_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._flights = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._revalidated = 0
+        self._refetched = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    def fetch_bytes(self, url):
+        """Return the garment image bytes for url"""
+        return self._get_entry(url).content
+
+    def fetch_image(self, url):
+        """Return the decoded RGB garment array for url (shared and read-only; copy before modifying)"""
+        entry = self._get_entry(url)
+        image = entry.image()
+        with self._lock:
+            # Decoding made the entry bigger; charge it if it is still cached
+            if self._entries.get(url) is entry and entry.charged != entry.size():
+                self._bytes += entry.size() - entry.charged
+                entry.charged = entry.size()
+                self._evict()
+        return image
+
+    def _get_entry(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry.is_fresh(self.max_age):
+                self._entries.move_to_end(url)
+                self._hits += 1
+                return entry
+
+            flight = self._flights.get(url)
+            if flight is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                flight = _Flight()
+                self._flights[url] = flight
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.entry
+
+        try:
+            flight.entry = self._download(url, entry)
+            return flight.entry
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(url, None)
+            flight.done.set()
+
+    def _download(self, url, stale):
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers['If-None-Match'] = stale.etag
+            if stale.last_modified:
+                headers['If-Modified-Since'] = stale.last_modified
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 304 and stale is not None:
+            stale.fetched_at = time.monotonic()
+            stale.max_age = _max_age(response.headers, stale.max_age)
+            with self._lock:
+                self._revalidated += 1
+                self._store(url, stale)
+            return stale
+
+        response.raise_for_status()
+        entry = GarmentEntry(
+            response.content,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            max_age=_max_age(response.headers)
+        )
+
+        with self._lock:
+            if stale is None:
+                self._misses += 1
+            else:
+                self._refetched += 1
+            if _cacheable(response.headers):
+                self._store(url, entry)
+        return entry
+
+    def _store(self, url, entry):
+        # Caller holds self._lock
+        previous = self._entries.get(url)
+        if previous is not None:
+            self._bytes -= previous.charged
+        entry.charged = entry.size()
+        self._bytes += entry.charged
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        self._evict()
+
+    def _evict(self):
+        # Caller holds self._lock; an entry bigger than the whole budget is not kept either
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.charged
+            self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'revalidated': self._revalidated,
+                'refetched': self._refetched,
+                'coalesced': self._coalesced,
+                'evictions': self._evictions
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def _cache_control(headers):
+    return headers.get('Cache-Control', '').lower()
+
+
+def _cacheable(headers):
+    return 'no-store' not in _cache_control(headers)
+
+
+def _max_age(headers, default=None):
+    cache_control = _cache_control(headers)
+    if 'no-cache' in cache_control:
+        return 0
+    match = re.search(r'max-age=(\d+)', cache_control)
+    if match:
+        return int(match.group(1))
+    return default
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_garment_fetcher():
+    """Return the process-wide garment fetcher"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = GarmentFetcher()
+        return _fetcher
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from services.image_io import decode_garment
+
+ASSET_VERSION = 1
+
+# Builds of different assets may share a lock; the set stays fixed however many ids are seen
+BUILD_LOCK_STRIPES = 64
+
+
+def white_background_matte(garment_img):
+    """Alpha matte (float32, 0..1) that drops the white/light-gray product-photo background"""
+    # Pixels that are white or light gray/off-white in every channel are background
+    white_mask = np.all(garment_img >= 240, axis=2)
+    light_mask = np.all(garment_img >= 220, axis=2)
+    shirt_mask = np.logical_not(np.logical_or(white_mask, light_mask))
+
+    # Clean up the mask
+    kernel = np.ones((5, 5), np.uint8)
+    shirt_mask_clean = cv2.morphologyEx(shirt_mask.astype(np.uint8) * 255, cv2.MORPH_CLOSE, kernel)
+    shirt_mask_clean = cv2.morphologyEx(shirt_mask_clean, cv2.MORPH_OPEN, kernel)
+
+    # Smooth edges
+    return cv2.GaussianBlur(shirt_mask_clean.astype(np.float32) / 255.0, (7, 7), 3)
+
+
+def enhance_texture(garment_img):
+    """Detail-enhanced garment used as fabric texture"""
+    return cv2.detailEnhance(garment_img, sigma_s=10, sigma_r=0.15)
+
+
+class GarmentAssets:
+    """Everything the engines derive from a garment image alone"""
+
+    def __init__(self, asset_id, rgb, alpha, enhanced, meta):
+        self.asset_id = asset_id
+        self.rgb = rgb
+        self.alpha = alpha
+        self.enhanced = enhanced
+        self.meta = meta
+
+    @property
+    def mean_color(self):
+        return np.array(self.meta['mean_color'], dtype=np.float64)
+
+    @property
+    def dominant_colors(self):
+        return self.meta['dominant_colors']
+
+    @property
+    def lab_stats(self):
+        return self.meta['lab_stats']
+
+    @property
+    def garment_type(self):
+        return self.meta['garment_type']
+
+    def resized(self, name, w, h, interpolation=cv2.INTER_LANCZOS4):
+        """Layer ('rgb', 'alpha' or 'enhanced') resized to w x h"""
+        return cv2.resize(getattr(self, name), (w, h), interpolation=interpolation)
+
+
+def _compute_assets(asset_id, rgb, source_hash):
+    from services.advanced_tryon import AdvancedTryOnService
+
+    rgb = np.ascontiguousarray(rgb)
+    alpha = white_background_matte(rgb)
+    enhanced = enhance_texture(rgb)
+
+    # Colour clustering on a subsample; the full image adds time, not accuracy
+    pixels = rgb.reshape(-1, 3)
+    step = max(1, len(pixels) // 20000)
+    dominant_colors = AdvancedTryOnService._extract_dominant_colors(pixels[::step].reshape(-1, 1, 3))
+
+    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB).reshape(-1, 3).astype(np.float64)
+    enhanced_lab = cv2.cvtColor(enhanced, cv2.COLOR_RGB2LAB).reshape(-1, 3).astype(np.float64)
+
+    meta = {
+        'version': ASSET_VERSION,
+        'asset_id': asset_id,
+        'source_hash': source_hash,
+        'size': [int(rgb.shape[1]), int(rgb.shape[0])],
+        'mean_color': np.mean(pixels, axis=0).tolist(),
+        'dominant_colors': dominant_colors,
+        'lab_stats': {
+            'mean': lab.mean(axis=0).tolist(),
+            'std': lab.std(axis=0).tolist(),
+            'enhanced_mean': enhanced_lab.mean(axis=0).tolist()
+        },
+        'garment_type': AdvancedTryOnService._classify_garment_type(rgb),
+        'texture': AdvancedTryOnService._analyze_texture(rgb),
+        'foreground_ratio': float(alpha.mean())
+    }
+    return GarmentAssets(asset_id, rgb, alpha, enhanced, meta)
+
+
+class GarmentAssetStore:
+    """Persistent store of precomputed garment assets, keyed by product id.
+
+    For each catalog item it keeps the decoded garment, the white-background
+    alpha matte, the detail-enhanced texture, dominant and mean colours, LAB
+    statistics and the garment classification. Build them ahead of time with
+    `python -m services.garment_store catalog.json`; anything missing is built
+    on first use and persisted.
+
+    Configuration (environment variables):
+        GARMENT_STORE_DIR - where assets are persisted (default: backend/.garment_assets)
+    """
+
+    def __init__(self, root=None, max_loaded=64):
+        self.root = root or os.getenv('GARMENT_STORE_DIR') or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.garment_assets'
+        )
+        self.max_loaded = max_loaded
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()
+        self._build_locks = [threading.Lock() for _ in range(BUILD_LOCK_STRIPES)]
+
+        self._hits = 0
+        self._disk_loads = 0
+        self._builds = 0
+
+    @staticmethod
+    def asset_id_for(product_info, garment_ref):
+        """Product id when the client sends one, otherwise a stable id derived from the garment URL/bytes"""
+        product_id = (product_info or {}).get('id')
+        if product_id:
+            return str(product_id)
+        if isinstance(garment_ref, (bytes, bytearray, memoryview)):
+            return 'bytes-' + hashlib.blake2b(garment_ref, digest_size=12).hexdigest()
+        return 'url-' + hashlib.blake2b(str(garment_ref).encode('utf-8'), digest_size=12).hexdigest()
+
+    def _dir(self, asset_id):
+        # Ids come from clients: the name is a hash (with a readable prefix), so no id
+        # can point outside the store ('..', '/', '\\' or a too long name)
+        readable = re.sub(r'[^A-Za-z0-9_-]', '_', asset_id)[:48]
+        digest = hashlib.blake2b(asset_id.encode('utf-8'), digest_size=12).hexdigest()
+        directory = os.path.join(self.root, f'{readable}-{digest}')
+        root = os.path.realpath(self.root)
+        if os.path.dirname(os.path.realpath(directory)) != root:
+            raise ValueError(f"Garment asset directory escapes the store: {asset_id!r}")
+        return directory
+
+    def get(self, asset_id, source_hash=None):
+        """Loaded assets for asset_id, or None when missing or built from a different image"""
+        with self._lock:
+            assets = self._loaded.get(asset_id)
+            if assets is not None and source_hash in (None, assets.meta['source_hash']):
+                self._loaded.move_to_end(asset_id)
+                self._hits += 1
+                return assets
+
+        assets = self._load(asset_id)
+        if assets is None or source_hash not in (None, assets.meta['source_hash']):
+            return None
+
+        with self._lock:
+            self._disk_loads += 1
+            self._remember(assets)
+        return assets
+
+    def get_or_build(self, asset_id, garment_bytes, garment_rgb=None):
+        """Assets for this garment, building and persisting them if needed"""
+        source_hash = hashlib.blake2b(garment_bytes, digest_size=16).hexdigest()
+        assets = self.get(asset_id, source_hash)
+        if assets is not None:
+            return assets
+
+        build_lock = self._build_locks[hash(asset_id) % len(self._build_locks)]
+
+        # One build per asset even when several requests miss at once
+        with build_lock:
+            assets = self.get(asset_id, source_hash)
+            if assets is not None:
+                return assets
+
+            if garment_rgb is None:
+                garment_rgb = decode_garment(garment_bytes)
+
+            assets = _compute_assets(asset_id, garment_rgb, source_hash)
+            self._save(assets)
+
+            with self._lock:
+                self._builds += 1
+                self._remember(assets)
+            return assets
+
+    def _remember(self, assets):
+        # Caller holds self._lock
+        self._loaded[assets.asset_id] = assets
+        self._loaded.move_to_end(assets.asset_id)
+        while len(self._loaded) > self.max_loaded:
+            self._loaded.popitem(last=False)
+
+    def _save(self, assets):
+        directory = self._dir(assets.asset_id)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            cv2.imwrite(os.path.join(directory, 'rgb.png'), cv2.cvtColor(assets.rgb, cv2.COLOR_RGB2BGR))
+            cv2.imwrite(os.path.join(directory, 'enhanced.png'), cv2.cvtColor(assets.enhanced, cv2.COLOR_RGB2BGR))
+            cv2.imwrite(os.path.join(directory, 'alpha.png'), np.round(assets.alpha * 255).astype(np.uint8))
+            # meta.json last: its presence marks a complete entry
+            tmp_path = os.path.join(directory, 'meta.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(assets.meta, f)
+            os.replace(tmp_path, os.path.join(directory, 'meta.json'))
+        except OSError as e:
+            print(f"⚠️ Could not persist garment assets for {assets.asset_id}: {e}")
+
+    def _load(self, asset_id):
+        directory = self._dir(asset_id)
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get('version') != ASSET_VERSION or meta.get('asset_id') != asset_id:
+            return None
+
+        rgb = cv2.imread(os.path.join(directory, 'rgb.png'), cv2.IMREAD_COLOR)
+        enhanced = cv2.imread(os.path.join(directory, 'enhanced.png'), cv2.IMREAD_COLOR)
+        alpha = cv2.imread(os.path.join(directory, 'alpha.png'), cv2.IMREAD_GRAYSCALE)
+        if rgb is None or enhanced is None or alpha is None:
+            return None
+
+        return GarmentAssets(
+            asset_id,
+            cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB),
+            alpha.astype(np.float32) / 255.0,
+            cv2.cvtColor(enhanced, cv2.COLOR_BGR2RGB),
+            meta
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                'root': self.root,
+                'loaded': len(self._loaded),
+                'hits': self._hits,
+                'disk_loads': self._disk_loads,
+                'builds': self._builds
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_garment_store():
+    """Return the process-wide garment asset store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = GarmentAssetStore()
+        return _store
+
+
+def build_catalog(catalog_path):
+    """Precompute assets for every item of a JSON catalog: [{"id": ..., "overlay_image_url": ...}, ...]"""
+    from services.garment_fetcher import get_garment_fetcher
+
+    with open(catalog_path) as f:
+        catalog = json.load(f)
+
+    store = get_garment_store()
+    fetcher = get_garment_fetcher()
+
+    for item in catalog:
+        url = item.get('overlay_image_url') or item.get('image_url') or item.get('image')
+        if not url:
+            print(f"⚠️ Skipping {item.get('id')}: no image URL")
+            continue
+        asset_id = store.asset_id_for(item, url)
+        try:
+            assets = store.get_or_build(asset_id, fetcher.fetch_bytes(url))
+            print(f"✅ {asset_id}: {assets.garment_type}, colors {assets.dominant_colors}")
+        except Exception as e:
+            print(f"❌ {asset_id}: {e}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python -m services.garment_store catalog.json")
+        sys.exit(1)
+    build_catalog(sys.argv[1])
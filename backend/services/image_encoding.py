@@ -0,0 +1,155 @@
+"""Result image encoding: format negotiation from Accept and per-endpoint quality presets.
+
+Configuration (environment variables):
+    TRYON_IMAGE_FORMATS    - formats the server may send (default: avif,webp,jpeg)
+    TRYON_IMAGE_PRESET     - force one preset (compact, standard, high) on every endpoint
+    TRYON_PROGRESSIVE_JPEG - 1 to send progressive JPEGs
+"""
+import io
+import os
+
+from PIL import Image, features
+
+from services.metrics import timed
+
+# Per-endpoint quality presets; WebP and AVIF reach JPEG quality at lower settings
+PRESETS = {
+    'compact': {'jpeg': 75, 'webp': 70, 'avif': 45},
+    'standard': {'jpeg': 90, 'webp': 82, 'avif': 60},
+    'high': {'jpeg': 95, 'webp': 90, 'avif': 72},
+}
+
+MIMETYPES = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+# Smallest output first: used when the client accepts several formats equally
+_PREFERENCE = ('avif', 'webp', 'jpeg')
+
+
+def _supported(fmt):
+    if fmt == 'jpeg':
+        return True
+    try:
+        return bool(features.check(fmt))
+    except (ValueError, KeyError):
+        # Older Pillow without the feature flag at all
+        return False
+
+
+def _enabled_formats():
+    configured = os.getenv('TRYON_IMAGE_FORMATS', 'avif,webp,jpeg')
+    enabled = [f.strip().lower() for f in configured.split(',') if f.strip()]
+    formats = [f for f in _PREFERENCE if f in enabled and _supported(f)]
+    return formats or ['jpeg']
+
+
+SUPPORTED_FORMATS = _enabled_formats()
+
+
+def _parse_accept(accept):
+    """{mimetype: q} for an Accept header"""
+    accepted = {}
+    for part in (accept or '').split(','):
+        fields = part.strip().split(';')
+        mimetype = fields[0].strip().lower()
+        if not mimetype:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[mimetype] = max(q, accepted.get(mimetype, 0.0))
+    return accepted
+
+
+def negotiate_format(accept):
+    """Best output format ('avif', 'webp' or 'jpeg') for an Accept header.
+
+    WebP and AVIF are only chosen when the client names them explicitly; a bare
+    `*/*` (what fetch() sends by default) gets JPEG, which every client decodes.
+    """
+    accepted = _parse_accept(accept)
+    if not accepted:
+        return 'jpeg'
+
+    best, best_q = 'jpeg', 0.0
+    for fmt in SUPPORTED_FORMATS:
+        mimetype = MIMETYPES[fmt]
+        if mimetype in accepted:
+            q = accepted[mimetype]
+        elif fmt == 'jpeg':
+            # JPEG is the fallback for image/* and */* too
+            q = max(accepted.get('image/*', 0.0), accepted.get('*/*', 0.0))
+        else:
+            q = 0.0
+        # Ties go to the smaller format (SUPPORTED_FORMATS is ordered by size)
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+
+def resolve_preset(preset):
+    """Preset name after the TRYON_IMAGE_PRESET override"""
+    override = os.getenv('TRYON_IMAGE_PRESET')
+    if override in PRESETS:
+        return override
+    return preset if preset in PRESETS else 'standard'
+
+
+def quality_for(fmt, preset='standard'):
+    return PRESETS[resolve_preset(preset)][fmt]
+
+
+def _progressive_default():
+    return os.getenv('TRYON_PROGRESSIVE_JPEG', '').lower() in ('1', 'true', 'yes')
+
+
+@timed('encode')
+def encode_image(image, fmt='jpeg', preset='standard', progressive=None):
+    """Encode a PIL image (or RGB ndarray) and return the bytes.
+
+    The encoder writes into one BytesIO and its value is returned without
+    re-wrapping, so callers can hand the bytes straight to the response.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(image)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    quality = quality_for(fmt, preset)
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+    elif fmt == 'avif':
+        image.save(buffer, format='AVIF', quality=quality, speed=8)
+    else:
+        if progressive is None:
+            progressive = _progressive_default()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=progressive)
+    return buffer.getvalue()
+
+
+def variant_key(fmt, preset='standard', progressive=None):
+    """What distinguishes two encodings of the same result (for result cache keys)"""
+    if progressive is None:
+        progressive = _progressive_default()
+    return {
+        'format': fmt,
+        'quality': quality_for(fmt, preset),
+        'progressive': bool(progressive) and fmt == 'jpeg'
+    }
+
+
+def transcode_image(data, fmt, preset='standard'):
+    """Re-encode a JPEG from a remote engine when the client negotiated another format"""
+    if fmt == 'jpeg':
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        return encode_image(image, fmt, preset)
@@ -0,0 +1,216 @@
+"""Image ingestion: one decode per upload into a contiguous uint8 RGB array.
+
+Every engine gets its person and garment images from decode_person() /
+decode_garment(), which:
+
+- check the dimensions in the header and reject decompression bombs before
+  any pixel is decoded;
+- when a smaller size is asked for (analysis copies, or TRYON_MAX_INPUT_SIDE),
+  decode large JPEGs straight to roughly that size using libjpeg DCT scaling
+  (1/2, 1/4, 1/8), never materialising the full frame;
+- apply the EXIF orientation, so phone photos come out upright;
+- flatten alpha onto white (transparent garment backgrounds read as the white
+  background the mattes expect) and expand grey/palette images to RGB;
+- return the decoder's own buffer as an RGB ndarray, with no PIL -> numpy copy.
+
+open_image() is the PIL variant, for code that needs a PIL image.
+
+Configuration (environment variables):
+    TRYON_MAX_INPUT_SIDE   - longest side photos are decoded to for try-on; results come out at this size (default: 0 = full size)
+    TRYON_MAX_INPUT_PIXELS - largest width x height accepted in an upload (default: 64000000, 0 = no limit)
+"""
+import io
+import math
+import os
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from services.metrics import timed
+
+# Enough for colour/body-type statistics and for vision-model uploads
+ANALYSIS_MAX_SIDE = 512
+LLM_MAX_SIDE = 1024
+
+_ORIENTATION_TAG = 0x0112
+_ALPHA_MODES = ('RGBA', 'LA', 'PA', 'RGBa', 'La')
+
+# Background that transparent pixels are flattened onto
+_BACKGROUND = 255
+
+
+class ImageTooLargeError(ValueError):
+    """The image header declares more pixels than TRYON_MAX_INPUT_PIXELS"""
+
+
+def _env_int(name, default):
+    value = os.getenv(name, str(default))
+    try:
+        return max(0, int(value))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def input_max_side():
+    # Off by default: results keep the photo's resolution, and detection already
+    # runs on a working-resolution copy (services/working_resolution.py)
+    return _env_int('TRYON_MAX_INPUT_SIDE', 0)
+
+
+def max_input_pixels():
+    return _env_int('TRYON_MAX_INPUT_PIXELS', 64000000)
+
+
+def _open_checked(data):
+    """Lazily opened PIL image (header only) after the size guard"""
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    width, height = image.size
+    limit = max_input_pixels()
+    if limit and width * height > limit:
+        image.close()
+        raise ImageTooLargeError(f"Image is {width}x{height}, more than {limit} pixels")
+    return image
+
+
+def _orientation(image):
+    try:
+        return image.getexif().get(_ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def _has_alpha(image):
+    return image.mode in _ALPHA_MODES or 'transparency' in image.info
+
+
+def open_image(data, max_side=None, mode='RGB'):
+    """Decode encoded image bytes to a loaded PIL image.
+
+    With max_side the result's longest side is at most max_side: JPEGs are
+    DCT-scaled during decode (1/2, 1/4 or 1/8) and the remainder is resized.
+    The EXIF orientation is applied, so phone photos come out upright, and
+    alpha is flattened onto white for RGB/L output.
+    """
+    image = _open_checked(data)
+
+    width, height = image.size
+    if max_side and max(width, height) > max_side and image.format == 'JPEG':
+        ratio = max_side / max(width, height)
+        # draft() picks the largest DCT reduction that stays at or above this size
+        image.draft('RGB' if mode != 'L' else 'L', (math.ceil(width * ratio), math.ceil(height * ratio)))
+
+    if _orientation(image) != 1:
+        image = ImageOps.exif_transpose(image)
+    else:
+        image.load()
+
+    if mode in ('RGB', 'L') and _has_alpha(image):
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (_BACKGROUND,) * 3)
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    if mode and image.mode != mode:
+        image = image.convert(mode)
+
+    if max_side and max(image.size) > max_side:
+        # The DCT step already did the heavy reduction; bilinear (antialiased) finishes the rest
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    return image
+
+
+def _jpeg_reduction(width, height, max_side):
+    """cv2 imread flag with the largest DCT reduction that stays >= max_side"""
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(width, height) / factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def _flatten_alpha(pixels):
+    """BGRA -> BGR over the white background"""
+    alpha = pixels[:, :, 3:4].astype(np.float32) / 255.0
+    flat = pixels[:, :, :3] * alpha + _BACKGROUND * (1.0 - alpha)
+    return np.ascontiguousarray(flat.round().astype(np.uint8))
+
+
+def _to_rgb(pixels):
+    """Any imdecode(IMREAD_UNCHANGED/COLOR) result as uint8 RGB, reusing the buffer where possible"""
+    if pixels.dtype == np.uint16:
+        pixels = (pixels >> 8).astype(np.uint8)
+    elif pixels.dtype != np.uint8:
+        pixels = cv2.normalize(pixels, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+    if pixels.ndim == 2:
+        return cv2.cvtColor(pixels, cv2.COLOR_GRAY2RGB)
+    if pixels.shape[2] == 4:
+        pixels = _flatten_alpha(pixels)
+    # In-place channel swap: OpenCV decodes to BGR
+    return cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB, dst=pixels)
+
+
+@timed('decode')
+def decode_rgb(data, max_side=None):
+    """Decode encoded image bytes to a contiguous uint8 RGB ndarray (H, W, 3).
+
+    Same guarantees as open_image() (size guard, DCT scaling, EXIF, alpha on
+    white), but the pixels come straight from OpenCV's decoder, so the only
+    full-size buffer is the one that is returned. Formats or orientations
+    OpenCV can't handle go through PIL instead.
+    """
+    header = _open_checked(data)
+    width, height = header.size
+    fmt = header.format
+    oriented = _orientation(header) != 1
+    alpha = _has_alpha(header)
+    header.close()
+
+    pixels = None
+    if fmt == 'JPEG':
+        # IMREAD_COLOR/REDUCED apply the EXIF orientation themselves
+        flag = _jpeg_reduction(width, height, max_side) if max_side else cv2.IMREAD_COLOR
+        pixels = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    elif not oriented:
+        flag = cv2.IMREAD_UNCHANGED if alpha else cv2.IMREAD_COLOR
+        pixels = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+    if pixels is None:
+        return np.array(open_image(data, max_side))
+
+    pixels = _to_rgb(pixels)
+    h, w = pixels.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        # After DCT scaling the remainder is under 2x, where bilinear is enough and ~6x faster than INTER_AREA
+        interpolation = cv2.INTER_AREA if scale < 0.5 else cv2.INTER_LINEAR
+        pixels = cv2.resize(pixels, size, interpolation=interpolation)
+    return pixels
+
+
+def decode_person(data):
+    """Person photo for the try-on pipelines as an RGB ndarray (capped at TRYON_MAX_INPUT_SIDE if set)"""
+    return decode_rgb(data, input_max_side())
+
+
+def decode_garment(data):
+    """Garment image for the try-on pipelines as an RGB ndarray (capped at TRYON_MAX_INPUT_SIDE if set)"""
+    return decode_rgb(data, input_max_side())
+
+
+def downscaled_jpeg(data, max_side=LLM_MAX_SIDE, quality=85):
+    """JPEG bytes no larger than max_side, for uploads to remote models.
+
+    Returns the original bytes when they are already a small enough JPEG.
+    """
+    with _open_checked(data) as probe:
+        if probe.format == 'JPEG' and max(probe.size) <= max_side:
+            return data
+
+    buffer = io.BytesIO()
+    open_image(data, max_side).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
@@ -0,0 +1,377 @@
+"""Persistent job queue for work too slow to run inside an HTTP request.
+
+A job is a small JSON `params` dict plus named binary inputs (e.g. the person
+photo). Both are written to a SQLite database before submit() returns, so
+queued jobs survive a restart; jobs that were running when the process died
+are queued again on the next start (up to MAX_ATTEMPTS times). A fixed pool
+of worker threads takes jobs oldest-first and runs handler(params, blobs),
+which returns (body, mimetype). The result is stored in the database, the
+inputs are dropped, and finished jobs are purged after JOB_RESULT_TTL.
+
+While a job runs, the stages its handler reports (services/progress.py) are
+kept in memory as an event list that events() waits on; the stage timings
+are stored with the job when it finishes. `params['preview']` turns on
+preview events.
+
+Configuration (environment variables):
+    JOB_WORKERS    - worker threads per queue (default: 2)
+    JOB_QUEUE_MAX  - queued jobs accepted before submit() refuses (default: 64)
+    JOB_RESULT_TTL - seconds a finished job and its result are kept (default: 3600)
+    JOB_DB_DIR     - directory of the queue databases (default: <tmp>/frenzy_vastra_jobs)
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from services.progress import ProgressReporter, progress_scope
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+MAX_ATTEMPTS = 3
+
+# Expired jobs (rows, results and in-memory events) are purged at most this often
+PURGE_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    mimetype TEXT,
+    error TEXT,
+    stages TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_blobs (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return max(1, cast(value))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+class JobQueueFull(RuntimeError):
+    """JOB_QUEUE_MAX jobs are already waiting"""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """SQLite-backed job queue drained by a bounded pool of worker threads.
+
+    Workers start on the first start() call, not at construction, so a
+    process that only imports the module (e.g. Flask's reloader parent)
+    never runs jobs.
+    """
+
+    def __init__(self, name, handler, workers=None, max_queued=None, result_ttl=None, db_path=None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers or _env_number('JOB_WORKERS', 2)
+        self.max_queued = max_queued or _env_number('JOB_QUEUE_MAX', 64)
+        self.result_ttl = result_ttl or _env_number('JOB_RESULT_TTL', 3600, float)
+        if db_path is None:
+            db_dir = os.getenv('JOB_DB_DIR') or os.path.join(tempfile.gettempdir(), 'frenzy_vastra_jobs')
+            os.makedirs(db_dir, exist_ok=True)
+            db_path = os.path.join(db_dir, f'{name}.sqlite3')
+        self.db_path = db_path
+
+        # One connection shared by all threads; the lock serialises every statement
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if 'stages' not in columns:
+            # Databases created before stage timings were recorded
+            self._db.execute("ALTER TABLE jobs ADD COLUMN stages TEXT")
+            self._db.commit()
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._threads = []
+        self._events = {}
+        self._stopping = False
+        self._last_purge = 0.0
+
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_ms = 0.0
+
+    def start(self):
+        """Requeue jobs interrupted by a restart and start the workers (idempotent)"""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            with self._db:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE status = ? AND attempts >= ?",
+                    (FAILED, time.time(), 'Interrupted too many times', RUNNING, MAX_ATTEMPTS)
+                )
+                resumed = self._db.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (QUEUED, RUNNING)
+                ).rowcount
+            if resumed:
+                print(f"🔁 Job queue {self.name}: resuming {resumed} interrupted job(s)")
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'{self.name}-job-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, params, blobs):
+        """Store a job and return its id. Raises JobQueueFull when JOB_QUEUE_MAX jobs are waiting."""
+        self.start()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                self._rejected += 1
+                raise JobQueueFull(f"{queued} jobs are already waiting in {self.name}")
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO jobs (id, status, params, created_at) VALUES (?, ?, ?, ?)",
+                    (job_id, QUEUED, json.dumps(params), time.time())
+                )
+                self._db.executemany(
+                    "INSERT INTO job_blobs (job_id, name, data) VALUES (?, ?, ?)",
+                    [(job_id, name, data) for name, data in blobs.items() if data is not None]
+                )
+            self._submitted += 1
+            self._changed.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        """Status dict of a job, or None if it is unknown (or already purged)"""
+        with self._lock:
+            return self._status(job_id)
+
+    def wait(self, job_id, timeout):
+        """get(), but first wait up to `timeout` seconds for the job to finish"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                status = self._status(job_id)
+                remaining = deadline - time.monotonic()
+                if status is None or status['status'] in (DONE, FAILED) or remaining <= 0:
+                    return status
+                self._changed.wait(remaining)
+
+    def events(self, job_id, after, timeout):
+        """(events[after:], status) of a job, waiting up to `timeout` seconds for a new event.
+
+        Events are dicts with an 'event' key: 'running', 'stage', 'preview',
+        then 'done' or 'failed'. Jobs finished before a restart have none.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                events = self._events.get(job_id, [])
+                status = self._status(job_id)
+                remaining = deadline - time.monotonic()
+                if len(events) > after or status is None or status['status'] in (DONE, FAILED) or remaining <= 0:
+                    return events[after:], status
+                self._changed.wait(remaining)
+
+    def _publish(self, job_id, event):
+        with self._lock:
+            self._events.setdefault(job_id, []).append(event)
+            self._changed.notify_all()
+
+    def result(self, job_id):
+        """(body, mimetype) of a finished job, or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.data, j.mimetype FROM jobs j JOIN job_blobs b ON b.job_id = j.id "
+                "WHERE j.id = ? AND j.status = ? AND b.name = 'result'", (job_id, DONE)
+            ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def _status(self, job_id):
+        # Caller holds self._lock
+        row = self._db.execute(
+            "SELECT status, created_at, started_at, finished_at, attempts, error, stages FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, created_at, started_at, finished_at, attempts, error, stages = row
+        info = {'job_id': job_id, 'status': status, 'created_at': created_at, 'attempts': attempts}
+        if status == QUEUED:
+            info['position'] = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, created_at)
+            ).fetchone()[0]
+        if started_at is not None:
+            info['started_at'] = started_at
+            info['queued_ms'] = round((started_at - created_at) * 1000, 1)
+        if finished_at is not None and started_at is not None:
+            info['finished_at'] = finished_at
+            info['run_ms'] = round((finished_at - started_at) * 1000, 1)
+        if stages:
+            info['stages'] = json.loads(stages)
+        if error:
+            info['error'] = error
+        return info
+
+    def _claim(self):
+        """Next queued job as (id, params, blobs), marked running; None if there is none"""
+        with self._lock:
+            while not self._stopping:
+                # On a timer, not only when idle: a queue that never drains still expires old jobs
+                self._purge_expired()
+                row = self._db.execute(
+                    "SELECT id, params FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._changed.wait(PURGE_INTERVAL)
+                    continue
+                job_id, params = row
+                with self._db:
+                    claimed = self._db.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 "
+                        "WHERE id = ? AND status = ?", (RUNNING, time.time(), job_id, QUEUED)
+                    ).rowcount
+                if not claimed:
+                    continue
+                blobs = {name: bytes(data) for name, data in self._db.execute(
+                    "SELECT name, data FROM job_blobs WHERE job_id = ?", (job_id,)
+                )}
+                self._events[job_id] = [{'event': 'running', 'attempt': self._status(job_id)['attempts']}]
+                self._changed.notify_all()
+                return job_id, json.loads(params), blobs
+        return None
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            job_id, params, blobs = job
+            started = time.perf_counter()
+            reporter = ProgressReporter(lambda event, job_id=job_id: self._publish(job_id, event),
+                                        preview=bool(params.get('preview')))
+            try:
+                with progress_scope(reporter):
+                    body, mimetype = self.handler(params, blobs)
+                outcome = {'status': DONE, 'body': body, 'mimetype': mimetype}
+            except Exception as e:
+                print(f"❌ Job {job_id} failed: {e}")
+                outcome = {'status': FAILED, 'error': str(e) or type(e).__name__}
+            
+            # A worker must outlive a job whose outcome cannot be stored
+            try:
+                self._finish(job_id, stages=reporter.finish(), **outcome)
+            except Exception as e:
+                print(f"❌ Job {job_id}: could not store its outcome: {e}")
+                self._abandon(job_id, f'Could not store the outcome: {e}')
+            finally:
+                with self._lock:
+                    self._total_ms += (time.perf_counter() - started) * 1000
+
+    def _finish(self, job_id, status, stages, body=None, mimetype=None, error=None):
+        with self._lock:
+            with self._db:
+                # Inputs are no longer needed once the job has an outcome
+                self._db.execute("DELETE FROM job_blobs WHERE job_id = ?", (job_id,))
+                if body is not None:
+                    self._db.execute(
+                        "INSERT INTO job_blobs (job_id, name, data) VALUES (?, 'result', ?)", (job_id, body)
+                    )
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, mimetype = ?, error = ?, stages = ? WHERE id = ?",
+                    (status, time.time(), mimetype, error, json.dumps(stages), job_id)
+                )
+            if status == DONE:
+                self._completed += 1
+            else:
+                self._failed += 1
+            self._events.setdefault(job_id, []).append({'event': status, **self._status(job_id)})
+            self._changed.notify_all()
+
+    def _abandon(self, job_id, error):
+        """Mark a job failed after _finish itself failed; it stays running (and resumes on restart) if even that fails"""
+        with self._lock:
+            self._failed += 1
+            try:
+                with self._db:
+                    self._db.execute("DELETE FROM job_blobs WHERE job_id = ? AND name = 'result'", (job_id,))
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                        (FAILED, time.time(), error, job_id)
+                    )
+            except sqlite3.Error as e:
+                print(f"❌ Job {job_id}: could not mark it failed either: {e}")
+            self._events.setdefault(job_id, []).append(
+                {'event': FAILED, 'job_id': job_id, 'status': FAILED, 'error': error}
+            )
+            self._changed.notify_all()
+
+    def _purge_expired(self):
+        # Caller holds self._lock
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        with self._db:
+            expired = [row[0] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, now - self.result_ttl)
+            )]
+            self._db.executemany("DELETE FROM job_blobs WHERE job_id = ?", [(job_id,) for job_id in expired])
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            self._events.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            finished = self._completed + self._failed
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'started': bool(self._threads),
+                'max_queued': self.max_queued,
+                'queued': counts.get(QUEUED, 0),
+                'running': counts.get(RUNNING, 0),
+                'done': counts.get(DONE, 0),
+                'failed': counts.get(FAILED, 0),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'errors': self._failed,
+                'rejected': self._rejected,
+                'avg_run_ms': round(self._total_ms / finished, 1) if finished else 0.0,
+                'db_path': self.db_path
+            }
+
+    def shutdown(self):
+        """Stop taking new jobs; a job already running finishes in the background"""
+        with self._lock:
+            self._stopping = True
+            self._changed.notify_all()
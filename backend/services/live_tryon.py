@@ -0,0 +1,238 @@
+"""Real-time webcam try-on: one MediaPipe Pose graph per connection in video mode.
+
+Stills go through PoseTryOnService, whose pooled graphs run full detection
+(static_image_mode=True, model_complexity=2) on every image. A live session
+instead owns a graph in tracking mode with the lighter full model: after the
+first detection MediaPipe follows the person from frame to frame from the
+previous landmarks, which skips the detector and keeps a 640x480 frame around
+30 ms on one core. The garment comes from
+the GarmentAssetStore (decoded pixels plus white-background alpha matte), so
+per frame the session only decodes, tracks, composites the ROI and encodes.
+
+The graph itself only runs on keyframes: a PoseTracker (services/pose_tracker.py)
+carries the landmarks across the frames in between with optical flow and
+smooths them with a One-Euro filter. While the clothing region moves by no
+more than LIVE_REUSE_PX the garment resized for the previous frame is reused
+as is, which also keeps it from shimmering when the person stands still.
+
+Configuration (environment variables):
+    LIVE_MODEL_COMPLEXITY - Pose model for live frames: 0 (lite, downloaded on first use),
+                            1 (full, bundled with mediapipe) or 2 (heavy) (default: 1)
+    LIVE_MAX_SIDE         - longest side frames are processed at (default: 640)
+    LIVE_JPEG_QUALITY     - JPEG quality of the frames sent back (default: 70)
+    LIVE_MAX_SESSIONS     - concurrent live connections per process (default: 4)
+    LIVE_REUSE_PX         - region movement (pixels) under which the previous garment fit is reused (default: 3)
+    TRACK_KEYFRAME_INTERVAL, TRACK_MIN_CONFIDENCE - see services/pose_tracker.py
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from services.image_io import decode_rgb
+from services.metrics import engine_scope, observe_stage
+from services.pose_tracker import PoseTracker
+from services.pose_tryon import PoseLandmark, clothing_region
+
+# Shoulders less visible than this are treated as "nobody in frame"
+MIN_SHOULDER_VISIBILITY = 0.5
+
+# Per-frame stages as they are named in /metrics
+LIVE_METRIC_STAGES = {'pose': 'detection', 'composite': 'blend', 'encode': 'encode'}
+
+
+def _env_int(name, default, minimum=1):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return max(minimum, int(value))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def live_max_sessions():
+    return _env_int('LIVE_MAX_SESSIONS', 4)
+
+
+class FrameMeter:
+    """Achieved frame rate and per-frame processing time over the last `window` seconds"""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._frames = deque()
+        self.frames = 0
+        self.dropped = 0
+
+    def record(self, process_ms):
+        now = time.monotonic()
+        self._frames.append((now, process_ms))
+        self.frames += 1
+        while self._frames and now - self._frames[0][0] > self.window:
+            self._frames.popleft()
+
+    def stats(self):
+        frames = list(self._frames)
+        if len(frames) > 1:
+            span = frames[-1][0] - frames[0][0]
+            fps = (len(frames) - 1) / span if span > 0 else 0.0
+        else:
+            fps = 0.0
+        return {
+            'fps': round(fps, 1),
+            'process_ms': round(sum(ms for _, ms in frames) / len(frames), 1) if frames else 0.0,
+            'frames': self.frames,
+            'dropped': self.dropped
+        }
+
+
+class LiveTryOnSession:
+    """Per-connection pose tracker and compositor; process_frame() must not run concurrently"""
+
+    def __init__(self, model_complexity=None, max_side=None, quality=None):
+        import mediapipe as mp
+
+        self.model_complexity = model_complexity if model_complexity is not None else \
+            min(2, _env_int('LIVE_MODEL_COMPLEXITY', 1, minimum=0))
+        self.max_side = max_side or _env_int('LIVE_MAX_SIDE', 640)
+        self.quality = quality or _env_int('LIVE_JPEG_QUALITY', 70)
+        self.reuse_px = _env_int('LIVE_REUSE_PX', 3, minimum=0)
+
+        # Video mode: detection only until a person is found, tracking afterwards.
+        # Smoothing is left to the tracker, which also sees the frames the graph skips.
+        self.pose = mp.solutions.pose.Pose(
+            static_image_mode=False,
+            model_complexity=self.model_complexity,
+            smooth_landmarks=False,
+            enable_segmentation=False,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        )
+        self.tracker = PoseTracker(self._run_pose)
+        self._lock = threading.Lock()
+        self._garment = None
+        self._fit = None
+        self.stage_ms = {}
+        self.fits_reused = 0
+
+    def set_garment(self, assets):
+        """Garment to composite from now on (GarmentAssets, or None for plain frames)"""
+        garment = None
+        if assets is not None:
+            # Shrink once to frame scale; per frame only a small resize is left
+            h, w = assets.rgb.shape[:2]
+            scale = min(1.0, self.max_side / max(h, w))
+            size = (max(1, round(w * scale)), max(1, round(h * scale)))
+            garment = (assets.resized('rgb', *size, cv2.INTER_AREA),
+                       assets.resized('alpha', *size, cv2.INTER_AREA))
+        with self._lock:
+            self._garment = garment
+
+    def _run_pose(self, frame):
+        # Read-only input lets MediaPipe use the buffer without copying it
+        frame.flags.writeable = False
+        results = self.pose.process(frame)
+        frame.flags.writeable = True
+        return results
+
+    def detect_region(self, frame, timestamp=None):
+        """Clothing region of the tracked person in an RGB frame, or None"""
+        landmarks = self.tracker.update(frame, time.monotonic() if timestamp is None else timestamp)
+        if landmarks is None:
+            return None
+        if min(landmarks[PoseLandmark.LEFT_SHOULDER].visibility,
+               landmarks[PoseLandmark.RIGHT_SHOULDER].visibility) < MIN_SHOULDER_VISIBILITY:
+            return None
+        h, w = frame.shape[:2]
+        return clothing_region(landmarks, w, h)
+
+    def process_frame(self, data):
+        """JPEG/PNG frame bytes in, composited JPEG bytes out"""
+        with engine_scope('live_tryon'):
+            return self._process_frame(data)
+
+    def _process_frame(self, data):
+        started = time.perf_counter()
+        frame = decode_rgb(data, self.max_side)
+        decoded = time.perf_counter()
+
+        region = self.detect_region(frame)
+        detected = time.perf_counter()
+
+        with self._lock:
+            garment = self._garment
+        if garment is not None and region is not None:
+            blend_garment(frame, *self._fit_garment(garment, region))
+        composited = time.perf_counter()
+
+        ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=frame),
+                                   [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("Could not encode frame")
+        finished = time.perf_counter()
+
+        self._record('decode', decoded - started)
+        self._record('pose', detected - decoded)
+        self._record('composite', composited - detected)
+        self._record('encode', finished - composited)
+        return encoded.tobytes()
+
+    def _fit_garment(self, garment, region):
+        """(region, garment, alpha) resized to the region, reusing the last fit for small movements"""
+        if self._fit is not None and self._fit[0] is garment:
+            _, fitted_region, rgb, alpha = self._fit
+            if max(abs(a - b) for a, b in zip(region, fitted_region)) <= self.reuse_px:
+                self.fits_reused += 1
+                return fitted_region, rgb, alpha
+        rgb, alpha = fit_garment(*garment, region)
+        self._fit = (garment, region, rgb, alpha)
+        return region, rgb, alpha
+
+    def stats(self):
+        """Tracker and garment-fit counters for the stats messages"""
+        return {**self.tracker.stats(), 'fits_reused': self.fits_reused}
+
+    def _record(self, stage, seconds):
+        # Exponential moving average, so the numbers follow the current scene
+        previous = self.stage_ms.get(stage, seconds * 1000)
+        self.stage_ms[stage] = round(previous * 0.9 + seconds * 1000 * 0.1, 2)
+        # decode_rgb reports 'decode' to /metrics itself
+        if stage in LIVE_METRIC_STAGES:
+            observe_stage(LIVE_METRIC_STAGES[stage], seconds)
+
+    def close(self):
+        self.pose.close()
+
+
+def fit_garment(garment_rgb, garment_alpha, region, strength=0.85):
+    """Garment (float32 RGB) and alpha (HxWx1, scaled by strength) resized to region (x1, y1, x2, y2)"""
+    x1, y1, x2, y2 = region
+    w, h = max(1, x2 - x1), max(1, y2 - y1)
+    # Bilinear is plenty at video sizes and several times faster than Lanczos
+    rgb = cv2.resize(garment_rgb, (w, h), interpolation=cv2.INTER_LINEAR).astype(np.float32)
+    alpha = cv2.resize(garment_alpha, (w, h), interpolation=cv2.INTER_LINEAR)[:, :, None] * strength
+    return rgb, alpha
+
+
+def blend_garment(frame, region, garment_rgb, alpha):
+    """Blend a garment fitted with fit_garment() into `region` of an RGB frame, in place"""
+    x1, y1, x2, y2 = region
+    if x2 <= x1 or y2 <= y1:
+        return frame
+
+    roi = frame[y1:y2, x1:x2]
+    # Match the garment to the scene lighting, as the still-image pipeline does
+    brightness = cv2.mean(cv2.cvtColor(roi, cv2.COLOR_RGB2GRAY))[0] / 255.0
+    blended = roi * (1.0 - alpha) + garment_rgb * (alpha * (brightness * 1.1))
+    np.clip(blended, 0, 255, out=blended)
+    roi[:] = blended.astype(np.uint8)
+    return frame
+
+
+def composite_garment(frame, garment_rgb, garment_alpha, region, strength=0.85):
+    """Blend an RGB garment with its alpha matte into region (x1, y1, x2, y2) of an RGB frame, in place"""
+    return blend_garment(frame, region, *fit_garment(garment_rgb, garment_alpha, region, strength))
@@ -0,0 +1,179 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from services.resilience import deadline_scope
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def normalize_prompt(prompt):
+    """Prompt text with whitespace collapsed and case folded, so cosmetic differences share an entry"""
+    return re.sub(r'\s+', ' ', prompt).strip().casefold()
+
+
+def response_key(model_url, payload):
+    """Cache key for a model call: the model plus its normalized JSON payload.
+
+    Text inputs are normalized with normalize_prompt(); long inputs (base64
+    images) are hashed rather than kept in the key.
+    """
+    inputs = payload.get('inputs')
+    if isinstance(inputs, str):
+        inputs = normalize_prompt(inputs) if len(inputs) < 4096 else \
+            hashlib.blake2b(inputs.encode(), digest_size=20).hexdigest()
+    body = json.dumps({**payload, 'inputs': inputs}, sort_keys=True, default=str)
+    return hashlib.blake2b(f"{model_url}\n{body}".encode(), digest_size=20).hexdigest()
+
+
+class LLMResponseCache:
+    """TTL cache for remote model responses with stale-while-revalidate.
+
+    A fresh entry is returned as-is. After `ttl` seconds it turns stale: it is
+    still returned immediately, and one background refresh replaces it. After
+    `ttl + stale_ttl` it is dropped and the next caller waits for the model.
+    Concurrent misses for one key share a single call. Only successful
+    responses are cached; when fetch() raises, callers fall back as before.
+
+    Configuration (environment variables):
+        LLM_CACHE_TTL         - seconds an answer is served without refreshing (default: 3600)
+        LLM_CACHE_STALE_TTL   - further seconds a stale answer is served while refreshing (default: 86400)
+        LLM_CACHE_MAX_ENTRIES - entries kept, least recently used evicted first (default: 2048)
+    """
+
+    def __init__(self, ttl=None, stale_ttl=None, max_entries=None):
+        self.ttl = ttl if ttl is not None else _env_number('LLM_CACHE_TTL', 3600, float)
+        self.stale_ttl = stale_ttl if stale_ttl is not None else _env_number('LLM_CACHE_STALE_TTL', 86400, float)
+        self.max_entries = max_entries if max_entries is not None else _env_number('LLM_CACHE_MAX_ENTRIES', 2048)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._refreshed = 0
+        self._refresh_errors = 0
+        self._evictions = 0
+
+    async def get_or_fetch(self, key, fetch):
+        """Cached response for key, calling `await fetch()` on a miss or in the background when stale"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                age = now - stored_at
+                if age <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return copy.deepcopy(value)
+                if age <= self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._stale_hits += 1
+                    self._revalidate(key, fetch)
+                    return copy.deepcopy(value)
+                del self._entries[key]
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._coalesced += 1
+            else:
+                self._misses += 1
+                flight = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+                self._flights[key] = flight
+
+        # shield: a caller that gives up must not cancel the call other callers wait on
+        return copy.deepcopy(await asyncio.shield(flight))
+
+    async def _fetch_and_store(self, key, fetch):
+        try:
+            value = await fetch()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def _revalidate(self, key, fetch):
+        # Caller holds self._lock; at most one refresh per key is in flight
+        if key in self._flights:
+            return
+        # Detached from the request that noticed the stale entry: not bound by its remote budget
+        with deadline_scope(None):
+            task = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+        self._flights[key] = task
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task):
+        if task.cancelled():
+            return
+        error = task.exception()
+        with self._lock:
+            if error is None:
+                self._refreshed += 1
+            else:
+                self._refresh_errors += 1
+        if error is not None:
+            # Keep serving the stale answer; the next stale hit tries again
+            print(f"⚠️ Background LLM refresh failed: {error}")
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._stale_hits + self._misses + self._coalesced
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'stale_ttl_seconds': self.stale_ttl,
+                'hits': self._hits,
+                'stale_hits': self._stale_hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'hit_ratio': round((self._hits + self._stale_hits) / lookups, 4) if lookups else 0.0,
+                'refreshed': self._refreshed,
+                'refresh_errors': self._refresh_errors,
+                'evictions': self._evictions
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Return the process-wide LLM response cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache()
+        return _cache
@@ -1,34 +1,66 @@
-import requests
+import asyncio
 import json
 import base64
 from PIL import Image
 import io
+from services.image_io import downscaled_jpeg
+from services.remote_client import get_remote_client, hf_model_url, hf_headers
+from services.llm_cache import get_llm_cache, response_key
+from services.metrics import stage_timer
 
 class LLMStylist:
     def __init__(self):
-        # Free LLM APIs
+        # Free LLM APIs (called through the shared async client, see services/remote_client.py)
         self.models = {
-            'vision': 'https://api-inference.huggingface.co/models/microsoft/DiT-base-finetuned-ade-512-512',
-            'text': 'https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium',
-            'style_analysis': 'https://api-inference.huggingface.co/models/google/vit-base-patch16-224'
+            'vision': hf_model_url('microsoft/DiT-base-finetuned-ade-512-512'),
+            'text': hf_model_url('microsoft/DialoGPT-medium'),
+            'style_analysis': hf_model_url('google/vit-base-patch16-224')
         }
+        # Answers repeat across users: served from cache, refreshed in the background
+        self.cache = get_llm_cache()
+    
+    async def _query_model(self, model, payload):
+        """JSON response of a model for payload, from the LLM cache when possible.
+        
+        Raises on transport errors, timeouts and non-200 answers, which are not cached.
+        """
+        url = self.models[model]
+        
+        async def fetch():
+            # Only real calls are timed; cache hits never get here
+            with stage_timer('remote_call'):
+                response = await get_remote_client().post_json(url, payload, headers=hf_headers())
+            if response.status_code != 200:
+                raise RuntimeError(f"{model} model returned HTTP {response.status_code}")
+            return response.json()
+        
+        return await self.cache.get_or_fetch(response_key(url, payload), fetch)
     
     async def analyze_style_with_llm(self, image_bytes, user_preferences=None):
-        """Use LLM to analyze style and provide recommendations"""
+        """Use LLM to analyze style and provide recommendations.
+        
+        The vision call comes first; the text recommendations and the outfit
+        suggestions both only need its result, so they run concurrently.
+        """
         try:
-            # Convert image to base64
-            image_b64 = base64.b64encode(image_bytes).decode()
+            # Vision models take small inputs: send a reduced JPEG, not the full photo
+            # (decoded off the event loop, which keeps serving other requests meanwhile)
+            small_jpeg = await asyncio.to_thread(downscaled_jpeg, image_bytes)
+            image_b64 = base64.b64encode(small_jpeg).decode()
             
             # Analyze image with vision model
             style_analysis = await self._analyze_image_style(image_b64)
             
-            # Generate style recommendations with LLM
-            recommendations = await self._generate_style_recommendations(style_analysis, user_preferences)
+            # Recommendations (LLM) and outfits depend only on the analysis
+            recommendations, outfit_suggestions = await asyncio.gather(
+                self._generate_style_recommendations(style_analysis, user_preferences),
+                self._suggest_complete_outfits(style_analysis)
+            )
             
             return {
                 'style_analysis': style_analysis,
                 'recommendations': recommendations,
-                'outfit_suggestions': await self._suggest_complete_outfits(style_analysis)
+                'outfit_suggestions': outfit_suggestions
             }
             
         except Exception as e:
@@ -38,17 +70,9 @@ class LLMStylist:
     async def _analyze_image_style(self, image_b64):
         """Analyze image style using vision model"""
         try:
-            response = requests.post(
-                self.models['vision'],
-                headers={"Authorization": "Bearer hf_demo"},
-                json={"inputs": image_b64},
-                timeout=30
-            )
+            result = await self._query_model('vision', {"inputs": image_b64})
+            return self._process_vision_result(result)
             
-            if response.status_code == 200:
-                result = response.json()
-                return self._process_vision_result(result)
-                
         except Exception as e:
             print(f"Vision analysis failed: {e}")
         
@@ -59,24 +83,16 @@ class LLMStylist:
         prompt = self._create_style_prompt(style_analysis, user_prefs)
         
         try:
-            response = requests.post(
-                self.models['text'],
-                headers={"Authorization": "Bearer hf_demo"},
-                json={
-                    "inputs": prompt,
-                    "parameters": {
-                        "max_length": 200,
-                        "temperature": 0.7,
-                        "do_sample": True
-                    }
-                },
-                timeout=30
-            )
+            result = await self._query_model('text', {
+                "inputs": prompt,
+                "parameters": {
+                    "max_length": 200,
+                    "temperature": 0.7,
+                    "do_sample": True
+                }
+            })
+            return self._process_llm_recommendations(result)
             
-            if response.status_code == 200:
-                result = response.json()
-                return self._process_llm_recommendations(result)
-                
         except Exception as e:
             print(f"LLM recommendation failed: {e}")
         
@@ -217,17 +233,9 @@ class LLMStylist:
         """
         
         try:
-            response = requests.post(
-                self.models['text'],
-                headers={"Authorization": "Bearer hf_demo"},
-                json={"inputs": prompt, "parameters": {"max_length": 300}},
-                timeout=30
-            )
+            result = await self._query_model('text', {"inputs": prompt, "parameters": {"max_length": 300}})
+            return self._format_styling_advice(result)
             
-            if response.status_code == 200:
-                result = response.json()
-                return self._format_styling_advice(result)
-                
         except Exception as e:
             print(f"Styling advice failed: {e}")
         
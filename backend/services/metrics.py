@@ -0,0 +1,456 @@
+"""Prometheus metrics (text exposition format) for the FastAPI app and the Flask engines.
+
+Request metrics come from the HTTP layer: main.py's middleware and
+add_flask_metrics() for the Flask engines. Per-stage latency comes from
+instrumentation hooks in the services and engines, for example
+`with stage_timer('detection'):` or `@timed('blend')`. Stages are labelled
+with the engine of the current request, which the HTTP layer sets with
+engine_scope(). Work on the executor's process pool collects its stage
+samples in the worker and sends them back with the task's result (see
+run_collecting), so the histograms of the serving process cover the pixel
+work too.
+
+Cache hit ratios, pool utilization, admission queues, breakers and job
+queues are read from the services' stats() when /metrics is scraped, so they
+add no cost per request.
+
+Stages: decode, detection, garment_fit, blend, overlay, encode, remote_call,
+style_analysis, recommendation.
+"""
+import contextvars
+import functools
+import inspect
+import math
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for labels, value in self._samples():
+            lines.append(f'{self.name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            series = [(dict(zip(self.labelnames, key)), list(counts), total, count)
+                      for key, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": _format_value(float(bound))})} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": "+Inf"})} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics plus collectors that report other components' stats at scrape time.
+
+    A collector is a callable returning [(name, type, help, [(labels, value), ...]), ...].
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets)
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+http_requests = REGISTRY.counter(
+    'http_requests_total', 'HTTP requests by engine, endpoint, method and status',
+    ('engine', 'endpoint', 'method', 'status'))
+http_latency = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time to answer HTTP requests (streamed bodies: until the last byte)',
+    ('engine', 'endpoint'))
+http_in_flight = REGISTRY.gauge(
+    'http_requests_in_flight', 'HTTP requests being served', ('engine', 'endpoint'))
+stage_latency = REGISTRY.histogram(
+    'tryon_stage_duration_seconds', 'Time spent in each processing stage, by engine',
+    ('engine', 'stage'), STAGE_BUCKETS)
+
+
+def metrics_text():
+    return REGISTRY.render()
+
+
+def record_request(engine, endpoint, method, status, seconds):
+    http_requests.inc(engine=engine, endpoint=endpoint, method=method, status=status)
+    http_latency.observe(seconds, engine=engine, endpoint=endpoint)
+
+
+# Engine of the request being served; stage samples are labelled with it
+_engine = contextvars.ContextVar('metrics_engine', default='unknown')
+
+# List that collects stage samples instead of recording them (process-pool workers)
+_collector = contextvars.ContextVar('metrics_stage_collector', default=None)
+
+
+@contextmanager
+def engine_scope(engine):
+    token = _engine.set(engine)
+    try:
+        yield
+    finally:
+        _engine.reset(token)
+
+
+def current_engine():
+    return _engine.get()
+
+
+def observe_stage(stage, seconds, engine=None, cpu_seconds=None):
+    engine = engine or _engine.get()
+    samples = _collector.get()
+    if samples is not None:
+        samples.append((engine, stage, seconds, cpu_seconds))
+    else:
+        stage_latency.observe(seconds, engine=engine, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time the block as `stage` of the current engine.
+
+    Collected samples also carry the process CPU time of the block, which is
+    only meaningful when the process runs one try-on at a time (benchmarks).
+    """
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started,
+                      cpu_seconds=time.process_time() - cpu_started)
+
+
+def timed(stage):
+    """Decorator: time every call of a function (or coroutine function) as `stage`"""
+
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def run_collecting(engine, call):
+    """Run call() for `engine` and return (result, stage samples), for work run in another process"""
+    samples = []
+    token = _collector.set(samples)
+    try:
+        with engine_scope(engine):
+            result = call()
+    finally:
+        _collector.reset(token)
+    return result, samples
+
+
+def record_samples(samples):
+    """Record stage samples returned by run_collecting"""
+    for engine, stage, seconds, _cpu_seconds in samples:
+        stage_latency.observe(seconds, engine=engine, stage=stage)
+
+
+def _family(name, kind, help, samples):
+    return (name, kind, help, list(samples))
+
+
+def _collect_caches():
+    """Hit/miss counters and hit ratios of the caches this process has loaded"""
+    sources = {
+        'result_cache': ('services.result_cache', 'get_result_cache'),
+        'person_cache': ('services.person_cache', 'get_person_cache'),
+        'llm_cache': ('services.llm_cache', 'get_llm_cache'),
+        'garment_fetcher': ('services.garment_fetcher', 'get_garment_fetcher'),
+        'garment_store': ('services.garment_store', 'get_garment_store')
+    }
+    hits, misses, ratios = [], [], []
+    for cache, (module_name, getter) in sources.items():
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        stats = getattr(module, getter)().stats()
+        if cache == 'result_cache':
+            cache_hits = sum(stats['hits'].values())
+        elif cache == 'llm_cache':
+            cache_hits = stats['hits'] + stats['stale_hits']
+        elif cache == 'garment_store':
+            cache_hits = stats['hits'] + stats['disk_loads']
+        else:
+            cache_hits = stats['hits']
+        cache_misses = stats['builds'] if cache == 'garment_store' else stats['misses']
+        lookups = cache_hits + cache_misses
+        labels = {'cache': cache}
+        hits.append((labels, cache_hits))
+        misses.append((labels, cache_misses))
+        ratios.append((labels, cache_hits / lookups if lookups else 0.0))
+    return [
+        _family('cache_hits_total', 'counter', 'Cache lookups answered from the cache', hits),
+        _family('cache_misses_total', 'counter', 'Cache lookups that had to compute or fetch', misses),
+        _family('cache_hit_ratio', 'gauge', 'Hits over lookups since start', ratios)
+    ]
+
+
+def _collect_services():
+    """Admission queues, circuit breakers, pose pools and the remote client, where loaded"""
+    families = []
+
+    admission = sys.modules.get('services.admission')
+    if admission is not None:
+        stats = admission.admission_stats()
+        engines = stats['engines'].values()
+        families += [
+            _family('admission_in_flight', 'gauge', 'Requests holding an admission slot',
+                    (({'engine': s['name']}, s['in_flight']) for s in engines)),
+            _family('admission_max_in_flight', 'gauge', 'Admission slots per engine',
+                    (({'engine': s['name']}, s['max_in_flight']) for s in engines)),
+            _family('admission_queue_depth', 'gauge', 'Requests waiting for an admission slot',
+                    (({'engine': s['name']}, s['queue_depth']) for s in engines)),
+            _family('admission_rejected_total', 'counter', 'Requests refused with 429',
+                    [({'engine': s['name'], 'reason': 'queue_full'}, s['rejected_full']) for s in engines] +
+                    [({'engine': s['name'], 'reason': 'queue_timeout'}, s['rejected_timeout']) for s in engines])
+        ]
+        if stats['rate_limit'] is not None:
+            families.append(_family('rate_limited_total', 'counter', 'Requests refused by the per-client rate limit',
+                                    [({}, stats['rate_limit']['rate_limited'])]))
+
+    resilience = sys.modules.get('services.resilience')
+    if resilience is not None:
+        breakers = resilience.breaker_stats()
+        states = {'closed': 0, 'half_open': 1, 'open': 2}
+        families += [
+            _family('circuit_breaker_state', 'gauge', 'Breaker state: 0 closed, 1 half-open, 2 open',
+                    (({'upstream': name}, states[s['state']]) for name, s in breakers.items())),
+            _family('circuit_breaker_failures_total', 'counter', 'Failed calls to the upstream',
+                    (({'upstream': name}, s['failures']) for name, s in breakers.items())),
+            _family('circuit_breaker_rejected_total', 'counter', 'Calls refused while the breaker was open',
+                    (({'upstream': name}, s['rejected']) for name, s in breakers.items()))
+        ]
+
+    pose_pool = sys.modules.get('services.pose_pool')
+    if pose_pool is not None:
+        pools = pose_pool.pose_pool_stats()
+        families += [
+            _family('pose_pool_size', 'gauge', 'Pose graphs a pool may hold',
+                    (({'pool': str(i)}, s['size']) for i, s in enumerate(pools))),
+            _family('pose_pool_in_use', 'gauge', 'Pose graphs checked out',
+                    (({'pool': str(i)}, s['in_use']) for i, s in enumerate(pools)))
+        ]
+
+    remote_client = sys.modules.get('services.remote_client')
+    if remote_client is not None:
+        # One client per event loop
+        clients = remote_client.remote_client_stats()
+        families += [
+            _family('remote_requests_in_flight', 'gauge', 'Remote model calls in flight',
+                    [({}, sum(c['in_flight'] for c in clients))]),
+            _family('remote_requests_total', 'counter', 'Remote model calls made',
+                    [({}, sum(c['requests'] for c in clients))])
+        ]
+    return families
+
+
+def pool_families(pools):
+    """Utilization gauges for TrackedPool stats ({name: stats})"""
+    return [
+        _family('pool_workers', 'gauge', 'Workers per pool',
+                (({'pool': name}, s['max_workers']) for name, s in pools.items())),
+        _family('pool_running', 'gauge', 'Tasks running on the pool',
+                (({'pool': name}, s['running']) for name, s in pools.items())),
+        _family('pool_queue_depth', 'gauge', 'Tasks waiting for a worker',
+                (({'pool': name}, s['queue_depth']) for name, s in pools.items())),
+        _family('pool_utilization', 'gauge', 'Running tasks over workers',
+                (({'pool': name}, s['running'] / s['max_workers']) for name, s in pools.items()))
+    ]
+
+
+def job_queue_families(stats):
+    labels = {'queue': stats['name']}
+    return [
+        _family('job_queue_jobs', 'gauge', 'Jobs by status',
+                [({**labels, 'status': status}, stats[status]) for status in ('queued', 'running', 'done', 'failed')]),
+        _family('job_queue_rejected_total', 'counter', 'Jobs refused because the queue was full',
+                [(labels, stats['rejected'])])
+    ]
+
+
+REGISTRY.register_collector(_collect_caches)
+REGISTRY.register_collector(_collect_services)
+
+
+def add_flask_metrics(app, engine):
+    """Request metrics and GET /metrics for a Flask engine"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_metrics():
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.metrics = (endpoint, time.perf_counter(), _engine.set(engine))
+        http_in_flight.inc(engine=engine, endpoint=endpoint)
+
+    @app.after_request
+    def record_request_metrics(response):
+        metrics = g.get('metrics')
+        if metrics is not None:
+            endpoint, started, _ = metrics
+            record_request(engine, endpoint, request.method, response.status_code,
+                           time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc=None):
+        metrics = g.pop('metrics', None)
+        if metrics is not None:
+            endpoint, _, token = metrics
+            http_in_flight.dec(engine=engine, endpoint=endpoint)
+            _engine.reset(token)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics_text(), content_type=CONTENT_TYPE)
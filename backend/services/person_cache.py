@@ -0,0 +1,216 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+class _PackedMask:
+    """A 2-D uint8 mask stored downsampled and PNG-compressed"""
+
+    def __init__(self, mask, max_side):
+        self.shape = mask.shape
+        h, w = mask.shape
+        scale = min(1.0, max_side / max(h, w)) if max_side else 1.0
+        small = mask
+        if scale < 1.0:
+            small = cv2.resize(mask, (max(1, int(w * scale)), max(1, int(h * scale))),
+                               interpolation=cv2.INTER_NEAREST)
+        ok, encoded = cv2.imencode('.png', np.ascontiguousarray(small))
+        if not ok:
+            raise ValueError("Could not encode mask")
+        self.png = encoded.tobytes()
+
+    def unpack(self):
+        small = cv2.imdecode(np.frombuffer(self.png, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        h, w = self.shape
+        if small.shape != self.shape:
+            small = cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+        return small
+
+
+def _pack(value, mask_side):
+    if isinstance(value, np.ndarray) and value.ndim == 2 and value.dtype == np.uint8:
+        return _PackedMask(value, mask_side)
+    if isinstance(value, dict):
+        return {k: _pack(v, mask_side) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_pack(v, mask_side) for v in value)
+    return value
+
+
+def _unpack(value):
+    if isinstance(value, _PackedMask):
+        return value.unpack()
+    if isinstance(value, dict):
+        return {k: _unpack(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unpack(v) for v in value)
+    return value
+
+
+_MISSING = object()
+
+
+class PersonAnalysisCache:
+    """Cache of person-image analysis (landmarks, body boxes, masks) keyed by image hash.
+
+    Detection is a pure function of the person photo, so trying a second
+    garment on the same photo can skip it. Results are stored serialized, with
+    2-D masks downsampled and PNG-compressed, and evicted by TTL and total size.
+
+    Configuration (environment variables):
+        PERSON_CACHE_MB        - total size budget (default: 64)
+        PERSON_CACHE_TTL       - seconds an entry stays valid (default: 1800)
+        PERSON_CACHE_MASK_SIDE - longest side of stored masks (default: 512)
+    """
+
+    def __init__(self, max_bytes=None, ttl=None, mask_side=None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            _env_number('PERSON_CACHE_MB', 64, float) * 1024 * 1024
+        )
+        self.ttl = ttl if ttl is not None else _env_number('PERSON_CACHE_TTL', 1800, float)
+        self.mask_side = mask_side if mask_side is not None else _env_number('PERSON_CACHE_MASK_SIDE', 512)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evictions = 0
+
+    @staticmethod
+    def image_key(image):
+        """Hash of a person image given as encoded bytes or a decoded ndarray"""
+        digest = hashlib.blake2b(digest_size=20)
+        if isinstance(image, np.ndarray):
+            digest.update(f"{image.shape}:{image.dtype}".encode())
+            digest.update(memoryview(np.ascontiguousarray(image)).cast('B'))
+        else:
+            digest.update(image)
+        return digest.hexdigest()
+
+    def get(self, image_key, kind):
+        key = (image_key, kind)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return _MISSING
+
+            stored_at, payload = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._drop(key)
+                self._expired += 1
+                self._misses += 1
+                return _MISSING
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+        return _unpack(pickle.loads(payload))
+
+    def put(self, image_key, kind, value):
+        payload = pickle.dumps(_pack(value, self.mask_side), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+
+        key = (image_key, kind)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic(), payload)
+            self._size += len(payload)
+
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._evictions += 1
+
+    def _drop(self, key):
+        # Caller holds self._lock
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def get_or_compute(self, image, kind, compute):
+        """Return the cached analysis of `kind` for image, running compute() on a miss"""
+        image_key = self.image_key(image)
+        value = self.get(image_key, kind)
+        if value is _MISSING:
+            value = compute()
+            self.put(image_key, kind, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'limit_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'expired': self._expired,
+                'evictions': self._evictions
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_person_cache():
+    """Return the process-wide person analysis cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PersonAnalysisCache()
+        return _cache
+
+
+def combined_stats(stats_by_pid):
+    """Totals of several processes' person caches ({pid: stats()}), with each process listed"""
+    processes = [{'pid': pid, **stats} for pid, stats in stats_by_pid.items()]
+    totals = {key: sum(p[key] for p in processes)
+              for key in ('entries', 'bytes', 'hits', 'misses', 'expired', 'evictions')}
+    lookups = totals['hits'] + totals['misses']
+    totals['hit_ratio'] = round(totals['hits'] / lookups, 4) if lookups else 0.0
+    return {**totals, 'processes': processes}
+
+
+def cached_person_analysis(kind):
+    """Decorator for detection functions whose first argument is the person image"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(image, *args, **kwargs):
+            return get_person_cache().get_or_compute(
+                image, (kind, args, tuple(sorted(kwargs.items()))),
+                lambda: fn(image, *args, **kwargs)
+            )
+        return wrapper
+    return decorator
@@ -0,0 +1,202 @@
+import multiprocessing.util
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+def _default_pool_size():
+    value = os.getenv('POSE_POOL_SIZE')
+    if value:
+        try:
+            return max(1, int(value))
+        except ValueError:
+            print(f"⚠️ Ignoring invalid POSE_POOL_SIZE={value!r}")
+    return os.cpu_count() or 1
+
+
+def _default_checkout_timeout():
+    value = os.getenv('POSE_CHECKOUT_TIMEOUT')
+    if value:
+        try:
+            return max(0.1, float(value))
+        except ValueError:
+            print(f"⚠️ Ignoring invalid POSE_CHECKOUT_TIMEOUT={value!r}")
+    return 30.0
+
+
+Landmark = namedtuple('Landmark', 'x y z visibility')
+
+
+def compact_landmarks(results):
+    """Plain, picklable copy of MediaPipe pose landmarks (indexable by PoseLandmark), or None"""
+    if not results.pose_landmarks:
+        return None
+    return [Landmark(lm.x, lm.y, lm.z, lm.visibility) for lm in results.pose_landmarks.landmark]
+
+
+class PosePool:
+    """Pool of MediaPipe Pose graphs with checkout/return semantics.
+
+    A Pose graph keeps per-call state and must not be used by two threads at
+    once, so every caller checks out its own instance. Instances are created
+    lazily, up to `size`, and reused afterwards.
+    """
+
+    def __init__(self, size=None, checkout_timeout=None, **pose_options):
+        self.size = size or _default_pool_size()
+        self.checkout_timeout = checkout_timeout or _default_checkout_timeout()
+        self.pose_options = pose_options
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._hits = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+
+    def _create(self):
+        import mediapipe as mp
+        return mp.solutions.pose.Pose(**self.pose_options)
+
+    def checkout(self, timeout=None):
+        """Take a Pose instance out of the pool, creating or waiting for one if needed.
+
+        Waits at most `timeout` seconds (default: `checkout_timeout`), then
+        raises TimeoutError. A waiter whose slot frees up because another
+        thread failed to build a graph builds one itself.
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Pose pool is closed")
+
+            self._checkouts += 1
+            started = None
+
+            while True:
+                if self._idle:
+                    if started is None:
+                        self._hits += 1
+                    else:
+                        self._wait_seconds += time.perf_counter() - started
+                    return self._idle.pop()
+
+                if self._created < self.size:
+                    # Reserve a slot, then build the graph outside the lock
+                    self._created += 1
+                    if started is not None:
+                        self._wait_seconds += time.perf_counter() - started
+                    break
+
+                if started is None:
+                    self._waits += 1
+                    started = time.perf_counter()
+                remaining = started + timeout - time.perf_counter()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise TimeoutError("Timed out waiting for a free Pose instance")
+                self._cond.wait(remaining)
+                if self._closed:
+                    raise RuntimeError("Pose pool is closed")
+
+        try:
+            return self._create()
+        except Exception:
+            # Give the slot back; a waiter wakes up and tries to build it
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, pose):
+        """Return a Pose instance to the pool"""
+        with self._cond:
+            if self._closed:
+                pose.close()
+                return
+            self._idle.append(pose)
+            self._cond.notify()
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        pose = self.checkout(timeout)
+        try:
+            yield pose
+        finally:
+            self.checkin(pose)
+
+    def process(self, image, timeout=None):
+        """Run pose detection on an RGB image using a pooled instance"""
+        with self.acquire(timeout) as pose:
+            return pose.process(image)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'idle': len(self._idle),
+                'in_use': self._created - len(self._idle),
+                'checkouts': self._checkouts,
+                'hits': self._hits,
+                'waits': self._waits,
+                'wait_seconds': round(self._wait_seconds, 4),
+                'timeouts': self._timeouts,
+                'options': dict(self.pose_options)
+            }
+
+    def close(self):
+        """Close idle instances; instances still checked out are closed on return"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+
+        for pose in idle:
+            pose.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pose_pool(**pose_options):
+    """Return the process-wide pool for a given Pose configuration.
+
+    Pools are shared by every service with the same options, so services must
+    not close them; close_pose_pools() releases them all at shutdown.
+    """
+    key = tuple(sorted(pose_options.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = PosePool(**pose_options)
+            _pools[key] = pool
+        return pool
+
+
+def pose_pool_stats():
+    with _pools_lock:
+        return [pool.stats() for pool in _pools.values()]
+
+
+def close_pose_pools():
+    """Close every pool in this process and release the native MediaPipe graphs"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
+
+
+# Runs at interpreter exit in the server process and, unlike atexit, also in
+# multiprocessing workers such as the CPU pool of services.executor.
+multiprocessing.util.Finalize(None, close_pose_pools, exitpriority=10)
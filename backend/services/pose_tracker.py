@@ -0,0 +1,177 @@
+"""Landmark tracking between pose detections for multi-frame input (webcam, video).
+
+Running the MediaPipe graph on every frame is most of the per-frame CPU. A
+PoseTracker runs it only on keyframes: every `keyframe_interval` frames, when
+there is nothing to track yet, or when tracking confidence drops. In between,
+landmarks are carried forward with sparse Lucas-Kanade optical flow (about a
+millisecond at 640x480). Every result passes through a One-Euro filter, which
+removes jitter when the person is still but follows fast movement without lag.
+
+Configuration (environment variables):
+    TRACK_KEYFRAME_INTERVAL - run the pose graph at least every N frames (default: 4, 1 = every frame)
+    TRACK_MIN_CONFIDENCE    - re-detect when tracked torso confidence falls below this (default: 0.6)
+"""
+import math
+import os
+
+import cv2
+import numpy as np
+
+from services.pose_pool import Landmark
+
+# Shoulders and hips: the points the clothing region is built from
+TORSO = (11, 12, 23, 24)
+
+_LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+)
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+class OneEuroFilter:
+    """One-Euro low-pass filter over an array of values (Casiez et al., CHI 2012).
+
+    The cutoff frequency rises with the speed of the signal: slow movement is
+    smoothed hard (min_cutoff), fast movement follows closely (beta).
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self._value = None
+        self._derivative = None
+        self._time = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, value, timestamp):
+        value = np.asarray(value, dtype=np.float64)
+        if self._value is None or timestamp <= self._time:
+            self._value = value
+            self._derivative = np.zeros_like(value)
+            self._time = timestamp
+            return value
+
+        dt = timestamp - self._time
+        derivative = (value - self._value) / dt
+        a_d = self._alpha(self.d_cutoff, dt)
+        self._derivative = a_d * derivative + (1 - a_d) * self._derivative
+
+        cutoff = self.min_cutoff + self.beta * np.abs(self._derivative)
+        a = self._alpha(cutoff, dt)
+        self._value = a * value + (1 - a) * self._value
+        self._time = timestamp
+        return self._value
+
+    def reset(self):
+        self._value = None
+
+
+class PoseTracker:
+    """Keyframe pose detection with optical-flow propagation and One-Euro smoothing.
+
+    `detect(frame)` runs the pose graph on an RGB frame and returns its
+    MediaPipe results; update() decides per frame whether to call it.
+    """
+
+    def __init__(self, detect, keyframe_interval=None, min_confidence=None, min_cutoff=1.0, beta=0.05):
+        self.detect = detect
+        self.keyframe_interval = max(1, keyframe_interval or _env_number('TRACK_KEYFRAME_INTERVAL', 4))
+        self.min_confidence = min_confidence if min_confidence is not None else \
+            _env_number('TRACK_MIN_CONFIDENCE', 0.6, float)
+        self.filter = OneEuroFilter(min_cutoff, beta)
+
+        self._gray = None
+        self._points = None        # (33, 2) pixel coordinates
+        self._visibility = None    # (33,)
+        self._since_keyframe = 0
+
+        self.motion = 0.0          # median landmark displacement in pixels since the last frame
+        self.detections = 0
+        self.tracked = 0
+        self.lost = 0
+
+    def update(self, frame, timestamp):
+        """Smoothed landmarks (Landmark list, normalized like MediaPipe's) for an RGB frame, or None"""
+        h, w = frame.shape[:2]
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+
+        tracked = None
+        if self._points is not None and self._since_keyframe < self.keyframe_interval - 1:
+            tracked = self._propagate(gray)
+
+        if tracked is None:
+            points, visibility = self._detect(frame, w, h)
+            self._since_keyframe = 0
+        else:
+            points, visibility = tracked
+            self._since_keyframe += 1
+
+        self._gray = gray
+        if points is None:
+            self.motion = 0.0
+            self._points = self._visibility = None
+            self.filter.reset()
+            return None
+
+        if self._points is not None:
+            self.motion = float(np.median(np.linalg.norm(points[list(TORSO)] - self._points[list(TORSO)], axis=1)))
+        smoothed = self.filter(points, timestamp)
+        self._points, self._visibility = points, visibility
+        return [Landmark(x / w, y / h, 0.0, v) for (x, y), v in zip(smoothed, visibility)]
+
+    def _detect(self, frame, w, h):
+        self.detections += 1
+        results = self.detect(frame)
+        if not results.pose_landmarks:
+            return None, None
+        landmarks = results.pose_landmarks.landmark
+        points = np.array([(lm.x * w, lm.y * h) for lm in landmarks], dtype=np.float32)
+        visibility = np.array([lm.visibility for lm in landmarks], dtype=np.float32)
+        return points, visibility
+
+    def _propagate(self, gray):
+        """Landmarks moved along the optical flow, or None when the torso can't be followed"""
+        previous = self._points.reshape(-1, 1, 2).astype(np.float32)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, previous, None, **_LK_PARAMS)
+        status = status.reshape(-1).astype(bool)
+
+        # Confidence: visibility of the torso points that were followed successfully
+        torso = list(TORSO)
+        confidence = float(np.mean(self._visibility[torso] * status[torso]))
+        if confidence < self.min_confidence:
+            self.lost += 1
+            return None
+
+        moved = moved.reshape(-1, 2)
+        # Points the flow lost move with the rest of the body
+        shift = np.median(moved[status] - self._points[status], axis=0)
+        points = np.where(status[:, None], moved, self._points + shift)
+        self.tracked += 1
+        return points, self._visibility
+
+    def stats(self):
+        frames = self.detections + self.tracked
+        return {
+            'detections': self.detections,
+            'tracked': self.tracked,
+            'lost': self.lost,
+            'detection_ratio': round(self.detections / frames, 3) if frames else 0.0,
+            'motion_px': round(self.motion, 2)
+        }
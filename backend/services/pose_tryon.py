@@ -2,12 +2,40 @@ import cv2
 import numpy as np
 from PIL import Image
 import mediapipe as mp
-import io
+from services.pose_pool import get_pose_pool
+from services.person_cache import get_person_cache
+from services.image_io import decode_person, decode_garment
+from services.metrics import stage_timer, timed
+
+PoseLandmark = mp.solutions.pose.PoseLandmark
+
+def clothing_region(landmarks, w, h):
+    """Clothing region (x1, y1, x2, y2) in a w x h image from pose landmarks (normalized coordinates)"""
+    # Get body keypoints
+    left_shoulder = landmarks[PoseLandmark.LEFT_SHOULDER]
+    right_shoulder = landmarks[PoseLandmark.RIGHT_SHOULDER]
+    left_hip = landmarks[PoseLandmark.LEFT_HIP]
+    right_hip = landmarks[PoseLandmark.RIGHT_HIP]
+    
+    # Calculate clothing region
+    x1 = int(min(left_shoulder.x, right_shoulder.x) * w) - 40
+    x2 = int(max(left_shoulder.x, right_shoulder.x) * w) + 40
+    y1 = int(min(left_shoulder.y, right_shoulder.y) * h) - 20
+    y2 = int(max(left_hip.y, right_hip.y) * h) + 60
+    
+    # Ensure bounds
+    x1 = max(0, x1)
+    x2 = min(w, x2)
+    y1 = max(0, y1)
+    y2 = min(h, y2)
+    
+    return (x1, y1, x2, y2)
 
 class PoseTryOnService:
     def __init__(self):
         self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(
+        # Pose graphs are not thread-safe; each request checks one out of the shared pool
+        self.pose_pool = get_pose_pool(
             static_image_mode=True,
             model_complexity=2,
             enable_segmentation=True,
@@ -16,45 +44,61 @@ class PoseTryOnService:
     
     async def realistic_tryon(self, person_bytes, garment_bytes, product_info=None):
         """Realistic virtual try-on using MediaPipe pose detection"""
+        result, _ = self.tryon_or_fallback(person_bytes, garment_bytes)
+        return result
+    
+    def tryon_or_fallback(self, person_bytes, garment_bytes):
+        """(image, fell_back): the pose try-on, or the simple overlay if it failed.
+        
+        A fallback comes from a possibly temporary failure (model download,
+        MediaPipe error), so callers should not cache it as the real result.
+        """
+        # Decoded once; the fallback below reuses the same arrays
+        person_np = decode_person(person_bytes)
+        garment_np = decode_garment(garment_bytes)
+        
         try:
-            person_img = Image.open(io.BytesIO(person_bytes))
-            garment_img = Image.open(io.BytesIO(garment_bytes))
-            
-            person_np = np.array(person_img)
-            garment_np = np.array(garment_img)
-            
-            # Convert to RGB for MediaPipe
-            rgb_image = cv2.cvtColor(person_np, cv2.COLOR_RGB2BGR)
-            results = self.pose.process(rgb_image)
+            region = self.detect_clothing_region(person_np)
+            return self.render_tryon(person_np, garment_np, region), False
             
-            h, w = person_np.shape[:2]
-            result = person_np.copy()
+        except Exception as e:
+            print(f"Pose try-on failed: {e}")
+            return self._simple_overlay(person_np, garment_np), True
+    
+    def detect_clothing_region(self, person_np):
+        """Clothing region (x1, y1, x2, y2) from pose landmarks, or None if no pose was found.
+        
+        Depends only on the person image, so the result is cached per image and
+        later try-ons on the same photo skip detection.
+        """
+        return get_person_cache().get_or_compute(
+            person_np, 'pose_tryon.clothing_region',
+            lambda: self._detect_clothing_region(person_np)
+        )
+    
+    @timed('detection')
+    def _detect_clothing_region(self, person_np):
+        # Decoded images are already RGB, which is what MediaPipe expects
+        results = self.pose_pool.process(person_np)
+        
+        if not results.pose_landmarks:
+            return None
+        
+        h, w = person_np.shape[:2]
+        return clothing_region(results.pose_landmarks.landmark, w, h)
+    
+    def render_tryon(self, person_np, garment_np, region):
+        """Fit and blend the garment into the region returned by detect_clothing_region"""
+        h, w = person_np.shape[:2]
+        result = person_np.copy()
+        
+        if region is not None:
+            x1, y1, x2, y2 = region
+            clothing_w = x2 - x1
+            clothing_h = y2 - y1
             
-            if results.pose_landmarks:
-                landmarks = results.pose_landmarks.landmark
-                
-                # Get body keypoints
-                left_shoulder = landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER]
-                right_shoulder = landmarks[self.mp_pose.PoseLandmark.RIGHT_SHOULDER]
-                left_hip = landmarks[self.mp_pose.PoseLandmark.LEFT_HIP]
-                right_hip = landmarks[self.mp_pose.PoseLandmark.RIGHT_HIP]
-                
-                # Calculate clothing region
-                x1 = int(min(left_shoulder.x, right_shoulder.x) * w) - 40
-                x2 = int(max(left_shoulder.x, right_shoulder.x) * w) + 40
-                y1 = int(min(left_shoulder.y, right_shoulder.y) * h) - 20
-                y2 = int(max(left_hip.y, right_hip.y) * h) + 60
-                
-                # Ensure bounds
-                x1 = max(0, x1)
-                x2 = min(w, x2)
-                y1 = max(0, y1)
-                y2 = min(h, y2)
-                
-                clothing_w = x2 - x1
-                clothing_h = y2 - y1
-                
-                if clothing_w > 0 and clothing_h > 0:
+            if clothing_w > 0 and clothing_h > 0:
+                with stage_timer('garment_fit'):
                     # Resize garment to fit body
                     garment_fitted = cv2.resize(garment_np, (clothing_w, clothing_h))
                     
@@ -62,7 +106,8 @@ class PoseTryOnService:
                     mask = np.ones((clothing_h, clothing_w), dtype=np.float32)
                     mask = cv2.GaussianBlur(mask, (31, 31), 0)
                     mask_3d = np.stack([mask] * 3, axis=-1)
-                    
+                
+                with stage_timer('blend'):
                     # Get ROI and calculate lighting
                     roi = result[y1:y2, x1:x2]
                     roi_brightness = np.mean(cv2.cvtColor(roi, cv2.COLOR_RGB2GRAY)) / 255.0
@@ -83,9 +128,10 @@ class PoseTryOnService:
                         shadow_3d = np.stack([shadow_mask] * 3, axis=-1)
                         shadow_roi = shadow_roi * (1 - shadow_3d)
                         result[y1+shadow_offset:y2+shadow_offset, x1+shadow_offset:x2+shadow_offset] = shadow_roi.astype(np.uint8)
-            
-            else:
-                # Fallback: center overlay
+        
+        else:
+            # Fallback: center overlay
+            with stage_timer('blend'):
                 garment_resized = cv2.resize(garment_np, (w//3, h//2))
                 y_offset = h//4
                 x_offset = w//3
@@ -95,27 +141,19 @@ class PoseTryOnService:
                     roi = result[y_offset:y_offset+gh, x_offset:x_offset+gw]
                     blended = roi * 0.3 + garment_resized * 0.7
                     result[y_offset:y_offset+gh, x_offset:x_offset+gw] = blended
-            
-            # Add AI indicator
+        
+        # Add AI indicator
+        with stage_timer('overlay'):
             cv2.rectangle(result, (10, 10), (400, 70), (0, 0, 0), -1)
             cv2.putText(result, '🤖 AI Virtual Try-On - MediaPipe Pose', (15, 35), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
             cv2.putText(result, 'Real-time body detection & fitting', (15, 60), 
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            return Image.fromarray(result)
-            
-        except Exception as e:
-            print(f"Pose try-on failed: {e}")
-            return await self._simple_overlay(person_bytes, garment_bytes)
+        
+        return Image.fromarray(result)
     
-    async def _simple_overlay(self, person_bytes, garment_bytes):
+    def _simple_overlay(self, person_np, garment_np):
         """Simple overlay fallback"""
-        person_img = Image.open(io.BytesIO(person_bytes))
-        garment_img = Image.open(io.BytesIO(garment_bytes))
-        
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
         
         h, w = person_np.shape[:2]
         garment_resized = cv2.resize(garment_np, (w//3, h//2))
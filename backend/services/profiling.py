@@ -0,0 +1,398 @@
+"""Opt-in profiling of individual requests with cProfile and tracemalloc.
+
+A request is profiled when it carries the admin token (header
+`X-Profile-Token: <token>` or query `?profile=<token>`), or when it is picked
+by PROFILE_SAMPLE_RATE. Profiling runs where the work runs: the Flask
+engines profile the request thread, and main.py asks the executor to profile
+each task of the request in its worker (see services/executor.py). The
+merged result is stored under PROFILE_DIR:
+
+    <id>.pstats - cProfile statistics (python -m pstats <file>, snakeviz, ...)
+    <id>.json   - summary: wall and CPU time, peak traced memory, top functions, top allocations
+
+Responses of profiled requests carry `X-Profile-Id`. The stored profiles can
+be listed and downloaded with the same admin token (see add_flask_profiling
+and main.py). Only one capture runs at a time per process, because
+tracemalloc is process-wide. A request sampled while another capture is
+running is served normally without a profile.
+
+Configuration (environment variables):
+    PROFILE_ADMIN_TOKEN     - token that turns profiling on for a request and guards downloads (default: unset, off)
+    PROFILE_SAMPLE_RATE     - fraction of requests to profile without the token, e.g. 0.01 (default: 0)
+    PROFILE_DIR             - where profiles are kept (default: <tmp>/frenzy_vastra_profiles)
+    PROFILE_KEEP            - profiles kept before the oldest are deleted (default: 50)
+    PROFILE_TOP_ALLOCATIONS - allocation sites listed per profile (default: 25)
+"""
+import contextvars
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_QUERY = 'profile'
+
+# Functions listed in the JSON summary, by cumulative time
+TOP_FUNCTIONS = 30
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def admin_token_ok(value):
+    """True if `value` is the configured PROFILE_ADMIN_TOKEN"""
+    token = os.getenv('PROFILE_ADMIN_TOKEN', '')
+    return bool(token) and bool(value) and hmac.compare_digest(value.encode(), token.encode())
+
+
+def profiling_requested(token):
+    """Should this request be profiled? `token`: the header or query value, if any"""
+    if admin_token_ok(token):
+        return True
+    rate = _env_number('PROFILE_SAMPLE_RATE', 0.0, float)
+    return rate > 0 and random.random() < rate
+
+
+# Held while a capture runs: tracemalloc is process-wide and profilers don't nest well
+_capture_lock = threading.Lock()
+
+
+class Capture:
+    """cProfile + tracemalloc over the current thread between start() and stop()"""
+
+    def __init__(self, top_allocations=None):
+        self.top_allocations = top_allocations or _env_number('PROFILE_TOP_ALLOCATIONS', 25)
+        self.active = False
+        self._profiler = None
+
+    def start(self):
+        """Begin capturing; False (and nothing captured) when another capture is running"""
+        if not _capture_lock.acquire(blocking=False):
+            return False
+        self.active = True
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        return True
+
+    def stop(self):
+        """End the capture and return its data (picklable dict), or None if it never started"""
+        if not self.active:
+            return None
+        try:
+            self._profiler.disable()
+            cpu_ms = (time.thread_time() - self._cpu) * 1000
+            wall_ms = (time.perf_counter() - self._wall) * 1000
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            if self._started_tracing:
+                tracemalloc.stop()
+            allocations = [{
+                'where': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                'bytes': stat.size,
+                'count': stat.count
+            } for stat in snapshot.statistics('lineno')[:self.top_allocations]]
+
+            stats = pstats.Stats(self._profiler)
+            return {
+                'stats': stats.stats,
+                'wall_ms': round(wall_ms, 1),
+                'cpu_ms': round(cpu_ms, 1),
+                'peak_traced_bytes': peak,
+                'allocations': allocations
+            }
+        finally:
+            self.active = False
+            self._profiler = None
+            _capture_lock.release()
+
+
+def capture_profile(call):
+    """Run call() under a Capture; returns (result, capture data or None)"""
+    capture = Capture()
+    capture.start()
+    try:
+        result = call()
+    except BaseException:
+        capture.stop()
+        raise
+    return result, capture.stop()
+
+
+class ProfileSession:
+    """Profile of one request, merged from the captures of the work it ran"""
+
+    def __init__(self, engine, endpoint):
+        self.id = uuid.uuid4().hex
+        self.engine = engine
+        self.endpoint = endpoint
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        self._lock = threading.Lock()
+        self._captures = []
+
+    def add(self, data):
+        if data is not None:
+            with self._lock:
+                self._captures.append(data)
+
+    def captures(self):
+        with self._lock:
+            return list(self._captures)
+
+    def wall_ms(self):
+        return round((time.perf_counter() - self._wall) * 1000, 1)
+
+
+_session = contextvars.ContextVar('profile_session', default=None)
+
+
+@contextmanager
+def profile_scope(session):
+    token = _session.set(session)
+    try:
+        yield session
+    finally:
+        _session.reset(token)
+
+
+def current_profile():
+    """ProfileSession of the request being served, or None"""
+    return _session.get()
+
+
+def _merged_stats(captures):
+    merged = pstats.Stats()
+    for data in captures:
+        part = pstats.Stats()
+        part.stats = data['stats']
+        part.total_calls = sum(entry[1] for entry in data['stats'].values())
+        part.prim_calls = sum(entry[0] for entry in data['stats'].values())
+        part.total_tt = sum(entry[2] for entry in data['stats'].values())
+        merged.add(part)
+    return merged
+
+
+def _top_functions(stats, limit):
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        'function': f'{filename}:{line}({name})',
+        'calls': calls,
+        'total_ms': round(total * 1000, 2),
+        'cumulative_ms': round(cumulative * 1000, 2)
+    } for (filename, line, name), (_, calls, total, cumulative, _) in rows]
+
+
+def _merged_allocations(captures, limit):
+    sites = {}
+    for data in captures:
+        for allocation in data['allocations']:
+            site = sites.setdefault(allocation['where'], {'where': allocation['where'], 'bytes': 0, 'count': 0})
+            site['bytes'] += allocation['bytes']
+            site['count'] += allocation['count']
+    return sorted(sites.values(), key=lambda site: site['bytes'], reverse=True)[:limit]
+
+
+class ProfileStore:
+    """Profiles on disk, newest PROFILE_KEEP kept"""
+
+    def __init__(self, root=None, keep=None):
+        self.root = root or os.getenv('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'frenzy_vastra_profiles')
+        self.keep = max(1, keep or _env_number('PROFILE_KEEP', 50))
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, profile_id, ext):
+        if not _PROFILE_ID.match(profile_id):
+            raise KeyError(profile_id)
+        return os.path.join(self.root, f'{profile_id}.{ext}')
+
+    def save(self, session):
+        """Write a finished session; returns its summary, or None if nothing was captured"""
+        captures = session.captures()
+        if not captures:
+            return None
+        stats = _merged_stats(captures)
+        summary = {
+            'id': session.id,
+            'engine': session.engine,
+            'endpoint': session.endpoint,
+            'started_at': session.started,
+            'wall_ms': session.wall_ms(),
+            'cpu_ms': round(sum(data['cpu_ms'] for data in captures), 1),
+            'captures': len(captures),
+            'peak_traced_bytes': max(data['peak_traced_bytes'] for data in captures),
+            'top_functions': _top_functions(stats, TOP_FUNCTIONS),
+            'top_allocations': _merged_allocations(captures, _env_number('PROFILE_TOP_ALLOCATIONS', 25))
+        }
+        with self._lock:
+            stats.dump_stats(self._path(session.id, 'pstats'))
+            with open(self._path(session.id, 'json'), 'w') as f:
+                json.dump(summary, f, indent=1)
+            self._prune()
+        print(f"🔬 Stored profile {session.id} for {session.endpoint} ({summary['wall_ms']} ms)")
+        return summary
+
+    def _prune(self):
+        summaries = sorted(
+            (entry for entry in os.scandir(self.root) if entry.name.endswith('.json')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in summaries[:max(0, len(summaries) - self.keep)]:
+            profile_id = entry.name[:-len('.json')]
+            for ext in ('json', 'pstats'):
+                try:
+                    os.remove(os.path.join(self.root, f'{profile_id}.{ext}'))
+                except OSError:
+                    pass
+
+    def list(self):
+        """Summaries without the long lists, newest first"""
+        profiles = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.json'):
+                summary = self.summary(entry.name[:-len('.json')])
+                if summary is not None:
+                    profiles.append({key: value for key, value in summary.items()
+                                     if key not in ('top_functions', 'top_allocations')})
+        return sorted(profiles, key=lambda profile: profile['started_at'], reverse=True)
+
+    def summary(self, profile_id):
+        try:
+            with open(self._path(profile_id, 'json')) as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def pstats_path(self, profile_id):
+        try:
+            path = self._path(profile_id, 'pstats')
+        except KeyError:
+            return None
+        return path if os.path.exists(path) else None
+
+    def report(self, profile_id, limit=60):
+        """pstats text report sorted by cumulative time"""
+        path = self.pstats_path(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ProfileStore()
+    return _store
+
+
+def add_flask_profiling(app, engine, paths=('/api/virtual-tryon',)):
+    """Profile sampled POSTs to `paths` of a Flask app, and serve the stored profiles.
+
+    GET /api/profiles                -> stored profiles, newest first
+    GET /api/profiles/<id>           -> summary (top functions and allocations)
+    GET /api/profiles/<id>/pstats    -> binary pstats file
+    GET /api/profiles/<id>/report    -> text report by cumulative time
+    All four need the admin token.
+    """
+    from flask import Response, g, jsonify, request, send_file
+
+    @app.before_request
+    def start_profile():
+        if request.method != 'POST' or request.path not in paths:
+            return None
+        token = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY)
+        if not profiling_requested(token):
+            return None
+        capture = Capture()
+        if capture.start():
+            g.profile = (ProfileSession(engine, request.path), capture)
+        return None
+
+    @app.after_request
+    def profile_header(response):
+        profile = g.get('profile')
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile[0].id
+        return response
+
+    @app.teardown_request
+    def store_profile(exc=None):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            session, capture = profile
+            session.add(capture.stop())
+            get_profile_store().save(session)
+
+    def authorized():
+        return admin_token_ok(request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY))
+
+    @app.route('/api/profiles', methods=['GET'])
+    def list_profiles():
+        if not authorized():
+            return jsonify({'error': 'Admin token required'}), 403
+        return jsonify(get_profile_store().list())
+
+    @app.route('/api/profiles/<profile_id>', methods=['GET'])
+    def profile_summary(profile_id):
+        if not authorized():
+            return jsonify({'error': 'Admin token required'}), 403
+        summary = get_profile_store().summary(profile_id)
+        if summary is None:
+            return jsonify({'error': 'Unknown profile'}), 404
+        return jsonify(summary)
+
+    @app.route('/api/profiles/<profile_id>/pstats', methods=['GET'])
+    def profile_pstats(profile_id):
+        if not authorized():
+            return jsonify({'error': 'Admin token required'}), 403
+        path = get_profile_store().pstats_path(profile_id)
+        if path is None:
+            return jsonify({'error': 'Unknown profile'}), 404
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f'{profile_id}.pstats')
+
+    @app.route('/api/profiles/<profile_id>/report', methods=['GET'])
+    def profile_report(profile_id):
+        if not authorized():
+            return jsonify({'error': 'Admin token required'}), 403
+        report = get_profile_store().report(profile_id)
+        if report is None:
+            return jsonify({'error': 'Unknown profile'}), 404
+        return Response(report, mimetype='text/plain')
@@ -0,0 +1,91 @@
+"""Stage progress of a try-on job, for the /api/jobs/<id>/events stream.
+
+Engines call report_stage('detect_body') as they move between stages and
+report_preview(image) once the composite exists. Both are no-ops unless the
+code runs inside progress_scope(), which the job queue's workers open around
+each job, so synchronous requests pay nothing for them.
+"""
+import base64
+import contextvars
+import io
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+# Longest side of preview images; small enough to send inline as a data URL
+PREVIEW_MAX_SIDE = 256
+
+
+class ProgressReporter:
+    """Turns stage transitions into timed events passed to sink(event)"""
+
+    def __init__(self, sink, preview=False):
+        self.sink = sink
+        self.preview_enabled = preview
+        self.started = time.perf_counter()
+        self.stages = []
+        self._current = None
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def stage(self, name):
+        self._close_stage()
+        self._current = (name, time.perf_counter())
+        self.sink({'event': 'stage', 'stage': name, 'elapsed_ms': self._elapsed_ms()})
+
+    def preview(self, image):
+        if not self.preview_enabled:
+            return
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        preview = image.convert('RGB')
+        preview.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE), Image.BILINEAR)
+        buffer = io.BytesIO()
+        preview.save(buffer, format='JPEG', quality=70)
+        self.sink({
+            'event': 'preview',
+            'width': preview.width,
+            'height': preview.height,
+            'elapsed_ms': self._elapsed_ms(),
+            'data_url': 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+        })
+
+    def _close_stage(self):
+        if self._current is not None:
+            name, started = self._current
+            self.stages.append({'stage': name, 'ms': round((time.perf_counter() - started) * 1000, 1)})
+            self._current = None
+
+    def finish(self):
+        """Close the running stage and return [{stage, ms}, ...] in order"""
+        self._close_stage()
+        return self.stages
+
+
+_reporter = contextvars.ContextVar('progress_reporter', default=None)
+
+
+@contextmanager
+def progress_scope(reporter):
+    token = _reporter.set(reporter)
+    try:
+        yield reporter
+    finally:
+        _reporter.reset(token)
+
+
+def report_stage(name):
+    """Mark the start of stage `name` of the current job (no-op outside a job)"""
+    reporter = _reporter.get()
+    if reporter is not None:
+        reporter.stage(name)
+
+
+def report_preview(image):
+    """Send a low-res preview of a PIL image or RGB array, if the job asked for previews"""
+    reporter = _reporter.get()
+    if reporter is not None:
+        reporter.preview(image)
@@ -3,6 +3,7 @@ import pandas as pd
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 import json
+from services.metrics import timed
 
 class RecommendationEngine:
     def __init__(self):
@@ -35,6 +36,7 @@ class RecommendationEngine:
             }
         ]
     
+    @timed('recommendation')
     async def generate_recommendations(self, user_data):
         # Extract user preferences
         body_type = user_data.get('body_type', 'rectangle')
@@ -0,0 +1,205 @@
+"""Shared async HTTP client for remote model calls (Hugging Face inference API).
+
+Service coroutines used to call blocking `requests.post(..., timeout=30)`,
+which froze the event loop for the whole round trip. RemoteClient wraps one
+pooled httpx.AsyncClient: keep-alive connections are reused, each host gets a
+cap on concurrent requests, and every call has a hard deadline after which
+the request is cancelled and its connection released. Calls also respect the
+request's remote budget and the host's circuit breaker (services/resilience.py).
+
+Configuration (environment variables):
+    HF_INFERENCE_URL       - base URL of the inference API (default: https://api-inference.huggingface.co);
+                             point it at a local fake server for testing
+    HF_API_TOKEN           - bearer token sent to the inference API (default: hf_demo)
+    REMOTE_MAX_CONNECTIONS - pooled connections across all hosts (default: 32)
+    REMOTE_PER_HOST_LIMIT  - concurrent requests per host (default: 8)
+    REMOTE_CONNECT_TIMEOUT - seconds to establish a connection (default: 5)
+    REMOTE_TIMEOUT         - seconds for a whole request, including the body (default: 30)
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+import httpx
+
+from services.resilience import DeadlineExceeded, get_breaker, remote_timeout
+
+DEFAULT_HF_URL = 'https://api-inference.huggingface.co'
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        # Zero would mean no connections or an instant timeout
+        return cast(value) if cast(value) > 0 else default
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def hf_model_url(model):
+    """Inference endpoint of a Hugging Face model, under HF_INFERENCE_URL"""
+    base = os.getenv('HF_INFERENCE_URL', DEFAULT_HF_URL).rstrip('/')
+    return f"{base}/models/{model}"
+
+
+def hf_headers():
+    return {"Authorization": f"Bearer {os.getenv('HF_API_TOKEN', 'hf_demo')}"}
+
+
+class RemoteClient:
+    """Pooled async HTTP client with per-host concurrency limits and request deadlines.
+
+    Bound to the event loop it is first used on; use get_remote_client() to
+    get the one for the running loop.
+    """
+
+    def __init__(self, max_connections=None, per_host=None, connect_timeout=None, timeout=None, transport=None):
+        self.max_connections = max_connections or _env_number('REMOTE_MAX_CONNECTIONS', 32)
+        self.per_host = per_host or _env_number('REMOTE_PER_HOST_LIMIT', 8)
+        self.timeout = timeout or _env_number('REMOTE_TIMEOUT', 30.0, float)
+        connect_timeout = connect_timeout or _env_number('REMOTE_CONNECT_TIMEOUT', 5.0, float)
+
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(self.timeout, connect=connect_timeout),
+            transport=transport
+        )
+        self._host_slots = {}
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._timeouts = 0
+        self._in_flight = 0
+        self._waiting = 0
+        self._total_ms = 0.0
+
+    def _slot(self, host):
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.per_host)
+        return slot
+
+    async def post_json(self, url, payload, headers=None, timeout=None):
+        """POST payload as JSON and return the httpx.Response.
+
+        Waits for a free slot on the host, then gives the whole request
+        `timeout` seconds (REMOTE_TIMEOUT by default), or less if the request
+        budget has less left. Raises asyncio.TimeoutError / httpx.HTTPError,
+        DeadlineExceeded, or CircuitOpenError when the host's breaker is open;
+        cancelling the caller cancels the request.
+        """
+        return await self.request('POST', url, json=payload, headers=headers, timeout=timeout)
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        cap = self.timeout if timeout is None else timeout
+        # Cut to what is left of the request's budget; raises DeadlineExceeded when spent
+        deadline = remote_timeout(cap)
+        host = httpx.URL(url).host
+        breaker = get_breaker(host)
+        # Known-bad upstream: refuse instantly so the caller falls back
+        breaker.check()
+
+        started = time.perf_counter()
+        try:
+            # httpx timeouts are per phase (connect, each read); this bounds the whole call,
+            # including the wait for a free slot on the host
+            response = await asyncio.wait_for(self._send(host, method, url, **kwargs), deadline)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            if deadline < cap:
+                # Cut short by the request budget: says nothing about the upstream
+                breaker.record_abandoned()
+                raise DeadlineExceeded(f"{method} {url} ran out of request budget after {deadline:.1f}s")
+            breaker.record_failure(f"timeout after {deadline}s")
+            raise asyncio.TimeoutError(f"{method} {url} took longer than {deadline}s")
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            breaker.record_failure(e)
+            raise
+        except BaseException:
+            breaker.record_abandoned()
+            raise
+        finally:
+            with self._lock:
+                self._total_ms += (time.perf_counter() - started) * 1000
+
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            breaker.record_success()
+        return response
+
+    async def _send(self, host, method, url, **kwargs):
+        slot = self._slot(host)
+        with self._lock:
+            self._waiting += 1
+        try:
+            await slot.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        with self._lock:
+            self._in_flight += 1
+            self._requests += 1
+        try:
+            return await self._client.request(method, url, **kwargs)
+        finally:
+            slot.release()
+            with self._lock:
+                self._in_flight -= 1
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'errors': self._errors,
+                'timeouts': self._timeouts,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'avg_ms': round(self._total_ms / self._requests, 1) if self._requests else 0.0,
+                'per_host_limit': self.per_host,
+                'max_connections': self.max_connections
+            }
+
+
+# One client per event loop: httpx connections and semaphores can't cross loops
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def get_remote_client():
+    """Return the RemoteClient for the running event loop"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None:
+            client = _clients[loop] = RemoteClient()
+        return client
+
+
+async def close_remote_client():
+    """Close the running loop's client (call on shutdown)"""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def remote_client_stats():
+    with _clients_lock:
+        clients = list(_clients.values())
+    return [client.stats() for client in clients]
@@ -0,0 +1,216 @@
+"""Request deadlines and per-upstream circuit breakers for remote model calls.
+
+A request opens a deadline scope with its remote budget; every remote call
+made inside it (directly, in asyncio tasks, or in Flask's request thread)
+asks remote_timeout() for its timeout and gets at most what is left of the
+budget. Once the budget is spent, remote_timeout() raises DeadlineExceeded
+and the caller takes its local fallback straight away.
+
+Each upstream (Hugging Face Space, Replicate, inference API host) has a
+CircuitBreaker. After BREAKER_FAILURES consecutive failures it opens and
+calls are refused instantly with CircuitOpenError; after BREAKER_RESET
+seconds one trial call is let through, and its outcome closes or re-opens it.
+
+Configuration (environment variables):
+    BREAKER_FAILURES - consecutive failures that open a breaker (default: 5)
+    BREAKER_RESET    - seconds an open breaker waits before a trial call (default: 30)
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def remote_budget(name, default):
+    """Seconds of remote time a request gets, from env var `name`"""
+    return _env_number(name, default, float)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's remote budget is spent"""
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream's circuit breaker is open; the call was not made"""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+_deadline = contextvars.ContextVar('remote_deadline', default=None)
+
+
+@contextmanager
+def deadline_scope(seconds):
+    """Run the block with a remote budget of `seconds` (None: no deadline)"""
+    token = _deadline.set(Deadline(seconds) if seconds is not None else None)
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline():
+    return _deadline.get()
+
+
+def remote_timeout(cap):
+    """Timeout for one remote call: `cap` seconds, cut to the remaining budget.
+
+    Raises DeadlineExceeded when nothing is left.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return cap
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Remote budget of {deadline.seconds}s spent")
+    return min(cap, remaining) if cap is not None else remaining
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed -> open -> half-open -> closed)"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or max(1, _env_number('BREAKER_FAILURES', 5))
+        self.reset_timeout = reset_timeout if reset_timeout is not None else _env_number('BREAKER_RESET', 30, float)
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+        self._successes = 0
+        self._total_failures = 0
+        self._rejected = 0
+        self._opened = 0
+        self._last_error = None
+
+    def allow(self):
+        """True if a call may go out now (in half-open state, only one trial at a time)"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def check(self):
+        """allow(), raising CircuitOpenError instead of returning False"""
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+    def record_success(self):
+        with self._lock:
+            self._successes += 1
+            self._failures = 0
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._total_failures += 1
+            self._failures += 1
+            self._last_error = str(error) if error is not None else None
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """The call ended without telling us about the upstream (our budget ran out, cancelled)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    @contextmanager
+    def guard(self):
+        """check(), then record the block's outcome: an exception is a failure"""
+        self.check()
+        try:
+            yield self
+        except DeadlineExceeded:
+            # Our budget ran out, not the upstream's fault
+            self.record_abandoned()
+            raise
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            self.record_abandoned()
+            raise
+        else:
+            self.record_success()
+
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def stats(self):
+        state = self.state()
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_seconds': self.reset_timeout,
+                'successes': self._successes,
+                'failures': self._total_failures,
+                'rejected': self._rejected,
+                'times_opened': self._opened,
+                'last_error': self._last_error
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the process-wide circuit breaker for upstream `name`"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def breaker_stats():
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.stats() for name, breaker in breakers.items()}
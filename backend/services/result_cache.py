@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Disk entries end with a digest of their content, so a damaged file is a miss, not a broken image
+_DIGEST_SIZE = 16
+# Temp files this old were left by a write that never finished
+_STALE_TMP_SECONDS = 3600
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=_DIGEST_SIZE).digest()
+
+
+def _env_mb(name, default):
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default * 1024 * 1024
+    try:
+        return max(0, int(float(value) * 1024 * 1024))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid {name}={value!r}, using {default} MB")
+        return default * 1024 * 1024
+
+
+class TryOnResultCache:
+    """Content-addressed cache of encoded try-on results.
+
+    Two tiers: a bounded in-memory LRU and a size-capped directory on disk,
+    sharded as <dir>/<ab>/<cd>/<key>. Disk hits are promoted to memory. Disk
+    entries carry a checksum; corrupt ones are deleted and count as misses.
+
+    Configuration (environment variables):
+        TRYON_CACHE_MEMORY_MB - memory tier budget (default: 64, 0 disables)
+        TRYON_CACHE_DISK_MB   - disk tier budget (default: 1024, 0 disables)
+        TRYON_CACHE_DIR       - disk tier location (default: <tmp>/frenzy_vastra_tryon_cache)
+    """
+
+    def __init__(self, memory_bytes=None, disk_bytes=None, disk_dir=None):
+        self.memory_limit = _env_mb('TRYON_CACHE_MEMORY_MB', 64) if memory_bytes is None else memory_bytes
+        self.disk_limit = _env_mb('TRYON_CACHE_DISK_MB', 1024) if disk_bytes is None else disk_bytes
+        self.disk_dir = disk_dir or os.getenv('TRYON_CACHE_DIR') or os.path.join(
+            tempfile.gettempdir(), 'frenzy_vastra_tryon_cache'
+        )
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+
+        self._hits = {'memory': 0, 'disk': 0}
+        self._misses = 0
+        self._stores = 0
+        self._evictions = {'memory': 0, 'disk': 0}
+        self._corrupt = 0
+
+    @staticmethod
+    def make_key(person_bytes, garment, product_info=None, engine='', quality=None, **variant):
+        """Hash everything that determines the rendered result.
+
+        `garment` is either the garment image bytes or its URL. Extra keyword
+        arguments (e.g. the output format) become part of the key as well.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(hashlib.blake2b(person_bytes, digest_size=20).digest())
+
+        if isinstance(garment, (bytes, bytearray, memoryview)):
+            digest.update(b'garment-bytes:')
+            digest.update(hashlib.blake2b(garment, digest_size=20).digest())
+        else:
+            digest.update(b'garment-url:')
+            digest.update(str(garment).encode('utf-8'))
+
+        params = {
+            'product_info': product_info or {},
+            'engine': engine,
+            'quality': quality,
+            **variant
+        }
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return cached result bytes, or None on a miss"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._hits['memory'] += 1
+                return data
+
+        data = self._read_disk(key)
+
+        with self._lock:
+            if data is None:
+                self._misses += 1
+                return None
+            self._hits['disk'] += 1
+            self._remember(key, data)
+            return data
+
+    def put(self, key, data):
+        data = bytes(data)
+        with self._lock:
+            self._stores += 1
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def _remember(self, key, data):
+        # Caller holds self._lock
+        if len(data) > self.memory_limit:
+            return
+
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+
+        self._memory[key] = data
+        self._memory_size += len(data)
+
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self._evictions['memory'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key[2:4], key)
+
+    def _read_disk(self, key):
+        if not self.disk_limit:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored = f.read()
+        except OSError:
+            return None
+
+        data, digest = stored[:-_DIGEST_SIZE], stored[-_DIGEST_SIZE:]
+        if len(stored) <= _DIGEST_SIZE or _digest(data) != digest:
+            print(f"⚠️ Result cache entry {key} is corrupt, dropping it")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._corrupt += 1
+                if self._disk_size is not None:
+                    self._disk_size = max(0, self._disk_size - len(stored))
+            return None
+
+        try:
+            # Touch so eviction drops the least recently used entries first
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.disk_limit or len(data) + _DIGEST_SIZE > self.disk_limit:
+            return
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            existed = os.path.exists(path)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.write(_digest(data))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Result cache write failed: {e}")
+            return
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            elif not existed:
+                self._disk_size += len(data) + _DIGEST_SIZE
+            over_limit = self._disk_size > self.disk_limit
+
+        if over_limit:
+            self._evict_disk()
+
+    def _disk_entries(self):
+        entries = []
+        stale_before = time.time() - _STALE_TMP_SECONDS
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                    if name.startswith('.tmp-'):
+                        # In-progress writes are skipped; leftovers of crashed ones are removed
+                        if st.st_mtime < stale_before:
+                            os.remove(path)
+                        continue
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_disk_size(self):
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        # Trim to 90% of the cap so we don't rescan on every write
+        target = int(self.disk_limit * 0.9)
+        evicted = 0
+
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._disk_size = total
+            self._evictions['disk'] += evicted
+
+    def stats(self):
+        with self._lock:
+            hits = self._hits['memory'] + self._hits['disk']
+            lookups = hits + self._misses
+            return {
+                'hits': dict(self._hits),
+                'misses': self._misses,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'stores': self._stores,
+                'evictions': dict(self._evictions),
+                'corrupt': self._corrupt,
+                'memory': {
+                    'entries': len(self._memory),
+                    'bytes': self._memory_size,
+                    'limit_bytes': self.memory_limit
+                },
+                'disk': {
+                    'dir': self.disk_dir,
+                    'bytes': self._disk_size,
+                    'limit_bytes': self.disk_limit
+                }
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide try-on result cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TryOnResultCache()
+        return _cache
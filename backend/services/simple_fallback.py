@@ -1,15 +1,11 @@
 import cv2
-import numpy as np
 from PIL import Image
-import io
+from services.image_io import decode_person, decode_garment
 
 async def simple_fallback(person_bytes, garment_bytes):
     """Simple fallback when everything fails"""
-    person_img = Image.open(io.BytesIO(person_bytes))
-    garment_img = Image.open(io.BytesIO(garment_bytes))
-    
-    person_np = np.array(person_img)
-    garment_np = np.array(garment_img)
+    person_np = decode_person(person_bytes)
+    garment_np = decode_garment(garment_bytes)
     
     h, w = person_np.shape[:2]
     garment_resized = cv2.resize(garment_np, (w//3, h//2))
@@ -1,9 +1,10 @@
 import cv2
 import numpy as np
-from PIL import Image
-import io
 from sklearn.cluster import KMeans
 import colorsys
+from services.person_cache import get_person_cache
+from services.image_io import decode_rgb, ANALYSIS_MAX_SIDE
+from services.metrics import timed
 
 class StyleAnalyzer:
     def __init__(self):
@@ -11,9 +12,15 @@ class StyleAnalyzer:
         self.style_categories = ['casual', 'formal', 'sporty', 'bohemian', 'classic']
         
     async def analyze_image(self, image_bytes):
-        # Convert bytes to image
-        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        image_np = np.array(image)
+        # The analysis depends only on the photo, so repeat uploads skip KMeans
+        return get_person_cache().get_or_compute(
+            image_bytes, 'style_analyzer.analysis', lambda: self._analyze(image_bytes)
+        )
+    
+    @timed('style_analysis')
+    def _analyze(self, image_bytes):
+        # Decode straight to analysis size: the statistics don't need the full photo
+        image_np = decode_rgb(image_bytes, ANALYSIS_MAX_SIDE)
         
         # Perform analysis
         body_type = self._analyze_body_type(image_np)
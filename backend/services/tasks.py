@@ -0,0 +1,94 @@
+"""Picklable entry points for work dispatched through services.executor.
+
+Each worker process (or thread) builds its own service instances lazily, so
+nothing heavy is created until a task actually needs it.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+
+from services.image_encoding import encode_image
+from services.image_io import decode_person, decode_garment
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def _build_service(name):
+    if name == 'pose_tryon':
+        from services.pose_tryon import PoseTryOnService
+        return PoseTryOnService()
+    if name == 'style_analyzer':
+        from services.style_analyzer import StyleAnalyzer
+        return StyleAnalyzer()
+    if name == 'recommendation_engine':
+        from services.recommendation_engine import RecommendationEngine
+        return RecommendationEngine()
+    raise ValueError(f"Unknown service: {name}")
+
+
+def get_service(name):
+    """Return the per-process instance of a service, creating it on first use"""
+    service = _services.get(name)
+    if service is None:
+        with _services_lock:
+            service = _services.get(name)
+            if service is None:
+                service = _build_service(name)
+                _services[name] = service
+    return service
+
+
+def _run(coro):
+    # Service methods are coroutines; workers have no running loop of their own
+    return asyncio.run(coro)
+
+
+def pose_tryon_task(person_bytes, garment_bytes, product_info=None, fmt='jpeg', preset='compact'):
+    """Pose-based try-on as (encoded bytes, fell_back) (see services.image_encoding)"""
+    result_image, fell_back = get_service('pose_tryon').tryon_or_fallback(person_bytes, garment_bytes)
+    return encode_image(result_image, fmt, preset), fell_back
+
+
+# Decoded person images, so a batch of garments on one photo decodes it once per worker
+_persons = OrderedDict()
+_persons_lock = threading.Lock()
+_MAX_PERSONS = 2
+
+
+def _decoded_person(person_key, person_bytes):
+    with _persons_lock:
+        person_np = _persons.get(person_key)
+        if person_np is not None:
+            _persons.move_to_end(person_key)
+            return person_np
+
+    person_np = decode_person(person_bytes)
+    person_np.setflags(write=False)
+
+    with _persons_lock:
+        _persons[person_key] = person_np
+        while len(_persons) > _MAX_PERSONS:
+            _persons.popitem(last=False)
+    return person_np
+
+
+def pose_detect_task(person_key, person_bytes):
+    """Clothing region for a person image (see PoseTryOnService.detect_clothing_region)"""
+    return get_service('pose_tryon').detect_clothing_region(_decoded_person(person_key, person_bytes))
+
+
+def pose_render_task(person_key, person_bytes, garment_bytes, region, fmt='jpeg', preset='compact'):
+    """Render one garment into an already detected region, returned as encoded bytes"""
+    person_np = _decoded_person(person_key, person_bytes)
+    garment_np = decode_garment(garment_bytes)
+    result_image = get_service('pose_tryon').render_tryon(person_np, garment_np, region)
+    return encode_image(result_image, fmt, preset)
+
+
+def analyze_image_task(image_bytes):
+    return _run(get_service('style_analyzer').analyze_image(image_bytes))
+
+
+def recommendations_task(user_data):
+    return _run(get_service('recommendation_engine').generate_recommendations(user_data))
@@ -0,0 +1,164 @@
+"""Job API for the Flask try-on engines (see services/job_queue.py).
+
+POST /api/jobs takes the same request forms as /api/virtual-tryon, stores
+the upload and answers 202 with a job id straight away; the engine's
+render(upload, fmt, remote_budget) runs later on the queue's workers. Jobs
+are not tied to an HTTP request, so remote providers get JOB_REMOTE_BUDGET
+instead of the synchronous TRYON_REMOTE_BUDGET.
+
+    POST /api/jobs[?preview=1]      -> 202 {job_id, status_url, events_url, result_url}
+    GET  /api/jobs/<id>?wait=<s>    -> status; waits up to <s> seconds (max 30) for it to finish
+    GET  /api/jobs/<id>/events      -> Server-Sent Events: status, running, stage, preview, done/failed
+    GET  /api/jobs/<id>/result      -> the image when done, 202 while pending
+    GET  /api/jobs                  -> queue stats
+
+Each SSE event carries its index as `id:`, so a reconnecting EventSource
+resumes after Last-Event-ID. Preview events (a small JPEG data URL of the
+composite) are only produced for jobs submitted with ?preview=1.
+
+Configuration (environment variables):
+    JOB_REMOTE_BUDGET - seconds a job may spend on the remote model (default: 120)
+"""
+import json
+
+from flask import jsonify, request, Response
+
+from services.image_encoding import MIMETYPES, negotiate_format
+from services.job_queue import JobQueue, JobQueueFull, DONE, FAILED
+from services.metrics import REGISTRY, engine_scope, job_queue_families
+from services.resilience import remote_budget
+from services.tryon_request import TryOnUpload, TryOnRequestError, read_tryon_request
+
+JOB_REMOTE_BUDGET = remote_budget('JOB_REMOTE_BUDGET', 120)
+
+MAX_WAIT_SECONDS = 30
+
+# Comment line sent when a stream has been idle this long, so proxies keep it open
+KEEPALIVE_SECONDS = 15
+
+
+def tryon_job_queue(engine, render):
+    """JobQueue that runs render(upload, fmt, remote_budget) for stored try-on uploads"""
+
+    def handle(params, blobs):
+        upload = TryOnUpload(blobs['person'], params.get('garment_url'), blobs.get('garment'),
+                             params.get('product_info'), params.get('transport', 'json'))
+        fmt = params['format']
+        with engine_scope(engine):
+            return render(upload, fmt, JOB_REMOTE_BUDGET), MIMETYPES[fmt]
+
+    queue = JobQueue(engine, handle)
+    REGISTRY.register_collector(lambda: job_queue_families(queue.stats()))
+    return queue
+
+
+def _job_urls(job_id):
+    return {
+        'status_url': f'/api/jobs/{job_id}',
+        'events_url': f'/api/jobs/{job_id}/events',
+        'result_url': f'/api/jobs/{job_id}/result'
+    }
+
+
+def _sse(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def _event_stream(queue, job_id, after):
+    """SSE text for a job's events from index `after` until it finishes"""
+    status = queue.get(job_id)
+    yield _sse('status', {**status, **_job_urls(job_id)})
+    while True:
+        events, status = queue.events(job_id, after, KEEPALIVE_SECONDS)
+        for event in events:
+            yield _sse(event['event'], event, after)
+            after += 1
+        if status is None:
+            return
+        if status['status'] in (DONE, FAILED):
+            if not any(event['event'] in (DONE, FAILED) for event in events):
+                # Finished before this process started: no event list, only the stored status
+                yield _sse(status['status'], {'event': status['status'], **status})
+            return
+        if not events:
+            yield ': keep-alive\n\n'
+
+
+def add_job_routes(app, queue):
+    """Register the /api/jobs endpoints of `queue` on a Flask app"""
+
+    # Workers start with the first request served, not on import (Flask's reloader imports twice)
+    app.before_request(queue.start)
+
+    @app.route('/api/jobs', methods=['POST'])
+    def submit_job():
+        try:
+            upload = read_tryon_request(request)
+        except TryOnRequestError as e:
+            return jsonify({'error': str(e)}), 400
+
+        params = {
+            'garment_url': upload.garment_url,
+            'product_info': upload.product_info,
+            'transport': upload.transport,
+            'format': negotiate_format(request.headers.get('Accept')),
+            'preview': request.args.get('preview') in ('1', 'true')
+        }
+        try:
+            job_id = queue.submit(params, {'person': bytes(upload.person_bytes), 'garment': upload.garment_bytes})
+        except JobQueueFull as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+
+        print(f"📥 Queued try-on job {job_id}")
+        response = jsonify({'job_id': job_id, 'status': 'queued', **_job_urls(job_id)})
+        response.headers['Location'] = f'/api/jobs/{job_id}'
+        return response, 202
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        try:
+            wait = min(float(request.args.get('wait', 0)), MAX_WAIT_SECONDS)
+        except ValueError:
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+        status = queue.wait(job_id, wait) if wait > 0 else queue.get(job_id)
+        if status is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        return jsonify({**status, **_job_urls(job_id)})
+
+    @app.route('/api/jobs/<job_id>/events', methods=['GET'])
+    def job_events(job_id):
+        if queue.get(job_id) is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        try:
+            after = int(request.headers.get('Last-Event-ID', -1)) + 1
+        except ValueError:
+            after = 0
+        return Response(_event_stream(queue, job_id, after), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/api/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        status = queue.get(job_id)
+        if status is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        if status['status'] == FAILED:
+            return jsonify(status), 500
+        if status['status'] != DONE:
+            response = jsonify(status)
+            response.headers['Retry-After'] = '1'
+            return response, 202
+
+        result = queue.result(job_id)
+        if result is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        body, mimetype = result
+        return Response(body, mimetype=mimetype, headers={'Vary': 'Accept'})
+
+    @app.route('/api/jobs', methods=['GET'])
+    def job_stats():
+        return jsonify(queue.stats())
@@ -0,0 +1,155 @@
+"""Parsing of try-on requests for the Flask engines.
+
+Three request forms are accepted on /api/virtual-tryon:
+
+- multipart/form-data: `person_image` file, `garment_image` URL (or file),
+  `product_info` JSON string. The person photo arrives as raw bytes, spooled by
+  the form parser, and is read once.
+- raw binary (`image/*` or `application/octet-stream`): the body is the person
+  photo; `garment_image` and `product_info` come from the query string.
+- application/json (legacy): `person_image` as a base64 data URL.
+"""
+import base64
+import binascii
+import json
+
+from flask import Response
+
+from services.image_encoding import MIMETYPES
+
+
+class TryOnRequestError(ValueError):
+    """The request is missing a field or carries an undecodable one"""
+
+
+class TryOnUpload:
+    """Person bytes, garment reference and product info of one try-on request"""
+
+    def __init__(self, person_bytes, garment_url=None, garment_bytes=None, product_info=None, transport='json'):
+        self.person_bytes = person_bytes
+        self.garment_url = garment_url
+        self.garment_bytes = garment_bytes
+        self.product_info = product_info or {}
+        self.transport = transport
+
+    @property
+    def garment_ref(self):
+        """What identifies the garment for cache keys: uploaded bytes or the URL"""
+        return self.garment_bytes if self.garment_bytes is not None else self.garment_url
+
+
+def decode_data_url(value):
+    """Bytes of a base64 string, with or without a `data:...;base64,` prefix"""
+    if value.startswith('data:'):
+        value = value[value.find(',') + 1:]
+    try:
+        return base64.b64decode(value)
+    except (binascii.Error, ValueError) as e:
+        raise TryOnRequestError(f"Invalid base64 image: {e}")
+
+
+def _product_info(raw):
+    if not raw:
+        return {}
+    try:
+        product_info = json.loads(raw)
+    except ValueError:
+        raise TryOnRequestError("product_info must be a JSON object")
+    if not isinstance(product_info, dict):
+        raise TryOnRequestError("product_info must be a JSON object")
+    return product_info
+
+
+def _garment_field(value):
+    # JSON/multipart garments are URLs; anything else is an inline base64 image
+    if value.startswith('http://') or value.startswith('https://'):
+        return value, None
+    return None, decode_data_url(value)
+
+
+def _from_multipart(request):
+    person_file = request.files.get('person_image')
+    if person_file is None:
+        raise TryOnRequestError("Missing person_image file")
+    person_bytes = person_file.read()
+
+    garment_file = request.files.get('garment_image')
+    if garment_file is not None:
+        garment_url, garment_bytes = None, garment_file.read()
+    else:
+        garment_url, garment_bytes = _garment_field(request.form.get('garment_image', ''))
+
+    return TryOnUpload(person_bytes, garment_url, garment_bytes,
+                       _product_info(request.form.get('product_info')), 'multipart')
+
+
+def _read_body(stream, length):
+    # Read into one preallocated buffer instead of joining chunks (which holds the body twice)
+    if not length:
+        return stream.read()
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < length:
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    view.release()
+    if filled < length:
+        del buffer[filled:]
+    return buffer
+
+
+def _from_binary(request):
+    # No form parsing and no cached copy of the body
+    person_bytes = _read_body(request.stream, request.content_length)
+    garment_url, garment_bytes = _garment_field(request.args.get('garment_image', ''))
+    return TryOnUpload(person_bytes, garment_url, garment_bytes,
+                       _product_info(request.args.get('product_info')), 'binary')
+
+
+def _from_json(request):
+    data = request.get_json(silent=True)
+    if not data:
+        raise TryOnRequestError("No data received")
+    if not isinstance(data, dict):
+        raise TryOnRequestError("Request body must be a JSON object")
+
+    person_b64 = data.get('person_image')
+    if not person_b64:
+        raise TryOnRequestError("Missing person_image")
+    if not isinstance(person_b64, str):
+        raise TryOnRequestError("person_image must be a base64 string or data URL")
+
+    garment = data.get('garment_image') or ''
+    if not isinstance(garment, str):
+        raise TryOnRequestError("garment_image must be a URL, base64 string or data URL")
+    garment_url, garment_bytes = _garment_field(garment)
+
+    product_info = data.get('product_info') or {}
+    if not isinstance(product_info, dict):
+        raise TryOnRequestError("product_info must be a JSON object")
+    return TryOnUpload(decode_data_url(person_b64), garment_url, garment_bytes, product_info, 'json')
+
+
+def read_tryon_request(request):
+    """TryOnUpload from a Flask request in any of the accepted forms"""
+    mimetype = request.mimetype or ''
+    if mimetype == 'multipart/form-data':
+        upload = _from_multipart(request)
+    elif mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        upload = _from_binary(request)
+    else:
+        upload = _from_json(request)
+
+    if not upload.person_bytes:
+        raise TryOnRequestError("Empty person_image")
+    if upload.garment_url is None and not upload.garment_bytes:
+        raise TryOnRequestError("Missing garment_image")
+    return upload
+
+
+def image_response(body, fmt):
+    """Encoded result sent as-is from its buffer (no file wrapper, no extra copy)"""
+    return Response(body, mimetype=MIMETYPES[fmt], headers={'Vary': 'Accept'})
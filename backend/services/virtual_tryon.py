@@ -2,33 +2,34 @@ import cv2
 import numpy as np
 from PIL import Image
 import mediapipe as mp
-import io
+from services.pose_pool import get_pose_pool, compact_landmarks
+from services.person_cache import get_person_cache
+from services.image_io import decode_person, decode_garment
 
 class VirtualTryOnService:
     def __init__(self):
         self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(
+        # Pose graphs are not thread-safe; each request checks one out of the shared pool
+        self.pose_pool = get_pose_pool(
             static_image_mode=True,
             model_complexity=2,
             enable_segmentation=True,
             min_detection_confidence=0.5
         )
-        
+    
     async def process_tryon(self, person_bytes, garment_bytes, product_info=None):
-        # Convert bytes to images
-        person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-        garment_img = Image.open(io.BytesIO(garment_bytes)).convert('RGB')
-        
-        # Convert to numpy arrays
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
+        # Decode once into RGB arrays
+        person_np = decode_person(person_bytes)
+        garment_np = decode_garment(garment_bytes)
         
-        # Detect pose landmarks
-        results = self.pose.process(person_np)
+        # Detect pose landmarks (cached per person image)
+        landmarks = get_person_cache().get_or_compute(
+            person_np, 'virtual_tryon.pose_landmarks',
+            lambda: compact_landmarks(self.pose_pool.process(person_np))
+        )
         
-        if results.pose_landmarks:
+        if landmarks:
             # Get key points for clothing placement
-            landmarks = results.pose_landmarks.landmark
             
             # Calculate clothing region
             left_shoulder = landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER]
@@ -61,13 +62,10 @@ class VirtualTryOnService:
             return Image.fromarray(result)
         
         # Fallback: simple overlay
-        return self._simple_overlay(person_img, garment_img)
+        return self._simple_overlay(person_np, garment_np)
     
-    def _simple_overlay(self, person_img, garment_img):
+    def _simple_overlay(self, person_np, garment_np):
         # Simple center overlay as fallback
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
-        
         h, w = person_np.shape[:2]
         garment_resized = cv2.resize(garment_np, (w//3, h//2))
         
@@ -0,0 +1,85 @@
+"""Working-resolution helpers for the Flask engines.
+
+Phone photos arrive at 12-48 MP, but finding the shirt only needs a ~1 MP
+copy. Detection runs on a downscaled copy, its boxes and masks are mapped back
+to full resolution, and only the garment ROI is composited at full size.
+
+Configuration (environment variables):
+    TRYON_WORKING_MAX_SIDE - longest side of the detection copy (default: 1024, 0 disables)
+"""
+import functools
+import os
+
+import cv2
+import numpy as np
+
+
+def working_max_side():
+    value = os.getenv('TRYON_WORKING_MAX_SIDE', '1024')
+    try:
+        return max(0, int(value))
+    except ValueError:
+        print(f"⚠️ Ignoring invalid TRYON_WORKING_MAX_SIDE={value!r}, using 1024")
+        return 1024
+
+
+def downscale(image, max_side=None):
+    """(copy with longest side <= max_side, scale); the image itself when already small enough"""
+    max_side = working_max_side() if max_side is None else max_side
+    h, w = image.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return image, 1.0
+
+    scale = max_side / max(h, w)
+    # Floor the small size so mapped-back boxes never run past the full image
+    small_w, small_h = max(1, int(w * scale)), max(1, int(h * scale))
+    return cv2.resize(image, (small_w, small_h), interpolation=cv2.INTER_AREA), scale
+
+
+def scale_geometry(value, factor, small_shape, full_shape):
+    """Map a detection result from the small copy back to full resolution.
+
+    Integers are pixel coordinates/sizes and are scaled (floored); booleans,
+    floats (confidences, ratios) and strings are left alone. 2-D arrays the
+    size of the small copy are masks and are resized to the full frame.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value * factor)
+    if isinstance(value, np.ndarray):
+        if value.ndim == 2 and value.shape == tuple(small_shape[:2]):
+            interpolation = cv2.INTER_NEAREST if value.dtype == np.uint8 else cv2.INTER_LINEAR
+            return cv2.resize(value, (full_shape[1], full_shape[0]), interpolation=interpolation)
+        return value
+    if isinstance(value, dict):
+        return {k: scale_geometry(v, factor, small_shape, full_shape) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(scale_geometry(v, factor, small_shape, full_shape) for v in value)
+    return value
+
+
+def at_working_resolution(fn):
+    """Decorator for detection functions whose first argument is the person image"""
+    @functools.wraps(fn)
+    def wrapper(image, *args, **kwargs):
+        small, scale = downscale(image)
+        if scale == 1.0:
+            return fn(image, *args, **kwargs)
+        result = fn(small, *args, **kwargs)
+        return scale_geometry(result, 1.0 / scale, small.shape, image.shape)
+    return wrapper
+
+
+def build_mask(builder, w, h, *args, **kwargs):
+    """Run a smooth-mask builder(w, h, ...) at working size and stretch it to w x h"""
+    small_w, small_h = w, h
+    max_side = working_max_side()
+    if max_side and max(w, h) > max_side:
+        scale = max_side / max(w, h)
+        small_w, small_h = max(1, int(w * scale)), max(1, int(h * scale))
+
+    mask = builder(small_w, small_h, *args, **kwargs)
+    if (small_w, small_h) != (w, h):
+        mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_LINEAR)
+    return mask
@@ -1,90 +1,136 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
-import io
-import base64
-import requests
+from services.result_cache import get_result_cache
+from services.tryon_request import read_tryon_request, TryOnRequestError, image_response
+from services.image_encoding import negotiate_format, encode_image, variant_key
+from services.garment_fetcher import get_garment_fetcher
+from services.person_cache import cached_person_analysis
+from services.working_resolution import at_working_resolution
+from services.image_io import decode_person, decode_garment, ImageTooLargeError
+from services.admission import add_flask_admission
+from services.profiling import add_flask_profiling
+from services.metrics import add_flask_metrics, timed
+from services.tryon_jobs import tryon_job_queue, add_job_routes
+from services.progress import report_stage, report_preview
 
 app = Flask(__name__)
 CORS(app)
 
+# Request and per-stage metrics at GET /metrics
+add_flask_metrics(app, 'simple_backend')
+
+# Bounded concurrent try-ons: excess requests wait briefly, then get 429 + Retry-After
+add_flask_admission(app, 'simple_backend')
+
+# Opt-in cProfile/tracemalloc captures of sampled try-ons (admin token)
+add_flask_profiling(app, 'simple_backend')
+
+result_cache = get_result_cache()
+garment_fetcher = get_garment_fetcher()
+
 @app.route('/api/virtual-tryon', methods=['POST'])
 def virtual_tryon():
     try:
         print("🔄 Received virtual try-on request")
-        data = request.get_json()
-        
-        if not data:
-            print("❌ No JSON data received")
-            return jsonify({'error': 'No data received'}), 400
+        # JSON (base64), multipart or raw binary upload
+        upload = read_tryon_request(request)
+        print(f"📦 Upload: {upload.transport}, {len(upload.person_bytes)} bytes")
         
-        # Get images
-        person_b64 = data.get('person_image')
-        garment_url = data.get('garment_image')
-        product_info = data.get('product_info', {})
+        # Output format from the Accept header (JPEG unless WebP/AVIF is asked for)
+        fmt = negotiate_format(request.headers.get('Accept'))
         
-        print(f"📸 Processing: {product_info.get('name', 'Unknown Product')}")
-        print(f"🔗 Garment URL: {garment_url[:50]}...")
-        
-        # Convert person image
-        if person_b64.startswith('data:'):
-            person_b64 = person_b64.split(',')[1]
-        person_bytes = base64.b64decode(person_b64)
-        person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-        print(f"✅ Person image loaded: {person_img.size}")
-        
-        # Download garment image
-        print("⬇️ Downloading garment image...")
-        garment_response = requests.get(garment_url, timeout=10)
-        garment_img = Image.open(io.BytesIO(garment_response.content)).convert('RGB')
-        print(f"✅ Garment image loaded: {garment_img.size}")
-        
-        # Process virtual try-on
-        print("🎨 Starting virtual try-on processing...")
-        result = process_tryon(person_img, garment_img, product_info)
-        print(f"✅ Processing complete: {result.size}")
-        
-        # Return result
-        img_io = io.BytesIO()
-        result.save(img_io, 'JPEG', quality=90)
-        img_io.seek(0)
+        body = render_tryon(upload, fmt)
         
         print("📤 Sending result back to frontend")
-        return send_file(img_io, mimetype='image/jpeg')
+        return image_response(body, fmt)
         
+    except TryOnRequestError as e:
+        print(f"❌ Bad request: {e}")
+        return jsonify({'error': str(e)}), 400
+    except ImageTooLargeError as e:
+        print(f"❌ Image too large: {e}")
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print(f"❌ ERROR: {str(e)}")
         import traceback
         print(f"📋 Traceback: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
-def process_tryon(person_img, garment_img, product_info):
+def render_tryon(upload, fmt, budget=None):
+    """Encoded try-on result for an upload (no remote model here, so `budget` is unused)"""
+    person_bytes = upload.person_bytes
+    garment_url = upload.garment_url
+    product_info = upload.product_info
+    
+    print(f"📸 Processing: {product_info.get('name', 'Unknown Product')}")
+    if garment_url:
+        print(f"🔗 Garment URL: {garment_url[:50]}...")
+    
+    # Serve retries of the same photo + garment from the result cache
+    cache_key = result_cache.make_key(person_bytes, upload.garment_ref, product_info,
+                                      engine='simple_backend', **variant_key(fmt, 'standard'))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print("⚡ Result cache hit")
+        return cached
+    
+    report_stage('decode')
+    person_np = decode_person(person_bytes)
+    print(f"✅ Person image loaded: {person_np.shape}")
+    
+    # Download garment image
+    print("⬇️ Downloading garment image...")
+    report_stage('download_garment')
+    if upload.garment_bytes is not None:
+        garment_np = decode_garment(upload.garment_bytes)
+    else:
+        garment_np = garment_fetcher.fetch_image(garment_url)
+    print(f"✅ Garment image loaded: {garment_np.shape}")
+    
+    # Process virtual try-on
+    print("🎨 Starting virtual try-on processing...")
+    result = process_tryon(person_np, garment_np, product_info)
+    print(f"✅ Processing complete: {result.size}")
+    
+    report_stage('encode')
+    body = encode_image(result, fmt, 'standard')
+    result_cache.put(cache_key, body)
+    return body
+
+# POST /api/jobs: try-ons on the queue's workers, with stage events for progress UIs
+job_queue = tryon_job_queue('simple_backend', render_tryon)
+add_job_routes(app, job_queue)
+
+def process_tryon(person_np, garment_np, product_info):
+    """Try-on on decoded RGB arrays (see services.image_io); neither is modified"""
     try:
-        print("🔍 Converting images to numpy arrays...")
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
-        
         height, width = person_np.shape[:2]
         print(f"📐 Image dimensions: {width}x{height}")
         
         # Detect body region using skin detection
         print("👤 Detecting body region...")
+        report_stage('detect_body')
         body_region = detect_body_region(person_np)
         print(f"✅ Body detection: {body_region['detected']}")
         
         # Calculate garment placement based on product type
         print("📏 Calculating garment placement...")
+        report_stage('garment_placement')
         garment_area = calculate_garment_placement(body_region, product_info, width, height)
         print(f"📍 Garment area: {garment_area}")
         
         # Apply garment with realistic fitting
         print("🎨 Applying garment to body...")
+        report_stage('apply_garment')
         result = apply_garment_realistic(person_np, garment_np, garment_area, product_info)
+        report_preview(result)
         
         # Add processing info
         print("📝 Adding info overlay...")
+        report_stage('overlay')
         result_pil = Image.fromarray(result)
         result_pil = add_info_overlay(result_pil, product_info, body_region)
         
@@ -97,6 +143,9 @@ def process_tryon(person_img, garment_img, product_info):
         print(f"📋 Traceback: {traceback.format_exc()}")
         raise e
 
+@at_working_resolution
+@cached_person_analysis('simple_backend.body_region')
+@timed('detection')
 def detect_body_region(image):
     """Detect body region using skin tone detection"""
     height, width = image.shape[:2]
@@ -150,6 +199,7 @@ def detect_body_region(image):
         'detected': False
     }
 
+@timed('garment_fit')
 def calculate_garment_placement(body_region, product_info, width, height):
     """Calculate where to place garment based on body and product type"""
     product_type = product_info.get('subcategory', 'shirt').lower()
@@ -182,6 +232,7 @@ def calculate_garment_placement(body_region, product_info, width, height):
             'height': body_region['torso_height']
         }
 
+@timed('blend')
 def apply_garment_realistic(person_img, garment_img, garment_area, product_info):
     """Apply garment with realistic blending and fitting"""
     result = person_img.copy()
@@ -254,6 +305,7 @@ def apply_color_tint(image, color_hex):
     
     return image
 
+@timed('overlay')
 def add_info_overlay(image, product_info, body_region):
     """Add information overlay to result"""
     draw = ImageDraw.Draw(image)
@@ -1,92 +1,142 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
-import requests
-import io
-import base64
 from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
+from services.result_cache import get_result_cache
+from services.tryon_request import read_tryon_request, TryOnRequestError, image_response
+from services.image_encoding import negotiate_format, encode_image, variant_key
+from services.garment_fetcher import get_garment_fetcher
+from services.person_cache import cached_person_analysis
+from services.working_resolution import at_working_resolution
+from services.image_io import decode_person, decode_garment, ImageTooLargeError
+from services.admission import add_flask_admission
+from services.profiling import add_flask_profiling
+from services.metrics import add_flask_metrics, timed
+from services.garment_store import get_garment_store, white_background_matte
+from services.tryon_jobs import tryon_job_queue, add_job_routes
+from services.progress import report_stage, report_preview
 
 app = Flask(__name__)
 CORS(app)
 
+# Request and per-stage metrics at GET /metrics
+add_flask_metrics(app, 'simple_dramatic_tryon')
+
+# Bounded concurrent try-ons: excess requests wait briefly, then get 429 + Retry-After
+add_flask_admission(app, 'simple_dramatic_tryon')
+
+# Opt-in cProfile/tracemalloc captures of sampled try-ons (admin token)
+add_flask_profiling(app, 'simple_dramatic_tryon')
+
+result_cache = get_result_cache()
+garment_fetcher = get_garment_fetcher()
+garment_store = get_garment_store()
+
 @app.route('/api/virtual-tryon', methods=['POST'])
 def virtual_tryon():
     try:
         print("=== DRAMATIC VIRTUAL TRY-ON ===")
-        data = request.get_json()
-        
-        person_b64 = data['person_image']
-        garment_url = data['garment_image']
-        product_info = data['product_info']
-        
-        print(f"Processing: {product_info.get('name', 'Unknown Product')}")
+        upload = read_tryon_request(request)
         
-        # Convert person image
-        if person_b64.startswith('data:'):
-            person_b64 = person_b64.split(',')[1]
-        person_bytes = base64.b64decode(person_b64)
+        # Output format from the Accept header (JPEG unless WebP/AVIF is asked for)
+        fmt = negotiate_format(request.headers.get('Accept'))
         
-        # Download garment
-        print("Downloading garment...")
-        garment_response = requests.get(garment_url, timeout=10)
-        garment_bytes = garment_response.content
-        
-        # Create DRAMATIC result
-        result = create_super_dramatic_tryon(person_bytes, garment_bytes, product_info)
-        
-        # Save result
-        img_io = io.BytesIO()
-        result.save(img_io, 'JPEG', quality=95)
-        img_io.seek(0)
+        body = render_tryon(upload, fmt)
         
         print("=== DRAMATIC TRY-ON COMPLETE ===")
-        return send_file(img_io, mimetype='image/jpeg')
+        return image_response(body, fmt)
         
+    except TryOnRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print(f"ERROR: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def create_super_dramatic_tryon(person_bytes, garment_bytes, product_info):
+def render_tryon(upload, fmt, budget=None):
+    """Encoded try-on result for an upload (no remote model here, so `budget` is unused)"""
+    person_bytes = upload.person_bytes
+    garment_url = upload.garment_url
+    product_info = upload.product_info
+    
+    print(f"Processing: {product_info.get('name', 'Unknown Product')}")
+    
+    # Serve retries of the same photo + garment from the result cache
+    cache_key = result_cache.make_key(person_bytes, upload.garment_ref, product_info,
+                                      engine='simple_dramatic_tryon', **variant_key(fmt, 'high'))
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        print("Result cache hit")
+        return cached
+    
+    # Download garment
+    print("Downloading garment...")
+    report_stage('download_garment')
+    garment_bytes = upload.garment_bytes if upload.garment_bytes is not None else garment_fetcher.fetch_bytes(garment_url)
+    
+    # Precomputed matte for this catalog item (built once, then loaded by product id)
+    report_stage('garment_assets')
+    assets = garment_store.get_or_build(garment_store.asset_id_for(product_info, upload.garment_ref), garment_bytes)
+    
+    # Create DRAMATIC result
+    result = create_super_dramatic_tryon(person_bytes, garment_bytes, product_info, assets)
+    
+    report_stage('encode')
+    body = encode_image(result, fmt, 'high')
+    result_cache.put(cache_key, body)
+    return body
+
+# POST /api/jobs: try-ons on the queue's workers, with stage events for progress UIs
+job_queue = tryon_job_queue('simple_dramatic_tryon', render_tryon)
+add_job_routes(app, job_queue)
+
+def create_super_dramatic_tryon(person_bytes, garment_bytes, product_info, assets=None):
     """Create virtual try-on with comprehensive error handling"""
     
+    person_np = None
     try:
-        # Load images
-        person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-        garment_img = Image.open(io.BytesIO(garment_bytes)).convert('RGB')
-        
-        # Convert to numpy
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
+        # Decode once into RGB arrays
+        report_stage('decode')
+        person_np = decode_person(person_bytes)
+        if assets is not None:
+            garment_np = assets.rgb
+        else:
+            garment_np = decode_garment(garment_bytes)
         
         print(f"Person: {person_np.shape}, Garment: {garment_np.shape}")
         
         # Find the shirt area using color detection
+        report_stage('detect_body')
         shirt_region = detect_shirt_dramatically(person_np)
         
+        report_stage('apply_garment')
         if shirt_region:
             x, y, w, h = shirt_region
             print(f"Shirt detected at: {x}, {y}, {w}, {h}")
             
             # Validate coordinates
             if w > 0 and h > 0 and x >= 0 and y >= 0:
-                result = apply_dramatic_replacement(person_np, garment_np, x, y, w, h, product_info)
+                result = apply_dramatic_replacement(person_np, garment_np, x, y, w, h, product_info, assets)
             else:
                 print("Invalid coordinates, using fallback")
-                result = create_fallback_result(person_np, garment_np, product_info)
+                result = create_fallback_result(person_np, garment_np, product_info, assets)
         else:
             print("No shirt detected - using center placement")
-            result = create_fallback_result(person_np, garment_np, product_info)
+            result = create_fallback_result(person_np, garment_np, product_info, assets)
         
+        report_preview(result)
         return Image.fromarray(result)
         
     except Exception as e:
         print(f"Error in tryon processing: {e}")
-        # Return original image with error message
-        person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-        return add_error_message(person_img, str(e))
+        # Return original image with error message (without decoding it a second time)
+        if person_np is None:
+            raise
+        return add_error_message(Image.fromarray(person_np), str(e))
 
-def create_fallback_result(person_np, garment_np, product_info):
+def create_fallback_result(person_np, garment_np, product_info, assets=None):
     """Create fallback result when detection fails"""
     
     h, w = person_np.shape[:2]
@@ -98,7 +148,7 @@ def create_fallback_result(person_np, garment_np, product_info):
     w_shirt = max(1, min(w_shirt, w-x))
     h_shirt = max(1, min(h_shirt, h-y))
     
-    return apply_dramatic_replacement(person_np, garment_np, x, y, w_shirt, h_shirt, product_info)
+    return apply_dramatic_replacement(person_np, garment_np, x, y, w_shirt, h_shirt, product_info, assets)
 
 def add_error_message(image, error_msg):
     """Add error message to image"""
@@ -107,6 +157,9 @@ def add_error_message(image, error_msg):
     draw.text((50, 50), f"Error: {error_msg}", fill=(255, 0, 0))
     return image
 
+@at_working_resolution
+@cached_person_analysis('simple_dramatic_tryon.shirt_region')
+@timed('detection')
 def detect_shirt_dramatically(person_img):
     """Detect shirt area with maximum accuracy"""
     
@@ -145,7 +198,8 @@ def detect_shirt_dramatically(person_img):
     
     return None
 
-def apply_dramatic_replacement(person_img, garment_img, x, y, w, h, product_info):
+@timed('blend')
+def apply_dramatic_replacement(person_img, garment_img, x, y, w, h, product_info, assets=None):
     """Apply replacement with aggressive white background removal"""
     
     try:
@@ -156,11 +210,15 @@ def apply_dramatic_replacement(person_img, garment_img, x, y, w, h, product_info
             print(f"Invalid dimensions: w={w}, h={h}")
             return result
         
-        # Resize garment to fit
-        garment_resized = cv2.resize(garment_img, (w, h), interpolation=cv2.INTER_LANCZOS4)
-        
-        # REMOVE WHITE BACKGROUND from garment
-        garment_clean, garment_mask = remove_white_background(garment_resized)
+        if assets is not None:
+            # Precomputed matte: only resize, no per-request background removal
+            garment_clean = assets.resized('rgb', w, h)
+            garment_mask = assets.resized('alpha', w, h, cv2.INTER_LINEAR)
+        else:
+            # REMOVE WHITE BACKGROUND at the garment's own resolution, then resize to fit
+            garment_clean, garment_mask = remove_white_background(garment_img)
+            garment_clean = cv2.resize(garment_clean, (w, h), interpolation=cv2.INTER_LANCZOS4)
+            garment_mask = cv2.resize(garment_mask, (w, h), interpolation=cv2.INTER_LINEAR)
         
         # Enhance the clean garment
         garment_enhanced = enhance_garment_dramatically(garment_clean)
@@ -203,6 +261,7 @@ def apply_dramatic_replacement(person_img, garment_img, x, y, w, h, product_info
         print(f"Error in apply_dramatic_replacement: {e}")
         return person_img
 
+@timed('garment_fit')
 def enhance_garment_dramatically(garment):
     """Make garment as visible as possible"""
     
@@ -255,41 +314,14 @@ def remove_white_background(garment_img):
     
     print(f"Removing white background from garment shape: {garment_img.shape}")
     
-    # Method 1: RGB-based white detection (more aggressive)
-    # Detect pixels that are very close to white
-    white_threshold = 240  # Pixels above this in all channels are considered white
-    
-    # Create mask for white pixels
-    white_mask = np.all(garment_img >= white_threshold, axis=2)
-    
-    # Also detect light gray/off-white pixels
-    light_gray_threshold = 220
-    light_mask = np.all(garment_img >= light_gray_threshold, axis=2)
-    
-    # Combine masks
-    background_mask = np.logical_or(white_mask, light_mask)
-    
-    # Invert to get shirt areas
-    shirt_mask = np.logical_not(background_mask)
-    
-    # Convert to float
-    shirt_mask_float = shirt_mask.astype(np.float32)
-    
-    # Clean up the mask
-    kernel = np.ones((5,5), np.uint8)
-    shirt_mask_clean = cv2.morphologyEx((shirt_mask_float * 255).astype(np.uint8), cv2.MORPH_CLOSE, kernel)
-    shirt_mask_clean = cv2.morphologyEx(shirt_mask_clean, cv2.MORPH_OPEN, kernel)
-    
-    # Convert back to float
-    shirt_mask_float = shirt_mask_clean.astype(np.float32) / 255.0
-    
-    # Apply strong gaussian blur for smooth edges
-    shirt_mask_float = cv2.GaussianBlur(shirt_mask_float, (7, 7), 3)
+    # Same matte the garment asset store precomputes per catalog item
+    shirt_mask_float = white_background_matte(garment_img)
     
     print(f"Shirt mask created - non-zero pixels: {np.count_nonzero(shirt_mask_float)}")
     
     return garment_img, shirt_mask_float
 
+@timed('overlay')
 def add_clean_indicators(result, x, y, w, h, product_info):
     """Add clean, professional indicators"""
     
@@ -0,0 +1,235 @@
+"""Admission control: slots, FIFO handoff, timeouts, cancellation and the 429 responses"""
+import asyncio
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from services.admission import AdmissionController, AdmissionRejected, RateLimiter, add_flask_admission, get_admission
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.01)
+
+
+def start_waiter(controller, results, name, timeout=5):
+    def acquire():
+        try:
+            controller.acquire(timeout)
+            results.append(name)
+        except AdmissionRejected as e:
+            results.append(e)
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    return thread
+
+
+def test_full_controller_queues_then_rejects():
+    controller = AdmissionController('test', max_in_flight=1, max_queued=1, queue_timeout=5)
+    controller.acquire()
+    results = []
+    waiter = start_waiter(controller, results, 'queued')
+    wait_until(lambda: controller.stats()['queue_depth'] == 1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire()
+    assert rejected.value.retry_after >= 1
+
+    controller.release()
+    waiter.join(2)
+    assert results == ['queued']
+    stats = controller.stats()
+    assert stats['rejected_full'] == 1
+    assert stats['in_flight'] == 1
+
+
+def test_release_hands_the_slot_to_the_oldest_waiter():
+    controller = AdmissionController('test', max_in_flight=1, max_queued=4, queue_timeout=5)
+    controller.acquire()
+    results = []
+    threads = []
+    for name in ('first', 'second', 'third'):
+        threads.append(start_waiter(controller, results, name))
+        wait_until(lambda: controller.stats()['queue_depth'] == len(threads))
+
+    for expected in (['first'], ['first', 'second'], ['first', 'second', 'third']):
+        controller.release()
+        wait_until(lambda: len(results) == len(expected))
+        assert results == expected
+        # Handed over, never freed: a newcomer cannot overtake the queue
+        assert controller.stats()['in_flight'] == 1
+
+    controller.release()
+    for thread in threads:
+        thread.join(2)
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_waiter_times_out_and_leaves_the_queue():
+    controller = AdmissionController('test', max_in_flight=1, max_queued=4, queue_timeout=0.1)
+    controller.acquire()
+
+    with pytest.raises(AdmissionRejected):
+        controller.acquire()
+
+    stats = controller.stats()
+    assert stats['rejected_timeout'] == 1
+    assert stats['queue_depth'] == 0
+    controller.release()
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_retry_after_follows_service_time_and_queue_depth():
+    controller = AdmissionController('test', max_in_flight=2, max_queued=8, queue_timeout=5)
+    controller.acquire()
+    controller.release(held_seconds=4)
+
+    assert controller.retry_after() == 2
+    controller._waiters.extend([object()] * 3)
+    assert controller.retry_after() == 8
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    controller = AdmissionController('test', max_in_flight=1, max_queued=4, queue_timeout=5)
+
+    async def scenario():
+        await controller.acquire_async()
+        waiter = asyncio.ensure_future(controller.acquire_async())
+        await asyncio.sleep(0.01)
+        assert controller.stats()['queue_depth'] == 1
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.stats()['queue_depth'] == 0
+        controller.release()
+
+    asyncio.run(scenario())
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_cancelled_waiter_gives_back_a_slot_it_was_handed():
+    controller = AdmissionController('test', max_in_flight=1, max_queued=4, queue_timeout=5)
+
+    async def scenario():
+        await controller.acquire_async()
+        waiter = asyncio.ensure_future(controller.acquire_async())
+        await asyncio.sleep(0.01)
+
+        # The slot is handed over, but the waiter is cancelled before it resumes
+        controller.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(scenario())
+    stats = controller.stats()
+    assert stats['in_flight'] == 0
+    assert stats['queue_depth'] == 0
+
+
+def test_admit_async_releases_on_error():
+    controller = AdmissionController('test', max_in_flight=1, max_queued=0, queue_timeout=5)
+
+    async def failing_request():
+        async with controller.admit_async():
+            raise ValueError('render failed')
+
+    with pytest.raises(ValueError):
+        asyncio.run(failing_request())
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_rate_limiter_allows_a_burst_then_asks_to_wait():
+    limiter = RateLimiter(rate=10, burst=2)
+
+    assert limiter.check('1.2.3.4') == 0
+    assert limiter.check('1.2.3.4') == 0
+    assert limiter.check('1.2.3.4') == 1
+    # Buckets are per client
+    assert limiter.check('5.6.7.8') == 0
+
+    time.sleep(0.15)
+    assert limiter.check('1.2.3.4') == 0
+    assert limiter.stats()['rate_limited'] == 1
+
+
+def test_flask_rejection_is_429_with_retry_after():
+    controller = get_admission('test-flask', max_in_flight=1, max_queued=0, queue_timeout=5)
+    app = Flask(__name__)
+
+    @app.route('/api/virtual-tryon', methods=['POST'])
+    def virtual_tryon():
+        return 'ok'
+
+    add_flask_admission(app, 'test-flask')
+    client = app.test_client()
+
+    controller.acquire()
+    response = client.post('/api/virtual-tryon')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
+
+    controller.release()
+    assert client.post('/api/virtual-tryon').status_code == 200
+    assert controller.stats()['in_flight'] == 0
+
+
+def asgi_request(path):
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+             'root_path': '', 'headers': [], 'client': ('127.0.0.1', 5000), 'server': ('127.0.0.1', 8002)}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    return scope, receive
+
+
+async def ok_app(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'ok'})
+
+
+@pytest.fixture
+def fastapi_admission(monkeypatch):
+    main = pytest.importorskip('main')
+    controller = AdmissionController('test-asgi', max_in_flight=1, max_queued=0, queue_timeout=5)
+    monkeypatch.setattr(main, 'ADMISSION_PATHS', {'/api/virtual-tryon': controller})
+    return main.AdmissionControl(ok_app), controller
+
+
+def test_fastapi_rejection_is_429_with_retry_after(fastapi_admission):
+    middleware, controller = fastapi_admission
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    controller.acquire()
+    asyncio.run(middleware(*asgi_request('/api/virtual-tryon'), send))
+
+    start = sent[0]
+    assert start['status'] == 429
+    headers = dict(start['headers'])
+    assert int(headers[b'retry-after']) >= 1
+    controller.release()
+
+
+def test_fastapi_slot_is_released_when_the_client_disconnects(fastapi_admission):
+    middleware, controller = fastapi_admission
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            raise OSError('client went away')
+
+    with pytest.raises(OSError):
+        asyncio.run(middleware(*asgi_request('/api/virtual-tryon'), send))
+    assert controller.stats()['in_flight'] == 0
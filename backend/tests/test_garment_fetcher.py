@@ -0,0 +1,194 @@
+"""GarmentFetcher against a local HTTP stand-in for the garment CDN"""
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from PIL import Image
+
+from services.garment_fetcher import GarmentFetcher
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 48), (200, 40, 40)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+GARMENT = _jpeg()
+ETAG = '"garment-v1"'
+
+
+class GarmentServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), GarmentHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+    def count(self, path):
+        with self.lock:
+            return sum(1 for seen_path, _ in self.requests if seen_path == path)
+
+
+class GarmentHandler(BaseHTTPRequestHandler):
+    # /shirt.jpg: ETag, always revalidated; /slow.jpg: 200 after a delay;
+    # /slow-missing.jpg: 404 after a delay; anything else: 200 straight away
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, dict(self.headers)))
+
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        if self.path.endswith('missing.jpg'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path == '/shirt.jpg' and self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(GARMENT)))
+        self.send_header('Cache-Control', 'no-cache')
+        if self.path == '/shirt.jpg':
+            self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(GARMENT)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = GarmentServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    session = requests.Session()
+    session.headers['User-Agent'] = 'garment-fetcher-test'
+    fetcher = GarmentFetcher(timeout=5, session=session)
+    yield fetcher
+    session.close()
+
+
+def fetch_concurrently(fetcher, url, callers):
+    """fetch_bytes(url) from `callers` threads at once; returns (results, errors)"""
+    barrier = threading.Barrier(callers)
+    results, errors = [], []
+
+    def fetch():
+        barrier.wait()
+        try:
+            results.append(fetcher.fetch_bytes(url))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results, errors
+
+
+def test_uses_injected_session(server, fetcher):
+    fetcher.fetch_bytes(server.url('/slow.jpg'))
+
+    _, headers = server.requests[0]
+    assert headers['User-Agent'] == 'garment-fetcher-test'
+
+
+def test_stale_entry_is_revalidated_with_etag(server, fetcher):
+    url = server.url('/shirt.jpg')
+
+    first = fetcher.fetch_bytes(url)
+    second = fetcher.fetch_bytes(url)
+
+    assert first == second == GARMENT
+    (_, initial), (_, revalidation) = server.requests
+    assert 'If-None-Match' not in initial
+    assert revalidation['If-None-Match'] == ETAG
+    stats = fetcher.stats()
+    assert stats['misses'] == 1
+    assert stats['revalidated'] == 1
+    assert stats['refetched'] == 0
+
+
+def test_concurrent_fetches_share_one_download(server, fetcher):
+    results, errors = fetch_concurrently(fetcher, server.url('/slow.jpg'), 8)
+
+    assert errors == []
+    assert results == [GARMENT] * 8
+    assert server.count('/slow.jpg') == 1
+    assert fetcher.stats()['coalesced'] == 7
+
+
+def test_failed_download_reaches_every_waiter_and_is_not_cached(server, fetcher):
+    url = server.url('/slow-missing.jpg')
+
+    results, errors = fetch_concurrently(fetcher, url, 4)
+
+    assert results == []
+    assert len(errors) == 4
+    assert all(isinstance(e, requests.HTTPError) for e in errors)
+    assert server.count('/slow-missing.jpg') == 1
+    assert fetcher.stats()['entries'] == 0
+
+    # The failure is not remembered: the next request goes back to the server
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch_bytes(url)
+    assert server.count('/slow-missing.jpg') == 2
+
+
+def test_byte_budget_evicts_least_recently_used(server):
+    fetcher = GarmentFetcher(max_bytes=int(2.5 * len(GARMENT)), session=requests.Session())
+    for name in ('a', 'b', 'c'):
+        fetcher.fetch_bytes(server.url(f'/{name}.jpg'))
+
+    stats = fetcher.stats()
+    assert stats['entries'] == 2
+    assert stats['bytes'] == 2 * len(GARMENT)
+    assert stats['max_bytes'] == int(2.5 * len(GARMENT))
+    assert stats['evictions'] == 1
+
+
+def test_decoded_image_counts_against_the_budget(server):
+    decoded_size = 32 * 48 * 3
+    fetcher = GarmentFetcher(max_bytes=len(GARMENT) + decoded_size, session=requests.Session())
+
+    image = fetcher.fetch_image(server.url('/a.jpg'))
+    assert image.shape == (48, 32, 3)
+    assert fetcher.stats()['bytes'] == len(GARMENT) + decoded_size
+
+    # A second garment does not fit next to the decoded first one
+    fetcher.fetch_bytes(server.url('/b.jpg'))
+    stats = fetcher.stats()
+    assert stats['entries'] == 1
+    assert stats['bytes'] == len(GARMENT)
+
+
+def test_entry_larger_than_the_budget_is_not_kept(server):
+    fetcher = GarmentFetcher(max_bytes=len(GARMENT) - 1, session=requests.Session())
+
+    assert fetcher.fetch_bytes(server.url('/a.jpg')) == GARMENT
+    assert fetcher.stats()['entries'] == 0
+    assert fetcher.stats()['bytes'] == 0
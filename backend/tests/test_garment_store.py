@@ -0,0 +1,96 @@
+"""GarmentAssetStore persistence, with client-supplied product ids"""
+import io
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from services import garment_store as garment_store_module
+from services.garment_store import GarmentAssetStore
+
+
+def _jpeg(color=(200, 40, 40)):
+    # A few colour bands, so the dominant-colour clustering has something to find
+    image = Image.new('RGB', (40, 60), color)
+    image.paste((color[2], color[0], color[1]), (0, 20, 40, 40))
+    image.paste((255, 255, 255), (0, 40, 40, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+GARMENT = _jpeg()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return GarmentAssetStore(root=str(tmp_path / 'store'))
+
+
+def files_under(path):
+    return {os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names}
+
+
+@pytest.mark.parametrize('asset_id', ['..', '.', '../outside', '../../etc', '/tmp/absolute', 'a/../../b', '..\\..\\x'])
+def test_client_ids_cannot_leave_the_store(tmp_path, store, asset_id):
+    store.get_or_build(asset_id, GARMENT)
+
+    written = files_under(tmp_path)
+    assert written
+    assert all(path.startswith(store.root + os.sep) for path in written)
+    assert os.path.dirname(store._dir(asset_id)) == store.root
+
+
+def test_similar_ids_get_separate_directories(store):
+    assert store._dir('shirt/1') != store._dir('shirt_1')
+    assert store._dir('..') != store._dir('__')
+
+
+def test_assets_survive_a_restart(store):
+    built = store.get_or_build('shirt-1', GARMENT)
+
+    reloaded = GarmentAssetStore(root=store.root).get('shirt-1', built.meta['source_hash'])
+
+    assert reloaded is not None
+    assert reloaded.meta == built.meta
+    assert reloaded.rgb.shape == built.rgb.shape
+
+
+def test_new_garment_image_rebuilds_the_assets(store):
+    store.get_or_build('shirt-1', GARMENT)
+    rebuilt = store.get_or_build('shirt-1', _jpeg((20, 40, 200)))
+
+    assert store.stats()['builds'] == 2
+    assert rebuilt.meta['source_hash'] == store.get('shirt-1').meta['source_hash']
+
+
+def test_concurrent_misses_build_once(store, monkeypatch):
+    builds = []
+    compute = garment_store_module._compute_assets
+
+    def counting_compute(*args):
+        builds.append(args[0])
+        return compute(*args)
+
+    monkeypatch.setattr(garment_store_module, '_compute_assets', counting_compute)
+    barrier = threading.Barrier(6)
+
+    def build():
+        barrier.wait()
+        store.get_or_build('shirt-1', GARMENT)
+
+    threads = [threading.Thread(target=build) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert builds == ['shirt-1']
+
+
+def test_build_locks_do_not_grow_with_ids(store):
+    for index in range(200):
+        store.get_or_build(f'shirt-{index}', GARMENT)
+
+    assert len(store._build_locks) == garment_store_module.BUILD_LOCK_STRIPES
@@ -0,0 +1,216 @@
+"""JobQueue: claiming, failures, restart recovery, expiry and event replay"""
+import sqlite3
+import threading
+
+import pytest
+
+from services import job_queue as job_queue_module
+from services.job_queue import DONE, FAILED, MAX_ATTEMPTS, QUEUED, JobQueue, JobQueueFull
+from services.progress import report_stage
+
+
+def echo(params, blobs):
+    report_stage('decode')
+    report_stage('encode')
+    return blobs['person'][::-1], 'image/jpeg'
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(handler=echo, **kwargs):
+        kwargs.setdefault('workers', 1)
+        queue = JobQueue('test', handler, db_path=str(tmp_path / 'jobs.sqlite3'), **kwargs)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.shutdown()
+
+
+def test_job_runs_and_keeps_its_result_and_stages(make_queue):
+    queue = make_queue()
+
+    job_id = queue.submit({'engine': 'test'}, {'person': b'abc'})
+    status = queue.wait(job_id, 5)
+
+    assert status['status'] == DONE
+    assert queue.result(job_id) == (b'cba', 'image/jpeg')
+    assert [stage['stage'] for stage in status['stages']] == ['decode', 'encode']
+
+
+def test_jobs_are_claimed_oldest_first(make_queue):
+    order = []
+
+    def record(params, blobs):
+        order.append(params['n'])
+        return b'', 'image/jpeg'
+
+    queue = make_queue(record)
+    job_ids = [queue.submit({'n': n}, {}) for n in range(5)]
+    for job_id in job_ids:
+        queue.wait(job_id, 5)
+
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_full_queue_refuses_with_retry_after(make_queue):
+    release = threading.Event()
+    running = threading.Event()
+
+    def block(params, blobs):
+        running.set()
+        release.wait(5)
+        return b'', 'image/jpeg'
+
+    queue = make_queue(block, max_queued=1)
+    first = queue.submit({}, {})
+    running.wait(5)
+    queue.submit({}, {})
+
+    with pytest.raises(JobQueueFull) as refused:
+        queue.submit({}, {})
+    assert refused.value.retry_after > 0
+    assert queue.stats()['rejected'] == 1
+
+    release.set()
+    assert queue.wait(first, 5)['status'] == DONE
+
+
+def test_failed_job_keeps_the_worker_running(make_queue):
+    def handler(params, blobs):
+        if params.get('fail'):
+            raise ValueError('bad garment')
+        return b'ok', 'image/jpeg'
+
+    queue = make_queue(handler)
+    failed = queue.submit({'fail': True}, {})
+    succeeded = queue.submit({}, {})
+
+    assert queue.wait(failed, 5)['error'] == 'bad garment'
+    assert queue.wait(succeeded, 5)['status'] == DONE
+    assert queue.result(failed) is None
+
+
+def test_worker_survives_an_outcome_that_cannot_be_stored(make_queue):
+    def handler(params, blobs):
+        if params.get('unstorable'):
+            return b'body', {'not': 'a mimetype'}
+        return b'ok', 'image/jpeg'
+
+    queue = make_queue(handler)
+    broken = queue.submit({'unstorable': True}, {})
+    after = queue.submit({}, {})
+
+    status = queue.wait(broken, 5)
+    assert status['status'] == FAILED
+    assert 'Could not store' in status['error']
+    assert queue.wait(after, 5)['status'] == DONE
+    events, _ = queue.events(broken, 0, 0)
+    assert events[-1]['event'] == FAILED
+
+
+def mark_running(db_path, job_id, attempts):
+    # What a crash mid-job leaves behind
+    with sqlite3.connect(db_path) as db:
+        db.execute("UPDATE jobs SET status = 'running', attempts = ? WHERE id = ?", (attempts, job_id))
+
+
+def test_interrupted_job_is_retried_after_a_restart(make_queue):
+    crashed = make_queue()
+    # Submitted without starting workers, as if the process died before claiming it
+    crashed.start = lambda: None
+    job_id = crashed.submit({}, {'person': b'abc'})
+    mark_running(crashed.db_path, job_id, 1)
+
+    restarted = make_queue()
+    restarted.start()
+    status = restarted.wait(job_id, 5)
+
+    assert status['status'] == DONE
+    assert status['attempts'] == 2
+    assert restarted.result(job_id) == (b'cba', 'image/jpeg')
+
+
+def test_job_interrupted_too_often_is_failed(make_queue):
+    crashed = make_queue()
+    crashed.start = lambda: None
+    job_id = crashed.submit({}, {'person': b'abc'})
+    mark_running(crashed.db_path, job_id, MAX_ATTEMPTS)
+
+    restarted = make_queue()
+    restarted.start()
+    status = restarted.get(job_id)
+
+    assert status['status'] == FAILED
+    assert status['error'] == 'Interrupted too many times'
+
+
+def test_expired_jobs_are_purged_while_the_queue_is_busy(make_queue, monkeypatch):
+    monkeypatch.setattr(job_queue_module, 'PURGE_INTERVAL', 0)
+    seen = {}
+    queue = None
+
+    def handler(params, blobs):
+        if 'check' in params:
+            # This job was claimed from a non-empty queue: the old job must already be gone
+            seen['old'] = queue.get(params['check'])
+            seen['events'] = params['check'] in queue._events
+        return b'ok', 'image/jpeg'
+
+    queue = make_queue(handler, result_ttl=0.2)
+    old = queue.submit({}, {})
+    queue.wait(old, 5)
+    assert queue.get(old)['status'] == DONE
+
+    threading.Event().wait(0.3)
+    checker = queue.submit({'check': old}, {})
+    queue.wait(checker, 5)
+
+    assert seen == {'old': None, 'events': False}
+    assert queue.result(old) is None
+
+
+def test_events_resume_after_last_event_id(make_queue):
+    queue = make_queue()
+    job_id = queue.submit({}, {'person': b'abc'})
+    queue.wait(job_id, 5)
+
+    events, status = queue.events(job_id, 0, 0)
+    assert [event['event'] for event in events] == ['running', 'stage', 'stage', DONE]
+    assert status['status'] == DONE
+
+    # A reconnecting client that saw the first two events gets only the rest
+    resumed, _ = queue.events(job_id, 2, 0)
+    assert resumed == events[2:]
+
+
+def test_events_wait_for_the_next_event(make_queue):
+    release = threading.Event()
+
+    def block(params, blobs):
+        release.wait(5)
+        report_stage('encode')
+        return b'', 'image/jpeg'
+
+    queue = make_queue(block)
+    job_id = queue.submit({}, {})
+    first, _ = queue.events(job_id, 0, 5)
+    assert first[0]['event'] == 'running'
+
+    threading.Timer(0.1, release.set).start()
+    following, _ = queue.events(job_id, 1, 5)
+    assert following[0]['event'] == 'stage'
+
+
+def test_queued_job_reports_its_position(make_queue):
+    queue = make_queue()
+    queue.start = lambda: None
+    first = queue.submit({}, {})
+    second = queue.submit({}, {})
+
+    assert queue.get(first)['status'] == QUEUED
+    assert queue.get(first)['position'] == 0
+    assert queue.get(second)['position'] == 1
@@ -0,0 +1,146 @@
+"""PosePool checkout/return with a fake Pose factory (no MediaPipe graphs built)"""
+import threading
+import time
+
+import pytest
+
+from services.pose_pool import PosePool
+
+
+class FakePose:
+    def __init__(self):
+        self.closed = False
+
+    def process(self, image):
+        return image
+
+    def close(self):
+        self.closed = True
+
+
+class FakePosePool(PosePool):
+    """Builds FakePose instances; `factory` may sleep or raise instead"""
+
+    def __init__(self, factory=FakePose, **kwargs):
+        super().__init__(**kwargs)
+        self.factory = factory
+
+    def _create(self):
+        return self.factory()
+
+
+def test_instances_are_reused():
+    pool = FakePosePool(size=2)
+
+    first = pool.checkout()
+    pool.checkin(first)
+    second = pool.checkout()
+
+    assert second is first
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['hits'] == 1
+    assert stats['in_use'] == 1
+
+
+def test_checkout_times_out_when_the_pool_is_busy():
+    pool = FakePosePool(size=1)
+    pool.checkout()
+
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.1)
+
+    stats = pool.stats()
+    assert stats['waits'] == 1
+    assert stats['timeouts'] == 1
+
+
+def test_default_checkout_timeout_is_finite():
+    pool = FakePosePool(size=1, checkout_timeout=0.1)
+    pool.checkout()
+
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        pool.checkout()
+    assert time.perf_counter() - started < 2
+
+
+def test_waiter_builds_the_graph_when_another_build_fails():
+    # Thread A reserves the only slot and fails to build (offline model
+    # download); thread B, waiting for that slot, must build its own
+    building = threading.Event()
+    calls = []
+
+    def factory():
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            building.set()
+            time.sleep(0.2)
+            raise OSError('model download failed')
+        return FakePose()
+
+    pool = FakePosePool(factory=factory, size=1, checkout_timeout=10)
+    outcomes = {}
+
+    def checkout(name):
+        try:
+            outcomes[name] = pool.checkout()
+        except Exception as e:
+            outcomes[name] = e
+
+    first = threading.Thread(target=checkout, args=('a',), name='a')
+    first.start()
+    building.wait(2)
+    second = threading.Thread(target=checkout, args=('b',), name='b')
+    second.start()
+    first.join(3)
+    second.join(3)
+
+    assert not first.is_alive() and not second.is_alive()
+    assert isinstance(outcomes['a'], OSError)
+    assert isinstance(outcomes['b'], FakePose)
+    assert calls == ['a', 'b']
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['waits'] == 1
+
+
+def test_every_waiter_sees_the_error_when_builds_keep_failing():
+    def factory():
+        time.sleep(0.1)
+        raise OSError('model download failed')
+
+    pool = FakePosePool(factory=factory, size=1, checkout_timeout=10)
+    errors = []
+
+    def checkout():
+        try:
+            pool.checkout()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=checkout) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(3)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 3
+    assert all(isinstance(e, OSError) for e in errors)
+    assert pool.stats()['created'] == 0
+
+
+def test_close_releases_idle_and_returned_instances():
+    pool = FakePosePool(size=2)
+    idle = pool.checkout()
+    busy = pool.checkout()
+    pool.checkin(idle)
+
+    pool.close()
+    assert idle.closed and not busy.closed
+
+    pool.checkin(busy)
+    assert busy.closed
+    with pytest.raises(RuntimeError):
+        pool.checkout()
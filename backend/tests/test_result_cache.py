@@ -0,0 +1,147 @@
+"""TryOnResultCache keys, memory LRU and the sharded disk tier"""
+import os
+import time
+
+import pytest
+
+from services.result_cache import TryOnResultCache
+
+PERSON = b'person-photo'
+
+
+@pytest.fixture
+def disk_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+def disk_files(disk_dir):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(disk_dir) for name in names)
+
+
+def key(n):
+    return TryOnResultCache.make_key(PERSON, f'https://cdn.example/{n}.jpg', engine='test')
+
+
+def test_key_covers_every_input():
+    base = TryOnResultCache.make_key(PERSON, b'garment', {'id': 1}, engine='pose_tryon', fmt='jpeg')
+
+    assert base == TryOnResultCache.make_key(PERSON, b'garment', {'id': 1}, engine='pose_tryon', fmt='jpeg')
+    assert base != TryOnResultCache.make_key(b'other', b'garment', {'id': 1}, engine='pose_tryon', fmt='jpeg')
+    assert base != TryOnResultCache.make_key(PERSON, b'garment', {'id': 2}, engine='pose_tryon', fmt='jpeg')
+    assert base != TryOnResultCache.make_key(PERSON, b'garment', {'id': 1}, engine='pose_tryon.simulation', fmt='jpeg')
+    assert base != TryOnResultCache.make_key(PERSON, b'garment', {'id': 1}, engine='pose_tryon', fmt='webp')
+    # Garment bytes and a URL with the same text are different garments
+    assert TryOnResultCache.make_key(PERSON, b'x') != TryOnResultCache.make_key(PERSON, 'x')
+
+
+def test_memory_tier_evicts_least_recently_used(disk_dir):
+    cache = TryOnResultCache(memory_bytes=250, disk_bytes=0, disk_dir=disk_dir)
+    cache.put(key(1), b'a' * 100)
+    cache.put(key(2), b'b' * 100)
+    cache.get(key(1))
+    cache.put(key(3), b'c' * 100)
+
+    assert cache.get(key(1)) == b'a' * 100
+    assert cache.get(key(2)) is None
+    stats = cache.stats()
+    assert stats['memory']['bytes'] == 200
+    assert stats['evictions']['memory'] == 1
+
+
+def test_disk_entries_are_sharded_by_key(disk_dir):
+    cache = TryOnResultCache(memory_bytes=0, disk_bytes=10_000, disk_dir=disk_dir)
+    k = key(1)
+    cache.put(k, b'result')
+
+    assert disk_files(disk_dir) == [os.path.join(disk_dir, k[:2], k[2:4], k)]
+
+
+def test_disk_hit_after_restart_is_promoted_to_memory(disk_dir):
+    TryOnResultCache(disk_bytes=10_000, disk_dir=disk_dir).put(key(1), b'result')
+
+    cache = TryOnResultCache(disk_bytes=10_000, disk_dir=disk_dir)
+    assert cache.get(key(1)) == b'result'
+    assert cache.get(key(1)) == b'result'
+    assert cache.stats()['hits'] == {'memory': 1, 'disk': 1}
+
+
+def test_disk_tier_evicts_oldest_entries_down_to_90_percent(disk_dir):
+    cache = TryOnResultCache(memory_bytes=0, disk_bytes=1000, disk_dir=disk_dir)
+    for n in range(4):
+        cache.put(key(n), bytes(200))
+        # Distinct, increasing access times
+        path = cache._path(key(n))
+        os.utime(path, (time.time() - 100 + n, time.time() - 100 + n))
+
+    # Five entries (with their checksums) exceed 1000 bytes; the oldest goes
+    cache.put(key(4), bytes(200))
+
+    stats = cache.stats()
+    assert stats['disk']['bytes'] <= 900
+    assert stats['disk']['bytes'] == sum(os.path.getsize(path) for path in disk_files(disk_dir))
+    assert stats['evictions']['disk'] == 1
+    assert cache.get(key(0)) is None
+    assert all(cache.get(key(n)) == bytes(200) for n in range(1, 5))
+
+
+def test_reading_an_entry_keeps_it_from_eviction(disk_dir):
+    cache = TryOnResultCache(memory_bytes=0, disk_bytes=700, disk_dir=disk_dir)
+    for n in range(3):
+        cache.put(key(n), bytes(200))
+        os.utime(cache._path(key(n)), (time.time() - 100 + n, time.time() - 100 + n))
+
+    cache.get(key(0))
+    cache.put(key(3), bytes(200))
+
+    assert cache.get(key(0)) == bytes(200)
+    assert cache.get(key(1)) is None
+
+
+@pytest.mark.parametrize('damage', [
+    lambda data: b'',
+    lambda data: data[:10],
+    lambda data: data[:-1] + bytes([data[-1] ^ 1]),
+    lambda data: bytes([data[0] ^ 1]) + data[1:],
+])
+def test_corrupt_disk_entry_is_a_miss_and_is_removed(disk_dir, damage):
+    TryOnResultCache(disk_bytes=10_000, disk_dir=disk_dir).put(key(1), b'encoded result bytes')
+    path = TryOnResultCache(disk_dir=disk_dir)._path(key(1))
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(damage(data))
+
+    cache = TryOnResultCache(disk_bytes=10_000, disk_dir=disk_dir)
+    assert cache.get(key(1)) is None
+    assert not os.path.exists(path)
+    assert cache.stats()['corrupt'] == 1
+
+    # The next put repairs the entry
+    cache.put(key(1), b'encoded result bytes')
+    assert TryOnResultCache(disk_bytes=10_000, disk_dir=disk_dir).get(key(1)) == b'encoded result bytes'
+
+
+def test_stale_temp_files_are_removed_on_eviction(disk_dir):
+    cache = TryOnResultCache(memory_bytes=0, disk_bytes=500, disk_dir=disk_dir)
+    cache.put(key(0), bytes(100))
+    shard = os.path.dirname(cache._path(key(0)))
+    stale = os.path.join(shard, '.tmp-crashed')
+    fresh = os.path.join(shard, '.tmp-writing')
+    for path in (stale, fresh):
+        with open(path, 'wb') as f:
+            f.write(bytes(100))
+    os.utime(stale, (time.time() - 7200, time.time() - 7200))
+
+    for n in range(1, 6):
+        cache.put(key(n), bytes(100))
+
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+
+def test_oversized_results_skip_the_tiers(disk_dir):
+    cache = TryOnResultCache(memory_bytes=50, disk_bytes=50, disk_dir=disk_dir)
+    cache.put(key(1), bytes(100))
+
+    assert cache.get(key(1)) is None
+    assert disk_files(disk_dir) == []
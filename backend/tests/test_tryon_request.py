@@ -0,0 +1,49 @@
+"""Validation of JSON try-on requests: malformed fields are a TryOnRequestError (400), not a 500"""
+import base64
+
+import pytest
+from flask import Flask, jsonify, request
+
+from services.tryon_request import TryOnRequestError, read_tryon_request
+
+PERSON = 'data:image/jpeg;base64,' + base64.b64encode(b'person').decode('ascii')
+GARMENT_URL = 'https://example.com/garment.jpg'
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+
+    @app.route('/api/virtual-tryon', methods=['POST'])
+    def virtual_tryon():
+        try:
+            upload = read_tryon_request(request)
+        except TryOnRequestError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'person_bytes': len(upload.person_bytes), 'garment_url': upload.garment_url})
+
+    return app.test_client()
+
+
+def test_valid_json_request(client):
+    response = client.post('/api/virtual-tryon', json={
+        'person_image': PERSON, 'garment_image': GARMENT_URL, 'product_info': {'id': 'sku-1'}
+    })
+
+    assert response.status_code == 200
+    assert response.json == {'person_bytes': len(b'person'), 'garment_url': GARMENT_URL}
+
+
+@pytest.mark.parametrize('body, message', [
+    ({'person_image': 12345, 'garment_image': GARMENT_URL}, 'person_image'),
+    ({'person_image': {'data': PERSON}, 'garment_image': GARMENT_URL}, 'person_image'),
+    ({'person_image': [PERSON], 'garment_image': GARMENT_URL}, 'person_image'),
+    ({'person_image': PERSON, 'garment_image': 42}, 'garment_image'),
+    ({'person_image': PERSON, 'garment_image': GARMENT_URL, 'product_info': ['shirt']}, 'product_info'),
+    ([PERSON, GARMENT_URL], 'JSON object'),
+])
+def test_wrongly_typed_fields_are_rejected(client, body, message):
+    response = client.post('/api/virtual-tryon', json=body)
+
+    assert response.status_code == 400
+    assert message in response.json['error']
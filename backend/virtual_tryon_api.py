@@ -1,24 +1,44 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 import cv2
 import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
-import io
-import base64
-import requests
 from services.virtual_tryon import VirtualTryOnService
+from services.result_cache import get_result_cache
+from services.tryon_request import read_tryon_request, TryOnRequestError, image_response
+from services.image_encoding import negotiate_format, encode_image, variant_key
+from services.garment_fetcher import get_garment_fetcher
+from services.person_cache import cached_person_analysis
+from services.working_resolution import at_working_resolution
+from services.image_io import decode_person, decode_garment, ImageTooLargeError
+from services.admission import add_flask_admission
+from services.profiling import add_flask_profiling
+from services.metrics import add_flask_metrics, timed
+from services.tryon_jobs import tryon_job_queue, add_job_routes
+from services.progress import report_stage, report_preview
 import logging
 
 # Create Flask app
 app = Flask(__name__)
 CORS(app)
 
+# Request and per-stage metrics at GET /metrics
+add_flask_metrics(app, 'virtual_tryon_api')
+
+# Bounded concurrent try-ons: excess requests wait briefly, then get 429 + Retry-After
+add_flask_admission(app, 'virtual_tryon_api')
+
+# Opt-in cProfile/tracemalloc captures of sampled try-ons (admin token)
+add_flask_profiling(app, 'virtual_tryon_api')
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize service
 tryon_service = VirtualTryOnService()
+result_cache = get_result_cache()
+garment_fetcher = get_garment_fetcher()
 
 @app.route('/api/virtual-tryon', methods=['POST'])
 def process_virtual_tryon():
@@ -26,69 +46,85 @@ def process_virtual_tryon():
     Advanced Virtual Try-On API endpoint
     """
     try:
-        data = request.get_json()
-        
-        if not data or 'person_image' not in data or 'garment_image' not in data:
-            return jsonify({'error': 'Missing required images'}), 400
-        
-        person_image_data = data['person_image']
-        garment_image_data = data['garment_image']
-        product_info = data.get('product_info', {})
-        
-        logger.info(f"Processing virtual try-on for product: {product_info.get('name', 'Unknown')}")
-        
-        # Convert base64 to bytes
-        person_bytes = base64_to_bytes(person_image_data)
+        # JSON (base64), multipart or raw binary upload; garment as URL or image
+        upload = read_tryon_request(request)
         
-        # Handle garment image (could be URL or base64)
-        if garment_image_data.startswith('http'):
-            garment_bytes = download_image_bytes(garment_image_data)
-        else:
-            garment_bytes = base64_to_bytes(garment_image_data)
+        # Output format from the Accept header (JPEG unless WebP/AVIF is asked for)
+        fmt = negotiate_format(request.headers.get('Accept'))
         
-        # Process with enhanced AI
-        result_image = enhanced_virtual_tryon(person_bytes, garment_bytes, product_info)
-        
-        # Convert result to bytes
-        img_io = io.BytesIO()
-        result_image.save(img_io, 'JPEG', quality=90)
-        img_io.seek(0)
-        
-        return send_file(
-            img_io,
-            mimetype='image/jpeg',
-            as_attachment=False
-        )
+        return image_response(render_tryon(upload, fmt), fmt)
         
+    except TryOnRequestError as e:
+        return jsonify({'error': str(e)}), 400
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         logger.error(f"Virtual try-on error: {str(e)}")
         return jsonify({'error': f'Processing failed: {str(e)}'}), 500
 
+def render_tryon(upload, fmt, budget=None):
+    """Encoded try-on result for an upload (no remote model here, so `budget` is unused)"""
+    person_bytes = upload.person_bytes
+    garment_bytes = upload.garment_bytes
+    product_info = upload.product_info
+    
+    logger.info(f"Processing virtual try-on for product: {product_info.get('name', 'Unknown')} ({upload.transport} upload)")
+    
+    # Serve retries of the same photo + garment from the result cache
+    cache_key = result_cache.make_key(
+        person_bytes, upload.garment_ref,
+        product_info, engine='virtual_tryon_api', **variant_key(fmt, 'standard')
+    )
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Result cache hit")
+        return cached
+    
+    if garment_bytes is None:
+        report_stage('download_garment')
+        garment_bytes = download_image_bytes(upload.garment_url)
+    
+    # Process with enhanced AI
+    result_image = enhanced_virtual_tryon(person_bytes, garment_bytes, product_info)
+    
+    # Convert result to bytes
+    report_stage('encode')
+    body = encode_image(result_image, fmt, 'standard')
+    result_cache.put(cache_key, body)
+    return body
+
+# POST /api/jobs: try-ons on the queue's workers, with stage events for progress UIs
+job_queue = tryon_job_queue('virtual_tryon_api', render_tryon)
+add_job_routes(app, job_queue)
+
 def enhanced_virtual_tryon(person_bytes, garment_bytes, product_info):
     """
     Python-based virtual try-on with body detection
     """
+    person_np = None
     try:
-        # Load images
-        person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-        garment_img = Image.open(io.BytesIO(garment_bytes)).convert('RGB')
-        
-        person_np = np.array(person_img)
-        garment_np = np.array(garment_img)
+        # Decode once into RGB arrays
+        report_stage('decode')
+        person_np = decode_person(person_bytes)
+        garment_np = decode_garment(garment_bytes)
         
         logger.info(f"Processing: Person {person_np.shape}, Garment {garment_np.shape}")
         
         # Detect body landmarks
+        report_stage('detect_body')
         landmarks = detect_body_landmarks(person_np)
         
         # Calculate garment fit area
+        report_stage('apply_garment')
         product_type = product_info.get('subcategory', 'shirt')
         fit_area = calculate_garment_fit_area(landmarks, product_type, person_np.shape)
         
         # Apply garment to body
         result = apply_garment_to_body(person_np, garment_np, fit_area, product_info)
+        report_preview(result)
         
         # Add realistic effects
+        report_stage('overlay')
         result = add_realistic_lighting(result, fit_area, landmarks)
         result = add_processing_info(result, product_info, landmarks)
         
@@ -96,9 +132,13 @@ def enhanced_virtual_tryon(person_bytes, garment_bytes, product_info):
         
     except Exception as e:
         logger.error(f"Virtual try-on failed: {e}")
-        person_img = Image.open(io.BytesIO(person_bytes)).convert('RGB')
-        return add_error_overlay(person_img, str(e))
+        if person_np is None:
+            raise
+        return add_error_overlay(Image.fromarray(person_np), str(e))
 
+@at_working_resolution
+@cached_person_analysis('virtual_tryon_api.body_mask')
+@timed('detection')
 def detect_body_landmarks(image):
     """
     Advanced body segmentation using multiple techniques
@@ -226,6 +266,7 @@ def create_default_body_mask(width, height):
     
     return mask
 
+@timed('garment_fit')
 def fit_garment_realistic(garment, body_mask, target_shape, product_info):
     """Fit garment realistically to body"""
     height, width = target_shape[:2]
@@ -292,6 +333,7 @@ def apply_color_tint(image, color_hex):
     
     return result.astype(np.uint8)
 
+@timed('blend')
 def realistic_blend(person, garment, mask):
     """Realistic blending with advanced techniques"""
     result = person.copy()
@@ -377,17 +419,9 @@ def enhance_final_result(image, product_info):
     
     return np.array(pil_image)
 
-def base64_to_bytes(base64_string):
-    """Convert base64 string to bytes"""
-    if base64_string.startswith('data:'):
-        base64_string = base64_string.split(',')[1]
-    return base64.b64decode(base64_string)
-
 def download_image_bytes(url):
-    """Download image from URL"""
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
-    return response.content
+    """Download image from URL (pooled, cached and revalidated by the shared fetcher)"""
+    return garment_fetcher.fetch_bytes(url)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=3001, debug=True)
\ No newline at end of file
@@ -29,6 +29,7 @@ export function useClothSwap() {
           person_image: personImageBase64,
           garment_image: garmentImageUrl,
           product_info: {
+            id: productData.id,
             name: productData.name,
             colorHex: productData.colorHex,
             subcategory: productData.subcategory,
@@ -314,7 +315,7 @@ export function useClothSwap() {
       // Try Python backend first
       try {
         console.log('🐍 Calling Python Backend...');
-        const result = await callPythonBackend(personImageBase64, selectedProduct);
+        const result = await callPythonBackend(imageFile, selectedProduct);
         console.log('✅ Python processing complete!');
         setResultImage(result);
         setIsProcessing(false);
@@ -398,24 +399,27 @@ export function useClothSwap() {
     });
   };
   
-  // Call Python backend API
-  const callPythonBackend = async (personImageBase64, selectedProduct) => {
+  // Call Python backend API (multipart: the photo is sent as-is, not as base64)
+  const callPythonBackend = async (imageFile, selectedProduct) => {
+    const formData = new FormData();
+    formData.append('person_image', imageFile);
+    formData.append('garment_image', selectedProduct.overlay_image_url);
+    formData.append('product_info', JSON.stringify({
+      id: selectedProduct.id,
+      name: selectedProduct.name,
+      category: selectedProduct.category,
+      subcategory: selectedProduct.subcategory,
+      colorHex: selectedProduct.colorHex,
+      color: selectedProduct.color
+    }));
+
     const response = await fetch('http://localhost:3001/api/virtual-tryon', {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json'
+        // Smaller results for browsers that decode them; the backend falls back to JPEG
+        'Accept': 'image/avif,image/webp,image/jpeg;q=0.9'
       },
-      body: JSON.stringify({
-        person_image: personImageBase64,
-        garment_image: selectedProduct.overlay_image_url,
-        product_info: {
-          name: selectedProduct.name,
-          category: selectedProduct.category,
-          subcategory: selectedProduct.subcategory,
-          colorHex: selectedProduct.colorHex,
-          color: selectedProduct.color
-        }
-      })
+      body: formData
     });
 
     if (!response.ok) {